@@ -1,3 +1,11 @@
+import datetime
+import json
+import mock
+
+from usage.utils import normalize_time
+from usage.utils import parse_datetime
+
+
 class FakeSummaryArgs:
     """Fake arguments object."""
     def __init__(self,
@@ -44,7 +52,28 @@ class FakeReportArgs:
                  log_level='log_level',
                  show_tags=False,
                  use_stdout=False,
-                 max_samples=10):
+                 max_samples=10,
+                 probe_concurrency=1,
+                 fetch_concurrency=1,
+                 strategy='bisect',
+                 histogram_period=3600,
+                 density_file=None,
+                 adaptive=False,
+                 min_samples=1000,
+                 target_latency=10.0,
+                 checkpoint_dir=None,
+                 retries=3,
+                 backoff=1.0,
+                 hedge=False,
+                 multi_meter=False,
+                 aggregate=False,
+                 approximate=False,
+                 approximate_period=3600,
+                 probe_boundaries=False,
+                 state_file=None,
+                 stream=False,
+                 epoch_timestamps=False,
+                 engine='python'):
         """Set up the fake argument object.
 
         :param mtd: Month to date
@@ -71,6 +100,48 @@ class FakeReportArgs:
         :type use_stdout: Bool
         :param max_samples: Max number of samples
         :type max_samples: Integer
+        :param probe_concurrency: Max number of concurrent count queries
+        :type probe_concurrency: Integer
+        :param fetch_concurrency: Max number of concurrent sample lists
+        :type fetch_concurrency: Integer
+        :param strategy: Query planning strategy
+        :type strategy: String
+        :param histogram_period: Histogram period in seconds
+        :type histogram_period: Integer
+        :param density_file: Sample density file
+        :type density_file: String
+        :param adaptive: Adaptive query sizing
+        :type adaptive: Bool
+        :param min_samples: Min number of samples when adaptive
+        :type min_samples: Integer
+        :param target_latency: Desired seconds per query when adaptive
+        :type target_latency: Float
+        :param checkpoint_dir: Checkpoint directory
+        :type checkpoint_dir: String
+        :param retries: Number of retries
+        :type retries: Integer
+        :param backoff: Seconds before the first retry
+        :type backoff: Float
+        :param hedge: Hedge slow queries
+        :type hedge: Bool
+        :param multi_meter: Fetch several meters at once
+        :type multi_meter: Bool
+        :param aggregate: Read from grouped statistics
+        :type aggregate: Bool
+        :param approximate: Approximate gauge readings
+        :type approximate: Bool
+        :param approximate_period: Approximate period in seconds
+        :type approximate_period: Integer
+        :param probe_boundaries: Probe existence outside the window
+        :type probe_boundaries: Bool
+        :param state_file: Boundary state file
+        :type state_file: String
+        :param stream: Stream sample lists
+        :type stream: Bool
+        :param epoch_timestamps: Keep timestamps as epoch microseconds
+        :type epoch_timestamps: Bool
+        :param engine: Reading engine
+        :type engine: String
         """
         self.mtd = mtd
         self.today = today
@@ -84,6 +155,27 @@ class FakeReportArgs:
         self.show_tags = show_tags
         self.use_stdout = use_stdout
         self.max_samples = max_samples
+        self.probe_concurrency = probe_concurrency
+        self.fetch_concurrency = fetch_concurrency
+        self.strategy = strategy
+        self.histogram_period = histogram_period
+        self.density_file = density_file
+        self.adaptive = adaptive
+        self.min_samples = min_samples
+        self.target_latency = target_latency
+        self.checkpoint_dir = checkpoint_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.multi_meter = multi_meter
+        self.aggregate = aggregate
+        self.approximate = approximate
+        self.approximate_period = approximate_period
+        self.probe_boundaries = probe_boundaries
+        self.state_file = state_file
+        self.stream = stream
+        self.epoch_timestamps = epoch_timestamps
+        self.engine = engine
 
 
 class FakeSample:
@@ -160,3 +252,231 @@ class FakeReading:
         self.project_id = project_id
         self.metadata = metadata or {}
         self.value = value
+        self.conversion = None
+
+    def convert(self, conversion):
+        """Remember the conversion.
+
+        :param conversion: Conversion function name
+        :type conversion: String|None
+        """
+        self.conversion = conversion
+
+
+class FakeStatistic:
+    """Fake statistic returned from the statistics api."""
+    def __init__(self, **kwargs):
+        """Set up the fake statistic.
+
+        :param kwargs: Attributes of the statistic.
+        :type kwargs: Dict
+        """
+        self.__dict__.update(kwargs)
+
+
+def _sample_matches(sample, q):
+    """Check whether a fake sample matches a list of query filters.
+
+    :param sample: Sample with an iso8601 string timestamp.
+    :type sample: FakeSample
+    :param q: List of query filters
+    :type q: List
+    :returns: Whether or not the sample matches
+    :rtype: Bool
+    """
+    ops = {
+        'gt': lambda a, b: a > b,
+        'ge': lambda a, b: a >= b,
+        'lt': lambda a, b: a < b,
+        'le': lambda a, b: a <= b,
+        'eq': lambda a, b: a == b
+    }
+    for f in q or []:
+        if f['field'] == 'timestamp':
+            value = normalize_time(parse_datetime(sample.timestamp))
+        else:
+            value = getattr(sample, f['field'])
+        if not ops[f['op']](value, f['value']):
+            return False
+    return True
+
+
+def _complex_matches(sample, expression):
+    """Check whether a fake sample matches a complex query filter.
+
+    :param sample: Sample with an iso8601 string timestamp.
+    :type sample: FakeSample
+    :param expression: Complex query filter
+    :type expression: Dict
+    :returns: Whether or not the sample matches
+    :rtype: Bool
+    """
+    ops = {
+        '>': lambda a, b: a > b,
+        '>=': lambda a, b: a >= b,
+        '<': lambda a, b: a < b,
+        '<=': lambda a, b: a <= b,
+        '=': lambda a, b: a == b,
+        'in': lambda a, b: a in b
+    }
+    op, operand = expression.items()[0]
+    if op == 'and':
+        return all(_complex_matches(sample, e) for e in operand)
+    if op == 'or':
+        return any(_complex_matches(sample, e) for e in operand)
+    field, value = operand.items()[0]
+    if field.startswith('resource_metadata.'):
+        key = field[len('resource_metadata.'):]
+        actual = sample.resource_metadata.get(key)
+    else:
+        actual = getattr(sample, field)
+    if field == 'timestamp':
+        actual = normalize_time(parse_datetime(actual))
+        value = normalize_time(parse_datetime(value))
+    return ops[op](actual, value)
+
+
+class FakeQuerySample:
+    """Fake sample returned from the complex query api."""
+    def __init__(self, sample):
+        """Set up the fake query sample from a fake sample.
+
+        :param sample: Fake sample
+        :type sample: FakeSample
+        """
+        self.id = sample.message_id
+        self.resource_id = sample.resource_id
+        self.project_id = sample.project_id
+        self.meter = sample.meter
+        self.type = sample.counter_type
+        self.volume = sample.counter_volume
+        self.timestamp = sample.timestamp
+        self.metadata = sample.resource_metadata
+
+
+def _period_start(q):
+    """Get the start of the first period of a query.
+
+    Periods start at the lower timestamp bound of the query.
+    """
+    return [f['value'] for f in q if f['op'] in ('gt', 'ge')][0]
+
+
+def _bucket(sample, q, period):
+    """Get the index of the period a fake sample falls in."""
+    offset = normalize_time(parse_datetime(sample.timestamp)) - \
+        _period_start(q)
+    return int(offset.total_seconds()) // period
+
+
+def _period(q, period, bucket):
+    """Get the period attributes of a statistic."""
+    period_start = _period_start(q) + \
+        datetime.timedelta(seconds=bucket * period)
+    return {
+        'period': period,
+        'period_start': period_start.isoformat(),
+        'period_end': (
+            period_start + datetime.timedelta(seconds=period)
+        ).isoformat()
+    }
+
+
+def _fake_statistic(samples, **kwargs):
+    """Aggregate fake samples like the statistics api.
+
+    :param samples: Samples with iso8601 string timestamps.
+    :type samples: List
+    :param kwargs: Other attributes of the statistic
+    :type kwargs: Dict
+    :returns: Statistic
+    :rtype: FakeStatistic
+    """
+    volumes = [s.counter_volume for s in samples]
+    timestamps = sorted(
+        normalize_time(parse_datetime(s.timestamp)) for s in samples
+    )
+    return FakeStatistic(
+        count=len(samples),
+        min=min(volumes),
+        max=max(volumes),
+        sum=sum(volumes),
+        avg=float(sum(volumes)) / len(volumes),
+        duration_start=timestamps[0].isoformat(),
+        duration_end=timestamps[-1].isoformat(),
+        **kwargs
+    )
+
+
+class FakeClient:
+    """Fake ceilometer client backed by a list of samples."""
+    def __init__(self, samples=None):
+        """Set up the fake client.
+
+        :param samples: Samples with iso8601 string timestamps.
+        :type samples: List
+        """
+        self.stored_samples = samples or []
+        self.samples = mock.Mock()
+        self.samples.list.side_effect = self._list
+        self.statistics = mock.Mock()
+        self.statistics.list.side_effect = self._statistics
+        self.query_samples = mock.Mock()
+        self.query_samples.query.side_effect = self._query
+
+    def _filter(self, q):
+        """Filters stored samples."""
+        return [s for s in self.stored_samples if _sample_matches(s, q)]
+
+    def _list(self, meter_name=None, q=None, limit=None):
+        """Lists samples newest first like ceilometer."""
+        samples = sorted(
+            self._filter(q),
+            key=lambda s: parse_datetime(s.timestamp),
+            reverse=True
+        )
+        return samples[:limit]
+
+    def _query(self, filter=None, orderby=None, limit=None):
+        """Queries samples newest first like the complex query api."""
+        expression = json.loads(filter)
+        samples = sorted(
+            [
+                s for s in self.stored_samples
+                if _complex_matches(s, expression)
+            ],
+            key=lambda s: parse_datetime(s.timestamp),
+            reverse=True
+        )
+        return [FakeQuerySample(s) for s in samples[:limit]]
+
+    def _statistics(self, meter_name=None, q=None, aggregates=None,
+                    period=None, groupby=None):
+        """Counts samples, optionally per period like ceilometer."""
+        samples = self._filter(q)
+        if groupby:
+            groups = {}
+            for s in samples:
+                value = tuple(getattr(s, key) for key in groupby)
+                bucket = _bucket(s, q, period) if period else None
+                groups.setdefault((value, bucket), []).append(s)
+            stats = []
+            for (value, bucket), group in sorted(groups.items()):
+                kwargs = {'groupby': dict(zip(groupby, value))}
+                if period:
+                    kwargs.update(_period(q, period, bucket))
+                stats.append(_fake_statistic(group, **kwargs))
+            return stats
+        if not period:
+            if not samples:
+                return []
+            return [FakeStatistic(count=len(samples))]
+
+        counts = {}
+        for s in samples:
+            bucket = _bucket(s, q, period)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return [
+            FakeStatistic(count=count, **_period(q, period, bucket))
+            for bucket, count in sorted(counts.items())
+        ]
@@ -0,0 +1,59 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from fakes import FakeSample
+from usage.checkpoint import Checkpoint
+from usage.query import Chunk
+from usage.query import query
+
+start = datetime.datetime(2016, 7, 1)
+stop = datetime.datetime(2016, 7, 2)
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests the checkpoint."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_plan(self):
+        checkpoint = Checkpoint(self.directory, 'meter', start, stop, [])
+        self.assertEquals(None, checkpoint.load_plan())
+
+        q = [
+            query('project_id', 'eq', 'project'),
+            query('timestamp', 'gt', start, 'datetime'),
+            query('timestamp', 'le', stop, 'datetime')
+        ]
+        checkpoint.save_plan([Chunk(start, stop, q, 10)])
+        plan = checkpoint.load_plan()
+        self.assertEquals([(start, stop, q, 10, False, False)], plan)
+
+        # Different windows do not share checkpoints.
+        other = Checkpoint(self.directory, 'meter', start, start, [])
+        self.assertEquals(None, other.load_plan())
+
+    def test_chunk(self):
+        checkpoint = Checkpoint(self.directory, 'meter', start, stop, [])
+        self.assertEquals(None, checkpoint.load_chunk(0))
+
+        checkpoint.save_chunk(0, [FakeSample(
+            resource_id='a',
+            counter_volume=2,
+            timestamp=start.isoformat(),
+            resource_metadata={'status': 'active'}
+        )])
+        samples = checkpoint.load_chunk(0)
+        self.assertEquals(1, len(samples))
+        self.assertEquals('a', samples[0].resource_id)
+        self.assertEquals(2, samples[0].counter_volume)
+        self.assertEquals(start.isoformat(), samples[0].timestamp)
+        self.assertEquals({'status': 'active'}, samples[0].resource_metadata)
+
+        checkpoint.clear()
+        self.assertEquals(None, checkpoint.load_chunk(0))
@@ -0,0 +1,118 @@
+import datetime
+import unittest
+
+from fakes import FakeSample
+from usage import columnar
+from usage import utils
+from usage.exc import UnknownCounterTypeError
+from usage.reading import Reading
+from usage.sample import Sample
+
+now = datetime.datetime(2016, 7, 1, 12)
+one_hour_ago = now - datetime.timedelta(hours=1)
+three_hours_ago = now - datetime.timedelta(hours=3)
+
+
+def samples(meter_type):
+    """Samples of four resources within the window, newest first."""
+    minutes = [
+        ('a', 170, 1, 'active'), ('a', 150, 3, 'active'),
+        ('a', 120, 6, 'active'), ('a', 90, 10, 'deleted'),
+        ('b', 150, 5, None), ('b', 120, 7, None), ('b', 70, 8, None),
+        ('c', 100, 2, 'deleted'),
+        ('d', 61, 4, 'active')
+    ]
+    result = []
+    for resource_id, minute, volume, status in minutes:
+        metadata = {}
+        if status is not None:
+            metadata['status'] = status
+        result.append(FakeSample(
+            message_id='{}{}'.format(resource_id, minute),
+            resource_id=resource_id,
+            counter_type=meter_type,
+            counter_volume=volume,
+            timestamp=now - datetime.timedelta(minutes=minute),
+            resource_metadata=metadata
+        ))
+    return sorted(result, key=lambda s: s.timestamp, reverse=True)
+
+
+def columns(meter_type):
+    """Columns of the samples added in two batches."""
+    result = columnar.SampleColumns()
+    batch = []
+    for s in samples(meter_type):
+        s = Sample.from_resource(s)
+        s.timestamp = utils.to_epoch_micros(s.timestamp)
+        batch.append(s)
+    result.add_batch(batch[:4])
+    result.add_batch(batch[4:])
+    return result
+
+
+@unittest.skipIf(not columnar.available(), 'numpy is not installed')
+class TestSampleColumns(unittest.TestCase):
+    """Tests columnar readings match readings."""
+
+    def assertMatchesReadings(self, meter_type, before, after):
+        readings = list(columns(meter_type).readings(
+            three_hours_ago, one_hour_ago, before, after
+        ))
+        self.assertEquals(
+            ['a', 'b', 'c', 'd'], [r.resource_id for r in readings]
+        )
+        by_resource = {}
+        for s in sorted(samples(meter_type), key=lambda s: s.timestamp):
+            by_resource.setdefault(s.resource_id, []).append(s)
+        for r in readings:
+            expected = Reading(
+                by_resource[r.resource_id],
+                three_hours_ago,
+                one_hour_ago,
+                existed_before=r.resource_id in before,
+                existed_after=r.resource_id in after
+            )
+            self.assertAlmostEquals(expected.value, r.value)
+            self.assertEquals(expected.usage_start, r.usage_start)
+            self.assertEquals(expected.usage_stop, r.usage_stop)
+            self.assertEquals(expected.metadata, r.metadata)
+            self.assertEquals(expected.project_id, r.project_id)
+            self.assertEquals(expected.meter_name, r.meter_name)
+
+    def test_gauge(self):
+        self.assertMatchesReadings('gauge', set(), set())
+        self.assertMatchesReadings('gauge', set(['a', 'c']), set(['b', 'c']))
+
+    def test_cumulative(self):
+        self.assertMatchesReadings('cumulative', set(), set())
+
+    def test_delta(self):
+        self.assertMatchesReadings('delta', set(['a']), set())
+        readings = list(columns('delta').readings(
+            three_hours_ago, one_hour_ago, set(), set()
+        ))
+        self.assertTrue(isinstance(readings[0].value, (int, long)))
+
+    def test_metadata(self):
+        readings = list(columns('gauge').readings(
+            three_hours_ago, one_hour_ago, set(), set()
+        ))
+        # a was deleted last, c only has a deleted sample.
+        self.assertEquals({'status': 'active'}, readings[0].metadata)
+        self.assertEquals({}, readings[1].metadata)
+        self.assertEquals({'status': 'deleted'}, readings[2].metadata)
+
+    def test_unknown_type(self):
+        with self.assertRaises(UnknownCounterTypeError):
+            list(columns('unknown').readings(
+                three_hours_ago, one_hour_ago, set(), set()
+            ))
+
+    def test_empty(self):
+        self.assertEquals(
+            [],
+            list(columnar.SampleColumns().readings(
+                three_hours_ago, one_hour_ago, set(), set()
+            ))
+        )
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from usage.density import DensityModel
+
+
+class TestDensityModel(unittest.TestCase):
+    """Tests the density model."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'density.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_predict_unknown(self):
+        model = DensityModel(self.filename)
+        self.assertEquals(None, model.predict('meter?'))
+
+    def test_record(self):
+        model = DensityModel(self.filename)
+        model.record('meter?', 100, 3600)
+        self.assertEquals(100.0, model.predict('meter?'))
+
+        # Observations are smoothed with the previous density.
+        model.record('meter?', 200, 3600)
+        self.assertEquals(150.0, model.predict('meter?'))
+
+        # Densities persist between models.
+        self.assertEquals(150.0, DensityModel(self.filename).predict('meter?'))
+
+    def test_record_no_time(self):
+        model = DensityModel(self.filename)
+        model.record('meter?', 100, 0)
+        self.assertEquals(None, model.predict('meter?'))
+        self.assertFalse(os.path.exists(self.filename))
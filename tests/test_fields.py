@@ -4,6 +4,7 @@ import unittest
 
 from fakes import FakeReading
 from usage.fields import field_function
+from usage.fields import normalize_name
 from usage.fields.item import billing_entity
 from usage.fields.item import currency_code
 from usage.fields.item import description
@@ -23,6 +24,7 @@ from usage.fields.reading import hours
 from usage.fields.reading import image_metadata_field
 from usage.fields.reading import instance_type
 from usage.fields.reading import metadata_field
+from usage.fields.reading import metadata_keys
 from usage.fields.reading import payer_account_id
 from usage.fields.reading import project_id
 from usage.fields.reading import resource_id
@@ -56,6 +58,15 @@ class TestFieldFunction(unittest.TestCase):
         )
 
 
+class TestNormalizeName(unittest.TestCase):
+    """Tests normalizing field function names."""
+    def test_normalize_name(self):
+        self.assertEquals('usage_amount', normalize_name('Usage Amount'))
+        self.assertEquals(
+            'metadata:instance_type', normalize_name('metadata:instance.type')
+        )
+
+
 class TestMetadataField(unittest.TestCase):
     """Tests the metadata field function."""
 
@@ -132,6 +143,22 @@ class TestImageMetadataField(unittest.TestCase):
         assert(image_metadata_field(self.key, r) is None)
 
 
+class TestMetadataKeys(unittest.TestCase):
+    """Tests the metadata keys read by field functions."""
+
+    def test_metadata_keys(self):
+        self.assertEquals(
+            ['metadata.uai', 'properties.uai', 'metadata'],
+            metadata_keys('metadata:UAI')
+        )
+        self.assertEquals(
+            ['image_meta.os_distro'],
+            metadata_keys('image_metadata:os_distro')
+        )
+        self.assertEquals(['display_name'], metadata_keys('display_name'))
+        self.assertEquals(None, metadata_keys('custom_plugin'))
+
+
 class TestResourceId(unittest.TestCase):
     """Tests the resource_id field function."""
     def test_resource_id(self):
@@ -1,11 +1,22 @@
 import datetime
 import mock
+import os
+import shutil
+import socket
+import tempfile
 import unittest
 
+from fakes import FakeClient
 from fakes import FakeSample
+from usage import columnar
+from usage import utils
 from usage.exc import InvalidTimeRangeError
-from usage.meter import _cmp_sample
+from usage.exc import UnknownEngineError
+from usage.meter import EXTRA_TIME
 from usage.meter import Meter
+from usage.query import query
+from usage.sample import Sample
+from usage.state import BoundaryState
 
 now = datetime.datetime.utcnow()
 one_hour_ago = now - datetime.timedelta(hours=1)
@@ -13,6 +24,7 @@ two_hours_ago = now - datetime.timedelta(hours=2)
 three_hours_ago = now - datetime.timedelta(hours=3)
 four_hours_ago = now - datetime.timedelta(hours=4)
 five_hours_ago = now - datetime.timedelta(hours=5)
+one_second = datetime.timedelta(seconds=1)
 
 
 class FakeStatCount:
@@ -20,31 +32,6 @@ class FakeStatCount:
         self.__dict__.update(count=count)
 
 
-class TestCmpSample(unittest.TestCase):
-
-    def test_comparison(self):
-        """Tests the sample comparison function used to sort samples."""
-        # Test a.resource_id < b.resource_id
-        a = FakeSample(resource_id='a')
-        b = FakeSample('b')
-        self.assertTrue(_cmp_sample(a, b) < 0)
-
-        # Test b.resource_id < a.resource_id
-        self.assertTrue(_cmp_sample(b, a) > 0)
-
-        # Test a.resource_id = b.resource_id and a.timestamp = b.timestamp
-        b.resource_id = 'a'
-        self.assertEquals(_cmp_sample(a, b), 0)
-
-        # Test a.timestamp < b.timestamp
-        a.timestamp = 0
-        b.timestamp = 1
-        self.assertTrue(_cmp_sample(a, b) < 0)
-
-        # Test b.timestamp < a.timestamp
-        self.assertTrue(_cmp_sample(b, a) > 0)
-
-
 class TestMeter(unittest.TestCase):
 
     def test_init(self):
@@ -53,6 +40,20 @@ class TestMeter(unittest.TestCase):
         self.assertEquals(m.client, 'client')
         self.assertEquals(m.name, 'meter_name')
 
+    @mock.patch('usage.meter.columnar')
+    def test_init_engine(self, mock_columnar):
+        """Tests engine selection."""
+        with self.assertRaises(UnknownEngineError):
+            Meter('client', 'meter_name', engine='unknown')
+
+        mock_columnar.available.return_value = False
+        m = Meter('client', 'meter_name', engine='numpy')
+        self.assertEquals('python', m.engine)
+
+        mock_columnar.available.return_value = True
+        m = Meter('client', 'meter_name', engine='numpy')
+        self.assertEquals('numpy', m.engine)
+
     @mock.patch('usage.meter.Reading')
     def test_read(self, mock_reading):
         """Tests the read method."""
@@ -107,3 +108,502 @@ class TestMeter(unittest.TestCase):
             for j, sample in enumerate(samples):
                 self.assertEquals(expected_resource_ids[i], sample.resource_id)
                 self.assertEquals(expected_timestamps[j], sample.timestamp)
+
+    @mock.patch('usage.meter.Reading')
+    def test_read_filters(self, mock_reading):
+        """Tests filters reach the count and list queries."""
+        client = FakeClient([
+            FakeSample(project_id='a', timestamp=one_hour_ago.isoformat()),
+            FakeSample(project_id='b', timestamp=one_hour_ago.isoformat())
+        ])
+        m = Meter(client, 'meter_name')
+        project_filter = query('project_id', 'eq', 'a')
+        readings = list(
+            m.read(start=two_hours_ago, stop=now, q=[project_filter])
+        )
+        self.assertEquals(1, len(readings))
+        self.assertTrue(
+            project_filter in client.statistics.list.call_args[1]['q']
+        )
+        self.assertTrue(
+            project_filter in client.samples.list.call_args[1]['q']
+        )
+
+    @mock.patch('usage.meter.Reading')
+    def test_read_batches(self, mock_reading):
+        """Tests reading samples that were already fetched."""
+        samples = [
+            FakeSample(resource_id='a', timestamp=one_hour_ago.isoformat()),
+            FakeSample(resource_id='a', timestamp=two_hours_ago.isoformat())
+        ]
+        m = Meter(mock.Mock(), 'meter_name')
+        # Read twice since prefetched samples may be shared.
+        for _ in xrange(2):
+            readings = list(
+                m.read_batches([samples], start=three_hours_ago, stop=now)
+            )
+            self.assertEquals(1, len(readings))
+            args, kwargs = mock_reading.call_args
+            self.assertEquals(
+                [two_hours_ago, one_hour_ago], [s.timestamp for s in args[0]]
+            )
+        self.assertEquals(0, m.client.samples.list.call_count)
+
+    def test_aggregate(self):
+        """Tests readings from statistics match readings from samples."""
+        def samples(counter_type, constant=False):
+            minutes = [
+                ('a', 300, 1), ('a', 150, 3), ('a', 120, 6), ('a', 90, 10),
+                ('b', 150, 5), ('b', 120, 7), ('b', 30, 8), ('c', 100, 2)
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    counter_type=counter_type,
+                    counter_volume=1 if constant else volume,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat()
+                )
+                for resource_id, minute, volume in minutes
+            ]
+
+        cases = [
+            ('cumulative', False, 0),
+            ('delta', False, 0),
+            ('gauge', True, 0),
+            # Resources a and b have changing volumes. Both are read in one
+            # pass.
+            ('gauge', False, 1)
+        ]
+        for counter_type, constant, sample_reads in cases:
+            m = Meter(FakeClient(samples(counter_type, constant)), 'name')
+            expected = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+            m = Meter(FakeClient(samples(counter_type, constant)), 'name')
+            readings = m.aggregate(start=three_hours_ago, stop=one_hour_ago)
+            self.assertEquals(
+                1 + sample_reads, m.client.samples.list.call_count
+            )
+            self.assertEquals(3, len(expected))
+            self.assertEquals(len(expected), len(readings))
+            for e, r in zip(expected, readings):
+                for attr in ['resource_id', 'project_id', 'value',
+                             'usage_start', 'usage_stop']:
+                    self.assertEquals(getattr(e, attr), getattr(r, attr))
+
+        m = Meter(FakeClient(), 'meter_name')
+        self.assertEquals(
+            [], m.aggregate(start=three_hours_ago, stop=one_hour_ago)
+        )
+
+    def test_aggregate_metadata(self):
+        """Tests metadata of aggregated readings matches sample readings."""
+        def samples():
+            minutes = [
+                ('a', 150, 'active', 'small'), ('a', 120, 'active', 'large'),
+                ('b', 150, 'active', 'small'), ('b', 90, 'deleted', None),
+                ('c', 100, None, 'small')
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    meter='name',
+                    counter_type='cumulative',
+                    counter_volume=minute,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat(),
+                    resource_metadata={
+                        k: v for k, v in [
+                            ('status', status), ('instance_type', size)
+                        ] if v is not None
+                    }
+                )
+                for resource_id, minute, status, size in minutes
+            ]
+
+        m = Meter(FakeClient(samples()), 'name')
+        expected = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+        m = Meter(FakeClient(samples()), 'name')
+        readings = m.aggregate(
+            start=three_hours_ago, stop=one_hour_ago, metadata=True
+        )
+        self.assertEquals(3, len(readings))
+        for e, r in zip(expected, readings):
+            self.assertEquals(e.metadata, r.metadata)
+        self.assertEquals(
+            {'status': 'active', 'instance_type': 'small'},
+            readings[1].metadata
+        )
+        # One query for the last samples of every resource.
+        self.assertEquals(1, m.client.query_samples.query.call_count)
+        # One type request and one list of b's samples to skip its
+        # deleted status.
+        self.assertEquals(2, m.client.samples.list.call_count)
+        listed = m.client.samples.list.call_args_list[1][1]
+        self.assertEquals(m.max_samples, listed['limit'])
+        self.assertIn(query('resource_id', 'eq', 'b'), listed['q'])
+
+        # Last samples are queried in batches of resources.
+        m = Meter(FakeClient(samples()), 'name')
+        with mock.patch('usage.meter._METADATA_BATCH', 2):
+            batched = m.aggregate(
+                start=three_hours_ago, stop=one_hour_ago, metadata=True
+            )
+        self.assertEquals(2, m.client.query_samples.query.call_count)
+        self.assertEquals(
+            [r.metadata for r in readings], [r.metadata for r in batched]
+        )
+
+    def test_aggregate_retries(self):
+        """Tests statistics and type requests are retried."""
+        client = mock.Mock()
+        client.samples.list.side_effect = [
+            socket.error('reset'), [FakeSample(counter_type='delta')]
+        ]
+        client.statistics.list.side_effect = [socket.error('reset'), []]
+        m = Meter(
+            client,
+            'meter_name',
+            scheduler_options={'retries': 1, 'backoff': 0}
+        )
+        self.assertEquals('delta', m.meter_type([]))
+        self.assertEquals([], m._statistics([], ['resource_id']))
+        self.assertEquals(2, client.samples.list.call_count)
+        self.assertEquals(2, client.statistics.list.call_count)
+
+        client.samples.list.side_effect = Exception('failed')
+        m = Meter(client, 'meter_name')
+        with self.assertRaises(Exception):
+            m.meter_type([])
+
+    def test_aggregate_approximate(self):
+        """Tests approximate gauge readings bound the exact readings."""
+        def samples():
+            return [
+                FakeSample(
+                    message_id=str(i),
+                    counter_type='gauge',
+                    counter_volume=i % 5,
+                    timestamp=(
+                        five_hours_ago + datetime.timedelta(minutes=15 * i)
+                    ).isoformat()
+                )
+                for i in xrange(1, 16)
+            ]
+
+        m = Meter(FakeClient(samples()), 'meter_name')
+        expected = list(m.read(start=four_hours_ago, stop=one_hour_ago))[0]
+        m = Meter(FakeClient(samples()), 'meter_name')
+        readings = m.aggregate(
+            start=four_hours_ago, stop=one_hour_ago, period=3600
+        )
+        self.assertEquals(1, len(readings))
+        stats_kwargs = m.client.statistics.list.call_args_list[0][1]
+        self.assertEquals(3600, stats_kwargs['period'])
+        reading = readings[0]
+        self.assertEquals(expected.usage_start, reading.usage_start)
+        self.assertEquals(expected.usage_stop, reading.usage_stop)
+        low, high = reading.value_bounds
+        self.assertTrue(low <= expected.value <= high)
+        self.assertTrue(low <= reading.value <= high)
+        self.assertTrue(abs(expected.value - reading.value) < 1)
+
+    def test_aggregate_approximate_gaps(self):
+        """Tests periods without samples are covered."""
+        def samples():
+            return [
+                FakeSample(
+                    message_id=str(i),
+                    counter_type='gauge',
+                    counter_volume=2,
+                    timestamp=(
+                        begin + datetime.timedelta(hours=2 * i)
+                    ).isoformat()
+                )
+                for i in xrange(6)
+            ]
+
+        begin = datetime.datetime(2016, 7, 1)
+        end = begin + datetime.timedelta(hours=10)
+        m = Meter(FakeClient(samples()), 'meter_name')
+        expected = list(m.read(start=begin, stop=end))[0]
+        self.assertEquals(20.0, expected.value)
+        m = Meter(FakeClient(samples()), 'meter_name')
+        reading = m.aggregate(start=begin, stop=end, period=3600)[0]
+        self.assertEquals(20.0, reading.value)
+        self.assertEquals((20.0, 20.0), reading.value_bounds)
+
+    def test_read_probe_boundaries(self):
+        """Tests probing boundaries matches reading extra samples."""
+        def samples():
+            minutes = [
+                ('a', 300, 1), ('a', 180, 3), ('a', 120, 6), ('a', 90, 10),
+                ('b', 150, 5), ('b', 120, 7), ('b', 30, 8), ('c', 100, 2)
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    counter_volume=volume,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat()
+                )
+                for resource_id, minute, volume in minutes
+            ]
+
+        m = Meter(FakeClient(samples()), 'meter_name')
+        expected = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+        client = FakeClient(samples())
+        m = Meter(client, 'meter_name', probe_boundaries=True)
+        readings = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+        self.assertEquals(3, len(readings))
+        for e, r in zip(expected, readings):
+            for attr in ['resource_id', 'value', 'usage_start', 'usage_stop']:
+                self.assertEquals(getattr(e, attr), getattr(r, attr))
+        # Only samples in the window were listed.
+        for args, kwargs in client.samples.list.call_args_list:
+            lower = [f for f in kwargs['q'] if f['op'] in ('gt', 'ge')][0]
+            self.assertTrue(lower['value'] >= three_hours_ago - one_second)
+
+    def test_read_state(self):
+        """Tests consecutive runs with state match reading extra samples."""
+        def samples():
+            minutes = [
+                ('a', 300, 1), ('a', 200, 3), ('a', 150, 6), ('a', 90, 10),
+                ('b', 150, 5), ('b', 100, 7), ('b', 30, 8), ('c', 100, 2)
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    counter_volume=volume,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat()
+                )
+                for resource_id, minute, volume in minutes
+            ]
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            state = BoundaryState(
+                os.path.join(tmp_dir, 'state.json'), EXTRA_TIME
+            )
+            m = Meter(FakeClient(samples()), 'meter_name', state=state)
+            list(m.read(start=three_hours_ago, stop=two_hours_ago))
+
+            m = Meter(FakeClient(samples()), 'meter_name')
+            expected = list(m.read(start=two_hours_ago, stop=one_hour_ago))
+            client = FakeClient(samples())
+            m = Meter(client, 'meter_name', state=state)
+            readings = list(m.read(start=two_hours_ago, stop=one_hour_ago))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEquals(3, len(readings))
+        for e, r in zip(expected, readings):
+            for attr in ['resource_id', 'value', 'usage_start', 'usage_stop']:
+                self.assertEquals(getattr(e, attr), getattr(r, attr))
+        # Nothing before the window was listed.
+        for args, kwargs in client.samples.list.call_args_list:
+            lower = [f for f in kwargs['q'] if f['op'] in ('gt', 'ge')][0]
+            self.assertTrue(lower['value'] >= two_hours_ago - one_second)
+
+    def test_read_epoch_timestamps(self):
+        """Tests epoch timestamps give the same readings as datetimes."""
+        def samples():
+            minutes = [
+                ('a', 300, 1), ('a', 180, 3), ('a', 120, 6), ('a', 90, 10),
+                ('b', 150, 5), ('b', 120, 7), ('b', 30, 8), ('c', 100, 2)
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    counter_volume=volume,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat()
+                )
+                for resource_id, minute, volume in minutes
+            ]
+
+        m = Meter(FakeClient(samples()), 'meter_name')
+        expected = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+        m = Meter(FakeClient(samples()), 'meter_name', epoch_timestamps=True)
+        readings = list(m.read(start=three_hours_ago, stop=one_hour_ago))
+        self.assertEquals(3, len(readings))
+        for e, r in zip(expected, readings):
+            for attr in ['resource_id', 'usage_start', 'usage_stop']:
+                self.assertEquals(getattr(e, attr), getattr(r, attr))
+            self.assertAlmostEquals(e.value, r.value)
+        self.assertTrue(
+            isinstance(readings[0].samples[0].timestamp, (int, long))
+        )
+
+    def test_read_state_last_hour(self):
+        """Tests state is used by consecutive last hour windows."""
+        first_stop = two_hours_ago
+        second_stop = first_stop + datetime.timedelta(hours=1, seconds=2.5)
+        with mock.patch('usage.utils.datetime') as mock_datetime:
+            mock_datetime.timedelta = datetime.timedelta
+            mock_datetime.datetime.utcnow.side_effect = [
+                first_stop, second_stop
+            ]
+            first_window = utils.last_hour_range()
+            start, stop = utils.last_hour_range()
+        self.assertEquals(first_stop + datetime.timedelta(seconds=2.5), start)
+
+        def samples():
+            offsets = [
+                ('a', -5400, 1), ('a', 1800, 3), ('b', -600, 5),
+                ('b', 1200, 7), ('c', 600, 2), ('d', 1, 4), ('d', 2400, 6)
+            ]
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, offset),
+                    resource_id=resource_id,
+                    counter_volume=volume,
+                    timestamp=(
+                        first_stop + datetime.timedelta(seconds=offset)
+                    ).isoformat()
+                )
+                for resource_id, offset, volume in offsets
+            ]
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            state = BoundaryState(
+                os.path.join(tmp_dir, 'state.json'), EXTRA_TIME
+            )
+            m = Meter(FakeClient(samples()), 'meter_name', state=state)
+            list(m.read(*first_window))
+
+            m = Meter(FakeClient(samples()), 'meter_name')
+            expected = list(m.read(start=start, stop=stop))
+            client = FakeClient(samples())
+            m = Meter(client, 'meter_name', state=state)
+            readings = list(m.read(start=start, stop=stop))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEquals(4, len(readings))
+        for e, r in zip(expected, readings):
+            for attr in ['resource_id', 'value', 'usage_start', 'usage_stop']:
+                self.assertEquals(getattr(e, attr), getattr(r, attr))
+        # Samples were listed from the previous stop instead of the lookback.
+        for args, kwargs in client.samples.list.call_args_list:
+            lower = [f for f in kwargs['q'] if f['op'] in ('gt', 'ge')][0]
+            self.assertTrue(lower['value'] >= first_stop - one_second)
+
+    @mock.patch('usage.meter.Reading')
+    def test_read_metadata_keys(self, mock_reading):
+        """Tests unused metadata is dropped as samples are read."""
+        samples = [
+            FakeSample(
+                timestamp=one_hour_ago.isoformat(),
+                resource_metadata={'Status': 'active', 'unused': 'x' * 100}
+            )
+        ]
+        m = Meter(mock.Mock(), 'meter_name', metadata_keys=set(['status']))
+        list(m.read_batches([samples], start=two_hours_ago, stop=now))
+        sample = mock_reading.call_args[0][0][0]
+        self.assertEquals({'Status': 'active'}, sample.resource_metadata)
+        self.assertTrue(isinstance(sample, Sample))
+
+    @mock.patch('usage.meter.Reading')
+    def test_read_shared_metadata(self, mock_reading):
+        """Tests equal metadata of consecutive samples is shared."""
+        samples = [
+            FakeSample(
+                message_id=str(i),
+                timestamp=(now - datetime.timedelta(minutes=i)).isoformat(),
+                resource_metadata=metadata
+            )
+            for i, metadata in enumerate([
+                {'status': 'deleted'},
+                {'status': 'active'},
+                {'status': 'active'},
+                {'status': 'active'}
+            ])
+        ]
+        m = Meter(mock.Mock(), 'meter_name')
+        list(m.read_batches([samples], start=two_hours_ago, stop=now))
+        read = mock_reading.call_args[0][0]
+        self.assertTrue(
+            read[0].resource_metadata is read[1].resource_metadata
+        )
+        self.assertTrue(
+            read[1].resource_metadata is read[2].resource_metadata
+        )
+        self.assertEquals({'status': 'deleted'}, read[3].resource_metadata)
+        self.assertEquals(read[2], m.last_non_deleted_sample(read))
+
+    def test_read_drops_outside_samples(self):
+        """Tests samples outside of the window are not kept."""
+        samples = [
+            FakeSample(
+                message_id=str(i),
+                timestamp=timestamp.isoformat(),
+                counter_volume=1
+            )
+            for i, timestamp in enumerate(
+                [five_hours_ago, three_hours_ago, two_hours_ago, now]
+            )
+        ]
+        m = Meter(mock.Mock(), 'meter_name')
+        readings = list(m.read_batches(
+            [samples[:2], samples[2:]], start=four_hours_ago, stop=one_hour_ago
+        ))
+        self.assertEquals(1, len(readings))
+        self.assertEquals(
+            ['1', '2'], [s.message_id for s in readings[0].samples]
+        )
+        self.assertEquals(four_hours_ago, readings[0].usage_start)
+        self.assertEquals(one_hour_ago, readings[0].usage_stop)
+        self.assertEquals(3.0, readings[0].value)
+
+    @unittest.skipIf(not columnar.available(), 'numpy is not installed')
+    def test_read_engine(self):
+        """Tests the numpy engine matches the python engine."""
+        def samples():
+            return [
+                FakeSample(
+                    message_id='{}{}'.format(resource_id, minute),
+                    resource_id=resource_id,
+                    counter_volume=volume,
+                    timestamp=(
+                        now - datetime.timedelta(minutes=minute)
+                    ).isoformat()
+                )
+                for resource_id, minute, volume in [
+                    ('a', 300, 1), ('a', 180, 3), ('a', 120, 6),
+                    ('b', 150, 5), ('b', 30, 8), ('c', 100, 2)
+                ]
+            ]
+
+        state = mock.Mock()
+        expected = list(Meter(mock.Mock(), 'meter_name').read_batches(
+            [samples()], start=three_hours_ago, stop=one_hour_ago
+        ))
+        m = Meter(mock.Mock(), 'meter_name', engine='numpy', state=state)
+        readings = list(m.read_batches(
+            [samples()[:3], samples()[3:]],
+            start=three_hours_ago,
+            stop=one_hour_ago
+        ))
+        self.assertEquals(3, len(readings))
+        for e, r in zip(expected, readings):
+            self.assertEquals(e.resource_id, r.resource_id)
+            self.assertAlmostEquals(e.value, r.value)
+            self.assertEquals(e.usage_start, r.usage_start)
+            self.assertEquals(e.usage_stop, r.usage_stop)
+        recorded = list(state.record.call_args[0][2])
+        self.assertEquals(
+            set(['a300', 'a120', 'b150', 'c100']),
+            set(s.message_id for s in recorded)
+        )
@@ -1,6 +1,39 @@
+import datetime
+import mock
+import os
+import random
+import shutil
+import socket
+import tempfile
+import time
 import unittest
 
+from ceilometerclient import exc
+from fakes import FakeClient
+from fakes import FakeSample
+from usage.exc import UnknownStrategyError
+from usage.query import _complex_filter
+from usage.query import AdaptiveLimit
+from usage.query import call
+from usage.query import filters
+from usage.query import MeterSetScheduler
 from usage.query import query
+from usage.query import Scheduler
+
+start = datetime.datetime(2016, 7, 1)
+stop = start + datetime.timedelta(hours=64)
+
+
+def hourly_samples(hours=64, per_hour=4):
+    """Create fake samples spread evenly over a number of hours."""
+    samples = []
+    step = datetime.timedelta(seconds=3600 / per_hour)
+    for i in xrange(1, hours * per_hour + 1):
+        samples.append(FakeSample(
+            message_id=str(i),
+            timestamp=(start + step * i).isoformat()
+        ))
+    return samples
 
 
 class TestQuery(unittest.TestCase):
@@ -18,6 +51,26 @@ class TestQuery(unittest.TestCase):
         for key in expected:
             self.assertEquals(q[key], expected[key])
 
+    def test_filters(self):
+        """Test assembling filters from a report definition."""
+        self.assertEquals([], filters(None))
+        self.assertEquals(
+            [
+                query('metadata.instance_type', 'eq', 'm1.small'),
+                query('project_id', 'eq', 'project')
+            ],
+            filters({
+                'project_id': 'project',
+                'metadata.instance_type': 'm1.small'
+            })
+        )
+        self.assertEquals(
+            [query('resource_id', 'ne', 'resource')],
+            filters([
+                {'field': 'resource_id', 'op': 'ne', 'value': 'resource'}
+            ])
+        )
+
     def test_with_type(self):
         """Test with the type keyword argument."""
         expected = {
@@ -34,3 +87,433 @@ class TestQuery(unittest.TestCase):
         )
         for key in expected:
             self.assertEquals(q[key], expected[key])
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests the scheduler."""
+
+    def assertSchedule(self, schedule, max_samples):
+        """Check the schedule is contiguous, ordered and bounded."""
+        previous_stop = start
+        for chunk in schedule:
+            self.assertEquals(previous_stop, chunk.start)
+            self.assertTrue(chunk.count <= max_samples)
+            previous_stop = chunk.stop
+        self.assertEquals(stop, previous_stop)
+
+    def test_schedule(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(client, 'meter', start, stop, max_samples=20)
+        self.assertSchedule(schedule, 20)
+        self.assertEquals(256, schedule.count())
+        self.assertEquals(256, len(schedule.list()))
+
+    def test_concurrent_schedule(self):
+        client = FakeClient(hourly_samples())
+        sequential = Scheduler(client, 'meter', start, stop, max_samples=20)
+        concurrent = Scheduler(
+            client, 'meter', start, stop, max_samples=20, concurrency=4
+        )
+        self.assertSchedule(concurrent, 20)
+        self.assertEquals(
+            [(c.start, c.stop, c.count) for c in sequential],
+            [(c.start, c.stop, c.count) for c in concurrent]
+        )
+
+    def test_concurrent_list(self):
+        client = FakeClient(hourly_samples())
+        sequential = Scheduler(client, 'meter', start, stop, max_samples=20)
+        concurrent = Scheduler(
+            client, 'meter', start, stop, max_samples=20, fetch_concurrency=4
+        )
+        self.assertEquals(
+            [s.message_id for s in sequential.list()],
+            [s.message_id for s in concurrent.list()]
+        )
+
+    def test_histogram_schedule(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, strategy='histogram'
+        )
+        self.assertSchedule(schedule, 20)
+        # A single statistics call plans the whole window.
+        self.assertEquals(1, client.statistics.list.call_count)
+        self.assertEquals(256, schedule.count())
+        self.assertEquals(256, len(schedule.list()))
+
+    def test_histogram_oversized_period(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, strategy='histogram',
+            period=32 * 3600
+        )
+        self.assertSchedule(schedule, 20)
+        self.assertEquals(256, len(schedule.list()))
+
+    def test_paging(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, strategy='paging'
+        )
+        self.assertEquals(None, schedule.count())
+        samples = schedule.list()
+        self.assertEquals(0, client.statistics.list.call_count)
+        self.assertEquals(256, len(samples))
+        self.assertEquals(256, len(set(s.message_id for s in samples)))
+
+    def test_paging_ties(self):
+        # 10 samples share every timestamp so pages end inside ties.
+        samples = []
+        for i, sample in enumerate(hourly_samples(hours=4, per_hour=2)):
+            for j in xrange(10):
+                samples.append(FakeSample(
+                    message_id='{}-{}'.format(i, j),
+                    timestamp=sample.timestamp
+                ))
+        client = FakeClient(samples)
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=7, strategy='paging',
+            fetch_concurrency=2
+        )
+        listed = schedule.list()
+        self.assertEquals(80, len(listed))
+        self.assertEquals(80, len(set(s.message_id for s in listed)))
+
+    def test_paging_shuffled_ties(self):
+        # Ceilometer does not order samples sharing a timestamp.
+        tied = start + datetime.timedelta(hours=1)
+        samples = hourly_samples(hours=4, per_hour=2)
+        for j in xrange(25):
+            samples.append(FakeSample(
+                message_id='tie-{}'.format(j), timestamp=tied.isoformat()
+            ))
+        for seed in xrange(10):
+            client = FakeClient(samples)
+            shuffle = random.Random(seed)
+
+            def shuffled(meter_name=None, q=None, limit=None):
+                listed = sorted(
+                    client._filter(q),
+                    key=lambda s: (s.timestamp, shuffle.random()),
+                    reverse=True
+                )
+                return listed[:limit]
+            client.samples.list.side_effect = shuffled
+            schedule = Scheduler(
+                client, 'meter', start, stop, max_samples=10,
+                strategy='paging'
+            )
+            listed = schedule.list()
+            self.assertEquals(33, len(listed))
+            self.assertEquals(33, len(set(s.message_id for s in listed)))
+
+    def test_density_schedule(self):
+        client = FakeClient(hourly_samples())
+        model = mock.Mock()
+        model.predict.return_value = 4.0
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, density_model=model
+        )
+        self.assertSchedule(schedule, 20)
+        self.assertEquals(256, len(schedule.list()))
+        self.assertEquals(0, client.statistics.list.call_count)
+        model.record.assert_called_once_with(
+            schedule.density_key, 256, 64 * 3600.0
+        )
+
+    def test_density_future_stop(self):
+        # The window extends 4 hours past now like Meter.read windows do.
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        begin = now - datetime.timedelta(hours=2)
+        end = now + datetime.timedelta(hours=4)
+        samples = [
+            FakeSample(
+                message_id=str(i),
+                timestamp=(begin + datetime.timedelta(minutes=15 * i))
+                .isoformat()
+            )
+            for i in xrange(1, 9)
+        ]
+        model = mock.Mock()
+        model.predict.return_value = 4.0
+        schedule = Scheduler(
+            FakeClient(samples), 'meter', begin, end, max_samples=4,
+            density_model=model
+        )
+        future = [c for c in schedule if c.start >= schedule.sampled_stop]
+        self.assertEquals(1, len(future))
+        self.assertEquals(0, future[0].count)
+        self.assertEquals(end, future[0].stop)
+        self.assertEquals(8, len(schedule.list()))
+        key, count, seconds = model.record.call_args[0]
+        self.assertEquals(8, count)
+        self.assertAlmostEquals(7200, seconds, delta=60)
+
+    def test_wrong_density_schedule(self):
+        client = FakeClient(hourly_samples())
+        model = mock.Mock()
+        model.predict.return_value = 1.0
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, density_model=model
+        )
+        samples = schedule.list()
+        self.assertEquals(256, len(samples))
+        self.assertEquals(256, len(set(s.message_id for s in samples)))
+        self.assertTrue(client.statistics.list.call_count > 0)
+
+    def test_adaptive_split(self):
+        # Every request is slower than the target so chunks get split.
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, adaptive=True,
+            min_samples=5, target_latency=-1
+        )
+        samples = schedule.list()
+        self.assertEquals(256, len(samples))
+        self.assertEquals(5, schedule.limit.value)
+        for call in client.samples.list.call_args_list[1:]:
+            self.assertTrue(call[1]['limit'] <= 10)
+
+    def test_adaptive_paging(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, strategy='paging',
+            adaptive=True, min_samples=5, target_latency=-1
+        )
+        samples = schedule.list()
+        self.assertEquals(256, len(samples))
+        self.assertEquals(256, len(set(s.message_id for s in samples)))
+        self.assertEquals(5, client.samples.list.call_args[1]['limit'])
+
+    def test_partition_burst(self):
+        # 60 samples share one timestamp across 3 projects and 6 resources.
+        burst = (start + datetime.timedelta(minutes=61)).isoformat()
+        samples = hourly_samples()
+        for i in xrange(60):
+            samples.append(FakeSample(
+                message_id='burst-{}'.format(i),
+                project_id='project-{}'.format(i % 3),
+                resource_id='resource-{}'.format(i % 6),
+                timestamp=burst
+            ))
+        client = FakeClient(samples)
+        schedule = Scheduler(client, 'meter', start, stop, max_samples=15)
+        partitioned = [chunk for chunk in schedule if chunk.partitioned]
+        self.assertEquals(6, len(partitioned))
+        for chunk in partitioned:
+            self.assertEquals(10, chunk.count)
+        self.assertEquals(316, len(schedule.list()))
+
+    def test_iter_batches(self):
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20, fetch_concurrency=3
+        )
+        batches = list(schedule.iter_batches())
+        self.assertEquals(len(schedule.schedule), len(batches))
+        for chunk, batch in zip(schedule, batches):
+            self.assertEquals(chunk.count, len(batch))
+        self.assertEquals(
+            [s.message_id for batch in batches for s in batch],
+            [s.message_id for s in schedule.iter_samples()]
+        )
+
+    def test_checkpoint_resume(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        client = FakeClient(hourly_samples())
+        list_samples = client.samples.list.side_effect
+
+        def fail_fifth(*args, **kwargs):
+            if client.samples.list.call_count == 5:
+                raise Exception('Timeout')
+            return list_samples(*args, **kwargs)
+        client.samples.list.side_effect = fail_fifth
+
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20,
+            checkpoint_dir=directory
+        )
+        with self.assertRaises(Exception):
+            schedule.list()
+
+        # Rerun loads the plan and the first four chunks.
+        client = FakeClient(hourly_samples())
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=20,
+            checkpoint_dir=directory
+        )
+        self.assertEquals(0, client.statistics.list.call_count)
+        samples = schedule.list()
+        self.assertEquals(256, len(samples))
+        self.assertEquals(
+            len(schedule.schedule) - 4, client.samples.list.call_count
+        )
+        # Finished fetches remove their checkpoint.
+        self.assertEquals([], os.listdir(directory))
+
+    def test_retry(self):
+        client = FakeClient(hourly_samples())
+        count = client.statistics.list.side_effect
+        client.statistics.list.side_effect = [socket.error('reset')] + [
+            count(q=[
+                query('timestamp', 'gt', start, 'datetime'),
+                query('timestamp', 'le', stop, 'datetime')
+            ])
+        ]
+        schedule = Scheduler(
+            client, 'meter', start, stop, max_samples=300, retries=1,
+            backoff=0
+        )
+        self.assertEquals(256, schedule.count())
+        self.assertEquals(2, client.statistics.list.call_count)
+
+    def test_no_retry_client_error(self):
+        error = exc.HTTPBadRequest('bad filter')
+        func = mock.Mock(side_effect=[error, 'result'])
+        with self.assertRaises(exc.HTTPBadRequest):
+            call(func, {}, retries=3, backoff=0)
+        self.assertEquals(1, func.call_count)
+
+        server_error = exc.HTTPServiceUnavailable('busy')
+        func = mock.Mock(side_effect=[server_error, 'result'])
+        self.assertEquals('result', call(func, {}, retries=3, backoff=0))
+
+    def test_split_on_timeout(self):
+        client = FakeClient(hourly_samples())
+        list_samples = client.samples.list.side_effect
+
+        def timeout_large(*args, **kwargs):
+            if kwargs['limit'] > 50:
+                raise socket.timeout()
+            return list_samples(*args, **kwargs)
+        client.samples.list.side_effect = timeout_large
+
+        schedule = Scheduler(client, 'meter', start, stop, max_samples=200)
+        samples = schedule.list()
+        self.assertEquals(256, len(samples))
+        self.assertEquals(256, len(set(s.message_id for s in samples)))
+
+    def test_hedge(self):
+        client = FakeClient()
+        schedule = Scheduler(client, 'meter', start, stop, hedge=True)
+        schedule._latencies = [0.01] * 20
+
+        def slow_then_fast(*args, **kwargs):
+            if client.samples.list.call_count == 1:
+                time.sleep(1)
+                return ['slow']
+            return ['fast']
+        client.samples.list.side_effect = slow_then_fast
+        self.assertEquals(['fast'], schedule._list([], 1))
+        self.assertEquals(2, client.samples.list.call_count)
+
+    @mock.patch('usage.query.stream.list_samples')
+    def test_streaming(self, mock_list_samples):
+        mock_list_samples.return_value = []
+        client = FakeClient()
+        schedule = Scheduler(
+            client, 'meter', start, stop, strategy='paging', streaming=True
+        )
+        self.assertEquals([], schedule.list())
+        mock_list_samples.assert_called_once_with(
+            client, 'meter', q=schedule.schedule[0].q, limit=500
+        )
+        self.assertEquals(0, client.samples.list.call_count)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(UnknownStrategyError):
+            Scheduler(FakeClient(), 'meter', start, stop, strategy='unknown')
+
+
+class TestMeterSetScheduler(unittest.TestCase):
+    """Tests the multi meter scheduler."""
+
+    def test_demultiplex(self):
+        samples = []
+        for meter in ['cpu', 'instance', 'other']:
+            for s in hourly_samples():
+                s.message_id = '{}-{}'.format(meter, s.message_id)
+                s.meter = meter
+                samples.append(s)
+        samples[0].project_id = 'another_project'
+        client = FakeClient(samples)
+        schedule = MeterSetScheduler(
+            client, ['instance', 'cpu', 'missing'], start, stop,
+            q=[query('project_id', 'eq', 'project_id')], max_samples=20,
+            fetch_concurrency=2, strategy='bisect'
+        )
+        self.assertEquals('cpu,instance,missing', schedule.meter_name)
+        by_meter = schedule.demultiplex()
+        self.assertEquals(255, len(by_meter['cpu']))
+        self.assertEquals(256, len(by_meter['instance']))
+        self.assertEquals([], by_meter['missing'])
+        self.assertEquals(
+            256, len(set(s.message_id for s in by_meter['instance']))
+        )
+        # Everything is paged through the complex query api.
+        self.assertEquals(0, client.statistics.list.call_count)
+        self.assertEquals(0, client.samples.list.call_count)
+        self.assertTrue(client.query_samples.query.call_count > 1)
+
+
+    def test_metadata_filter(self):
+        samples = []
+        for meter in ['cpu', 'instance']:
+            for s in hourly_samples():
+                s.message_id = '{}-{}'.format(meter, s.message_id)
+                s.meter = meter
+                s.resource_metadata = {'instance_type': 'small'}
+                samples.append(s)
+        samples[0].resource_metadata = {'instance_type': 'large'}
+        q = [
+            query('metadata.instance_type', 'eq', 'small'),
+            query('resource', 'eq', 'resource_id')
+        ]
+        self.assertEquals(
+            {
+                'and': [
+                    {'in': {'meter': ['cpu']}},
+                    {'=': {'resource_metadata.instance_type': 'small'}},
+                    {'=': {'resource_id': 'resource_id'}}
+                ]
+            },
+            _complex_filter(['cpu'], q)
+        )
+        schedule = MeterSetScheduler(
+            FakeClient(samples), ['instance', 'cpu'], start, stop,
+            q=[query('metadata.instance_type', 'eq', 'small')],
+            max_samples=20, strategy='bisect'
+        )
+        by_meter = schedule.demultiplex()
+        self.assertEquals(255, len(by_meter['cpu']))
+        self.assertEquals(256, len(by_meter['instance']))
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+    """Tests the adaptive limit."""
+
+    def test_increase(self):
+        limit = AdaptiveLimit(10, 110, target_latency=1)
+        limit.value = 50
+        limit.observe(50, 0.5)
+        self.assertEquals(60, limit.value)
+        # Mostly empty requests say nothing about larger requests.
+        limit.observe(1, 0.5)
+        self.assertEquals(60, limit.value)
+        # Never above the maximum
+        limit.value = 105
+        limit.observe(105, 0.5)
+        self.assertEquals(110, limit.value)
+
+    def test_decrease(self):
+        limit = AdaptiveLimit(10, 110, target_latency=1)
+        limit.observe(110, 2)
+        self.assertEquals(55, limit.value)
+        limit.failure()
+        self.assertEquals(27, limit.value)
+        # Never below the minimum
+        limit.observe(27, 2)
+        limit.observe(13, 2)
+        self.assertEquals(10, limit.value)
@@ -3,6 +3,7 @@ import mock
 import unittest
 
 from fakes import FakeSample
+from usage import utils
 from usage.exc import NoSamplesError
 from usage.exc import UnknownCounterTypeError
 from usage.reading import Reading
@@ -100,6 +101,27 @@ class TestReading(unittest.TestCase):
         r = Reading(samples, four_hours_ago, two_hours_ago)
         self.assertEquals(two_hours_ago, r.usage_stop)
 
+    def test_existence_overrides(self):
+        samples = [FakeSample(timestamp=three_hours_ago)]
+        r = Reading(
+            samples, four_hours_ago, two_hours_ago,
+            existed_before=True, existed_after=True
+        )
+        self.assertTrue(r.resource_existed_before())
+        self.assertTrue(r.resource_existed_after())
+        self.assertEquals(four_hours_ago, r.usage_start)
+        self.assertEquals(two_hours_ago, r.usage_stop)
+
+        samples = [
+            FakeSample(timestamp=five_hours_ago),
+            FakeSample(timestamp=three_hours_ago)
+        ]
+        r = Reading(
+            samples, four_hours_ago, two_hours_ago, existed_before=False
+        )
+        self.assertFalse(r.resource_existed_before())
+        self.assertEquals(three_hours_ago, r.usage_start)
+
     def test_resource_id(self):
         samples = [FakeSample(timestamp=one_hour_ago)]
         r = Reading(samples, two_hours_ago, now)
@@ -161,6 +183,37 @@ class TestReading(unittest.TestCase):
         r = Reading(samples, four_hours_ago, one_hour_ago)
         self.assertEquals(r.value, 3.0)
 
+    def test_epoch_reading(self):
+        def samples(epoch):
+            return [
+                FakeSample(
+                    counter_volume=volume,
+                    timestamp=(
+                        utils.to_epoch_micros(timestamp) if epoch
+                        else timestamp
+                    )
+                )
+                for volume, timestamp in [
+                    (1, five_hours_ago),
+                    (2, three_hours_ago),
+                    (4, two_hours_ago),
+                    (8, now)
+                ]
+            ]
+
+        expected = Reading(samples(False), four_hours_ago, one_hour_ago)
+        r = Reading(samples(True), four_hours_ago, one_hour_ago, epoch=True)
+        self.assertEquals(2, len(r.samples))
+        self.assertAlmostEquals(expected.value, r.value)
+        self.assertEquals(expected.usage_start, r.usage_start)
+        self.assertEquals(expected.usage_stop, r.usage_stop)
+
+        micros = utils.to_epoch_micros(three_hours_ago)
+        samples = [FakeSample(timestamp=micros)]
+        r = Reading(samples, four_hours_ago, one_hour_ago, epoch=True)
+        self.assertEquals(three_hours_ago, r.usage_start)
+        self.assertEquals(three_hours_ago, r.usage_stop)
+
     def test_cumulative_reading(self):
         # Test with both pre and post samples
         samples = [
@@ -0,0 +1,216 @@
+import datetime
+import mock
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import yaml
+
+from fakes import FakeReading
+from usage.report import Report
+
+start = datetime.datetime(2016, 7, 1)
+stop = datetime.datetime(2016, 7, 2)
+
+
+class FakeOutput:
+    """Fake output with a string stream."""
+    def __init__(self):
+        self.stream = StringIO.StringIO()
+        self.location = 'location'
+
+
+class TestReport(unittest.TestCase):
+    """Tests the report."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.definition_filename = os.path.join(self.tmp_dir, 'report.yaml')
+        definition = {
+            'columns': [
+                {'name': 'Resource Id', 'func': 'resource_id'},
+                {'name': 'Conversion', 'func': 'conversion'}
+            ],
+            'items': [
+                {'meter_name': 'instance', 'conversion': 'first'},
+                {'meter_name': 'volume.size'},
+                {'meter_name': 'instance', 'conversion': 'second'},
+                {
+                    'meter_name': 'instance',
+                    'filters': {'project_id': 'a'},
+                    'conversion': 'third'
+                }
+            ]
+        }
+        with open(self.definition_filename, 'w') as f:
+            yaml.safe_dump(definition, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('usage.report.Meter')
+    def test_shared_reads(self, mock_meter):
+        """Items with the same meter and filters share one read."""
+        mock_meter.return_value.read.side_effect = \
+            lambda **kwargs: iter([FakeReading(resource_id='r')])
+        output = FakeOutput()
+        r = Report(
+            'client', self.definition_filename, output, start=start, stop=stop
+        )
+        r._field_function = lambda func, item, reading: \
+            getattr(reading, func)
+        r.run()
+
+        self.assertEquals(3, mock_meter.return_value.read.call_count)
+        meter_names = [args[1] for args, _ in mock_meter.call_args_list]
+        self.assertEquals(['instance', 'volume.size', 'instance'], meter_names)
+        self.assertEquals(
+            [
+                'Resource Id,Conversion',
+                'r,first',
+                'r,',
+                'r,second',
+                'r,third'
+            ],
+            output.stream.getvalue().splitlines()
+        )
+
+    def test_item_key_datetime(self):
+        """Items filtered on unquoted datetimes have keys."""
+        item = yaml.safe_load(
+            "meter_name: instance\n"
+            "filters:\n"
+            "  - field: metadata.created_at\n"
+            "    op: ge\n"
+            "    value: 2016-07-01 00:00:00\n"
+            "    type: datetime\n"
+        )
+        r = Report('client', self.definition_filename, FakeOutput())
+        self.assertEquals(
+            ('instance', 'metadata.created_at>=2016-07-01T00:00:00'),
+            r._item_key(item)
+        )
+
+    @mock.patch('usage.report.query.MeterSetScheduler')
+    @mock.patch('usage.report.Meter')
+    def test_multi_meter(self, mock_meter, mock_scheduler):
+        """Groups are fetched when first read and released once read."""
+        events = []
+
+        def demultiplex(client, meter_names, *args, **kwargs):
+            events.append(('fetch', tuple(meter_names)))
+            schedule = mock.Mock()
+            schedule.demultiplex.return_value = {
+                name: ['{} samples'.format(name)] for name in meter_names
+            }
+            return schedule
+
+        def read_batches(batches, **kwargs):
+            events.append(('read', batches[0][0]))
+            return iter([FakeReading(resource_id='r')])
+
+        mock_scheduler.side_effect = demultiplex
+        mock_meter.return_value.read_batches.side_effect = read_batches
+        r = Report(
+            'client',
+            self.definition_filename,
+            FakeOutput(),
+            start=start,
+            stop=stop,
+            multi_meter=True
+        )
+        r._field_function = lambda func, item, reading: \
+            getattr(reading, func)
+        r.run()
+
+        self.assertEquals(
+            [
+                ('fetch', ('instance', 'volume.size', 'instance')),
+                ('read', 'instance samples'),
+                ('read', 'volume.size samples'),
+                ('fetch', ('instance',)),
+                ('read', 'instance samples')
+            ],
+            events
+        )
+
+    @mock.patch('usage.report.Meter')
+    def test_aggregate(self, mock_meter):
+        """Aggregated readings are used when no column needs samples."""
+        mock_meter.return_value.aggregate.side_effect = [
+            [FakeReading(resource_id='aggregated')], None, None
+        ]
+        mock_meter.return_value.read.side_effect = \
+            lambda **kwargs: iter([FakeReading(resource_id='read')])
+        output = FakeOutput()
+        r = Report(
+            'client', self.definition_filename, output, start=start,
+            stop=stop, aggregate=True
+        )
+        r._field_function = lambda func, item, reading: \
+            getattr(reading, func)
+        r._definition['columns'] = [
+            {'name': 'Resource Id', 'func': 'resource_id'}
+        ]
+        r.run()
+
+        self.assertEquals(3, mock_meter.return_value.aggregate.call_count)
+        self.assertEquals(2, mock_meter.return_value.read.call_count)
+        self.assertEquals(
+            ['Resource Id', 'aggregated', 'read', 'aggregated', 'read'],
+            output.stream.getvalue().splitlines()
+        )
+        self.assertFalse(
+            mock_meter.return_value.aggregate.call_args[1]['metadata']
+        )
+
+    @mock.patch('usage.report.Meter')
+    def test_aggregate_metadata(self, mock_meter):
+        """Metadata columns are served from aggregated readings."""
+        mock_meter.return_value.aggregate.return_value = [
+            FakeReading(resource_id='aggregated')
+        ]
+        r = Report(
+            'client', self.definition_filename, FakeOutput(), start=start,
+            stop=stop, aggregate=True
+        )
+        r._field_function = lambda func, item, reading: None
+        r._definition['columns'] = [
+            {'name': 'Resource Id', 'func': 'resource_id'},
+            {'name': 'Display Name', 'func': 'display_name'},
+            {'name': 'Os', 'func': 'image_metadata:os_distro'}
+        ]
+        r.run()
+
+        self.assertEquals(0, mock_meter.return_value.read.call_count)
+        self.assertTrue(
+            mock_meter.return_value.aggregate.call_args[1]['metadata']
+        )
+
+    def test_project_metadata(self):
+        """Metadata keys are worked out from the columns."""
+        r = Report(
+            'client', self.definition_filename, FakeOutput(), start=start,
+            stop=stop
+        )
+        self.assertEquals(
+            set(['state', 'status']), r._project_metadata(
+                [{'func': 'resource_id'}, {'func': 'hours'}]
+            )
+        )
+        self.assertEquals(
+            set([
+                'state', 'status', 'display_name', 'metadata.uai',
+                'properties.uai', 'metadata', 'image_meta.os_distro'
+            ]),
+            r._project_metadata([
+                {'func': 'display_name'},
+                {'func': 'metadata:UAI'},
+                {'func': 'image_metadata:os_distro'}
+            ])
+        )
+        # Plugin field functions may read any metadata.
+        self.assertEquals(
+            None, r._project_metadata([{'func': 'custom_plugin'}])
+        )
@@ -80,6 +80,162 @@ class TestArgs(unittest.TestCase):
         args = parser.parse_args(test_args)
         self.assertEquals(1, args.max_samples)
 
+    def test_probe_concurrency(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(1, args.probe_concurrency)
+
+        test_args = ['--probe-concurrency', '4']
+        args = parser.parse_args(test_args)
+        self.assertEquals(4, args.probe_concurrency)
+
+    def test_fetch_concurrency(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(1, args.fetch_concurrency)
+
+        test_args = ['--fetch-concurrency', '8']
+        args = parser.parse_args(test_args)
+        self.assertEquals(8, args.fetch_concurrency)
+
+    def test_strategy(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals('bisect', args.strategy)
+
+        test_args = ['--strategy', 'histogram']
+        args = parser.parse_args(test_args)
+        self.assertEquals('histogram', args.strategy)
+
+    def test_histogram_period(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(3600, args.histogram_period)
+
+        test_args = ['--histogram-period', '600']
+        args = parser.parse_args(test_args)
+        self.assertEquals(600, args.histogram_period)
+
+    def test_density_file(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(None, args.density_file)
+
+        test_args = ['--density-file', 'afile']
+        args = parser.parse_args(test_args)
+        self.assertEquals('afile', args.density_file)
+
+    def test_adaptive(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.adaptive)
+        self.assertEquals(1000, args.min_samples)
+        self.assertEquals(10.0, args.target_latency)
+
+        test_args = [
+            '--adaptive', '--min-samples', '10', '--target-latency', '2.5'
+        ]
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.adaptive)
+        self.assertEquals(10, args.min_samples)
+        self.assertEquals(2.5, args.target_latency)
+
+    def test_checkpoint_dir(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(None, args.checkpoint_dir)
+
+        test_args = ['--checkpoint-dir', '/somedir']
+        args = parser.parse_args(test_args)
+        self.assertEquals('/somedir', args.checkpoint_dir)
+
+    def test_retries(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(3, args.retries)
+        self.assertEquals(1.0, args.backoff)
+        self.assertFalse(args.hedge)
+
+        test_args = ['--retries', '0', '--backoff', '0.5', '--hedge']
+        args = parser.parse_args(test_args)
+        self.assertEquals(0, args.retries)
+        self.assertEquals(0.5, args.backoff)
+        self.assertTrue(args.hedge)
+
+    def test_multi_meter(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.multi_meter)
+
+        test_args = ['--multi-meter']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.multi_meter)
+
+    def test_aggregate(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.aggregate)
+
+        test_args = ['--aggregate']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.aggregate)
+
+    def test_approximate(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.approximate)
+        self.assertEquals(3600, args.approximate_period)
+
+        test_args = ['--approximate', '--approximate-period', '600']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.approximate)
+        self.assertEquals(600, args.approximate_period)
+
+    def test_probe_boundaries(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.probe_boundaries)
+
+        test_args = ['--probe-boundaries']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.probe_boundaries)
+
+    def test_state_file(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals(None, args.state_file)
+
+        test_args = ['--state-file', '/tmp/state.json']
+        args = parser.parse_args(test_args)
+        self.assertEquals('/tmp/state.json', args.state_file)
+
+    def test_stream(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.stream)
+
+        test_args = ['--stream']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.stream)
+
+    def test_epoch_timestamps(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertFalse(args.epoch_timestamps)
+
+        test_args = ['--epoch-timestamps']
+        args = parser.parse_args(test_args)
+        self.assertTrue(args.epoch_timestamps)
+
+    def test_engine(self):
+        test_args = []
+        args = parser.parse_args(test_args)
+        self.assertEquals('python', args.engine)
+
+        test_args = ['--engine', 'numpy']
+        args = parser.parse_args(test_args)
+        self.assertEquals('numpy', args.engine)
+
     def test_definition_filename(self):
         test_args = []
         args = parser.parse_args(test_args)
@@ -0,0 +1,49 @@
+import copy
+import mock
+import unittest
+
+from fakes import FakeSample
+from usage import sample
+from usage.sample import FIELDS
+from usage.sample import Sample
+
+
+class TestSample(unittest.TestCase):
+    """Tests the compact sample."""
+
+    def test_init(self):
+        s = Sample(resource_id='r', counter_volume=1, source='openstack')
+        self.assertEquals('r', s.resource_id)
+        self.assertEquals(1, s.counter_volume)
+        self.assertEquals(None, s.project_id)
+        self.assertFalse(hasattr(s, '__dict__'))
+        self.assertFalse(hasattr(s, 'source'))
+
+    def test_interned(self):
+        # Build equal strings that are not the same object.
+        a = Sample(resource_id=u''.join([u'res', u'ource']), meter='m')
+        b = Sample(resource_id=u''.join([u'reso', u'urce']), meter='m')
+        self.assertTrue(a.resource_id is b.resource_id)
+        self.assertTrue(a.meter is b.meter)
+
+    @mock.patch('usage.sample._IDENTIFIERS_SIZE', 3)
+    @mock.patch('usage.sample._IDENTIFIERS', {})
+    def test_interned_bounded(self):
+        for i in xrange(10):
+            s = Sample(resource_id='resource-{}'.format(i), meter='m')
+            self.assertEquals('resource-{}'.format(i), s.resource_id)
+            self.assertTrue(len(sample._IDENTIFIERS) <= 3)
+
+    def test_copy(self):
+        s = Sample(resource_id='r', timestamp=1, resource_metadata={})
+        c = copy.copy(s)
+        c.timestamp = 2
+        self.assertEquals(1, s.timestamp)
+        self.assertEquals(s.resource_id, c.resource_id)
+        self.assertTrue(s.resource_metadata is c.resource_metadata)
+
+    def test_from_resource(self):
+        resource = FakeSample(resource_id='r', counter_volume=3)
+        s = Sample.from_resource(resource)
+        for field in FIELDS:
+            self.assertEquals(getattr(resource, field), getattr(s, field))
@@ -0,0 +1,65 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from fakes import FakeSample
+from usage.state import BoundaryState
+
+start = datetime.datetime(2016, 7, 1)
+lookback = datetime.timedelta(hours=4)
+
+
+class TestBoundaryState(unittest.TestCase):
+    """Tests the boundary state."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sample(self, resource_id, hours):
+        return FakeSample(
+            resource_id=resource_id,
+            timestamp=start + datetime.timedelta(hours=hours)
+        )
+
+    def test_unknown(self):
+        state = BoundaryState(self.filename, lookback)
+        self.assertEquals(None, state.existed_before('meter?', start))
+
+    def test_record(self):
+        state = BoundaryState(self.filename, lookback)
+        state.record('meter?', start, [
+            self.sample('a', -1),
+            self.sample('a', -2),
+            self.sample('b', -5),
+            self.sample('c', 1)
+        ])
+        # b is too old and c is after the stop.
+        self.assertEquals(set(['a']), state.existed_before('meter?', start))
+        # Known when starting at or shortly after the previous stop.
+        later = start + datetime.timedelta(seconds=3)
+        self.assertEquals(start, state.previous_stop('meter?', later))
+        self.assertEquals(set(['a']), state.existed_before('meter?', later))
+        # Unknown when starting before the previous stop or a lookback
+        # after it.
+        earlier = start - datetime.timedelta(seconds=3)
+        self.assertEquals(None, state.existed_before('meter?', earlier))
+        self.assertEquals(
+            None, state.existed_before('meter?', start + lookback)
+        )
+
+        # State persists and carries resources without new samples.
+        state = BoundaryState(self.filename, lookback)
+        stop = start + datetime.timedelta(hours=1)
+        state.record('meter?', stop, [self.sample('c', 1)])
+        self.assertEquals(
+            set(['a', 'c']), state.existed_before('meter?', stop)
+        )
+        stop = start + datetime.timedelta(hours=4)
+        state.record('meter?', stop, [])
+        self.assertEquals(set(['c']), state.existed_before('meter?', stop))
@@ -0,0 +1,96 @@
+import json
+import mock
+import unittest
+
+from ceilometerclient.client import SessionClient
+from ceilometerclient.exc import HTTPException
+from usage import stream
+
+
+class FakeResponse:
+    """Fake streamed response."""
+    def __init__(self, content):
+        self.content = content
+        self.close = mock.Mock()
+
+    def iter_content(self, chunk_size):
+        for i in xrange(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class TestResponseReader(unittest.TestCase):
+    """Tests reading a streamed response like a file."""
+
+    def test_read(self):
+        reader = stream._ResponseReader(FakeResponse('abcdefg'), 3)
+        self.assertEquals('ab', reader.read(2))
+        self.assertEquals('cdef', reader.read(4))
+        self.assertEquals('g', reader.read())
+        self.assertEquals('', reader.read(1))
+
+
+class TestListSamples(unittest.TestCase):
+    """Tests listing samples from a streamed response."""
+
+    def test_list_samples(self):
+        body = [
+            {
+                'message_id': 'a',
+                'counter_volume': 1.5,
+                'resource_metadata': {'status': 'active'},
+                'source': 'openstack'
+            },
+            {'message_id': 'b', 'counter_volume': 2}
+        ]
+        response = FakeResponse(json.dumps(body))
+        client = mock.Mock()
+        client.http_client.get.return_value = response
+        q = [{'field': 'resource_id', 'op': 'eq', 'value': 'r'}]
+        samples = stream.list_samples(client, 'cpu', q=q, limit=10)
+
+        url = client.http_client.get.call_args[0][0]
+        self.assertTrue(url.startswith('/v2/meters/cpu?'))
+        self.assertTrue(url.endswith('&limit=10'))
+        kwargs = client.http_client.get.call_args[1]
+        self.assertTrue(kwargs['stream'])
+        self.assertEquals('gzip', kwargs['headers']['Accept-Encoding'])
+        self.assertEquals(['a', 'b'], [s.message_id for s in samples])
+        self.assertEquals(1.5, samples[0].counter_volume)
+        self.assertEquals(2, samples[1].counter_volume)
+        self.assertEquals({'status': 'active'}, samples[0].resource_metadata)
+        response.close.assert_called_once_with()
+
+    @mock.patch('usage.stream.adapter.Adapter.request')
+    def test_session_client(self, m_request):
+        body = [{'message_id': 'a', 'counter_volume': 1}]
+        response = FakeResponse(json.dumps(body))
+        response.status_code = 200
+        m_request.return_value = response
+        client = mock.Mock()
+        client.http_client = SessionClient(
+            session=mock.Mock(), service_type='metering'
+        )
+        samples = stream.list_samples(client, 'cpu')
+
+        self.assertEquals(['a'], [s.message_id for s in samples])
+        args, kwargs = m_request.call_args
+        self.assertEquals(client.http_client, args[0])
+        self.assertEquals('GET', args[2])
+        self.assertTrue(kwargs['stream'])
+        # Nothing was read before parsing.
+        client.http_client.session.request.assert_not_called()
+
+        response = FakeResponse('{}')
+        response.status_code = 500
+        response.headers = {}
+        m_request.return_value = response
+        with self.assertRaises(HTTPException):
+            stream.list_samples(client, 'cpu')
+        response.close.assert_called_once_with()
+
+    def test_plain(self):
+        value = {'a': [stream.decimal.Decimal('1.5')],
+                 'b': stream.decimal.Decimal('2')}
+        plain = stream._plain(value)
+        self.assertEquals({'a': [1.5], 'b': 2}, plain)
+        self.assertTrue(isinstance(plain['b'], int))
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+
+from usage import utils
+
+
+class TestParseTimestamp(unittest.TestCase):
+    """Tests the fast timestamp parser."""
+
+    def setUp(self):
+        utils._CACHE.clear()
+        utils._EPOCH_CACHE.clear()
+
+    def test_formats(self):
+        cases = [
+            '2016-07-01T10:11:12',
+            '2016-07-01T10:11:12.5',
+            '2016-07-01T10:11:12.123456',
+            '2016-07-01 10:11:12.123456',
+            '2016-07-01T10:11:12Z',
+            '2016-07-01T10:11:12.123456+00:00',
+            '2016-07-01T10:11:12-0000',
+            '2016-07-01T12:11:12.123456+02:00',
+            '2016-07-01'
+        ]
+        for timestamp in cases:
+            expected = utils.normalize_time(utils.parse_datetime(timestamp))
+            self.assertEquals(expected, utils.parse_timestamp(timestamp))
+
+    def test_cache(self):
+        parsed = utils.parse_timestamp('2016-07-01T10:11:12')
+        self.assertTrue(
+            parsed is utils.parse_timestamp('2016-07-01T10:11:12')
+        )
+
+        old_size = utils._CACHE_SIZE
+        utils._CACHE_SIZE = 2
+        try:
+            utils.parse_timestamp('2016-07-01T10:11:13')
+            utils.parse_timestamp('2016-07-01T10:11:14')
+            self.assertEquals(1, len(utils._CACHE))
+        finally:
+            utils._CACHE_SIZE = old_size
+
+    def test_epoch_micros(self):
+        dt = datetime.datetime(2016, 7, 1, 10, 11, 12, 123456)
+        micros = utils.to_epoch_micros(dt)
+        self.assertEquals(1467367872123456, micros)
+        self.assertEquals(dt, utils.from_epoch_micros(micros))
+        self.assertEquals(
+            micros, utils.parse_epoch_micros('2016-07-01T10:11:12.123456')
+        )
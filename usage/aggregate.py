@@ -0,0 +1,365 @@
+"""
+Module for readings computed from statistics instead of samples.
+
+Grouped statistics are one row per resource, so a meter can be read without
+listing its samples when no report column needs per sample data.
+"""
+import utils
+
+from conversions import convert
+from conversions.time_units import seconds_to_hours
+from fields import normalize_name
+from fields.reading import metadata_keys
+from log import logging
+
+logger = logging.getLogger('usage.aggregate')
+
+# Meter types whose readings can be computed from statistics. Gauge
+# readings can only be computed for resources with a constant volume.
+AGGREGATE_METER_TYPES = set(['cumulative', 'delta', 'gauge'])
+
+# Field functions that only use the value, times and ids of a reading.
+SAMPLE_FREE_FIELDS = set([
+    'billing_entity',
+    'billing_period_end_date',
+    'billing_period_start_date',
+    'cost',
+    'currency_code',
+    'description',
+    'hours',
+    'invoice_id',
+    'item_rate',
+    'line_item_type',
+    'meter_name',
+    'operation',
+    'payer_account_id',
+    'product_code',
+    'product_name',
+    'project_id',
+    'resource_id',
+    'timeinterval',
+    'usage_account_id',
+    'usage_amount',
+    'usage_end_date',
+    'usage_start_date',
+    'usage_type'
+])
+
+
+def _parse_time(timestamp):
+    """Parse a statistics timestamp into a naive utc datetime.
+
+    :param timestamp: Iso8601 timestamp
+    :type timestamp: String
+    :returns: Naive utc datetime
+    :rtype: Datetime
+    """
+    return utils.parse_timestamp(timestamp)
+
+
+def constant_volume(statistics):
+    """Check whether the statistics of a resource have one volume.
+
+    Existence meters like instance always have a volume of 1.
+
+    :param statistics: Grouped statistics of one resource
+    :type statistics: List
+    :returns: Whether every sample had the same volume
+    :rtype: Bool
+    """
+    return len(
+        set(s.min for s in statistics) | set(s.max for s in statistics)
+    ) == 1
+
+
+def _column_func(column):
+    """Get the normalized field function name of a column.
+
+    :param column: Column in report definition
+    :type column: Dict
+    :returns: Field function name
+    :rtype: String
+    """
+    return normalize_name(column.get('func', ''))
+
+
+def needs_samples(columns):
+    """Check whether any column needs per sample data.
+
+    Metadata columns do not. Their metadata is read from the last samples
+    of each resource. Unknown field functions are assumed to need samples.
+
+    :param columns: Columns in report definition
+    :type columns: List
+    :returns: Whether samples are needed
+    :rtype: Bool
+    """
+    for column in columns:
+        func = _column_func(column)
+        if func in SAMPLE_FREE_FIELDS:
+            continue
+        if metadata_keys(func) is None:
+            return True
+    return False
+
+
+def needs_metadata(columns):
+    """Check whether any column reads resource metadata.
+
+    :param columns: Columns in report definition
+    :type columns: List
+    :returns: Whether metadata is needed
+    :rtype: Bool
+    """
+    return any(
+        metadata_keys(_column_func(column)) is not None
+        for column in columns
+    )
+
+
+class StatisticsReading:
+    """Models a reading of a meter computed from grouped statistics.
+
+    Has the same attributes as reading.Reading except for metadata, which
+    is always empty, and samples, which are never listed.
+
+    Cumulative readings are the max minus the min volume, which equals the
+    last minus the first volume as long as the counter did not reset during
+    the reading. Delta readings are the sum of volumes. Gauge readings are
+    only exact for a constant volume, where the integral is the volume
+    times the hours between usage start and usage stop.
+    """
+    def __init__(self,
+                 statistics,
+                 start,
+                 stop,
+                 meter_name,
+                 meter_type,
+                 existed_before=False,
+                 existed_after=False):
+        """Init the reading.
+
+        :param statistics: Statistics of one resource grouped by resource id
+            and project id. There is more than one if the resource moved
+            between projects.
+        :type statistics: List
+        :param start: Starting datetime.
+        :type start: Datetime
+        :param stop: Stopping datetime.
+        :type stop: Datetime
+        :param meter_name: Name of the meter
+        :type meter_name: String
+        :param meter_type: Type of the meter. One of AGGREGATE_METER_TYPES
+        :type meter_type: String
+        :param existed_before: Whether there are samples prior to start.
+        :type existed_before: Bool
+        :param existed_after: Whether there are samples after stop.
+        :type existed_after: Bool
+        """
+        self.start = start
+        self.stop = stop
+        self.meter_name = meter_name
+        self.meter_type = meter_type
+        self.metadata = {}
+        self.samples = []
+        self._existed_before = existed_before
+        self._existed_after = existed_after
+
+        # Like Reading, the project is the project of the first sample.
+        statistics = sorted(
+            statistics, key=lambda s: _parse_time(s.duration_start)
+        )
+        self.resource_id = statistics[0].groupby['resource_id']
+        self.project_id = statistics[0].groupby.get('project_id')
+        self._duration_start = _parse_time(statistics[0].duration_start)
+        self._duration_end = max(
+            _parse_time(s.duration_end) for s in statistics
+        )
+        self._calculate(statistics)
+
+    def _calculate(self, statistics):
+        """Compute the value according to meter type.
+
+        :param statistics: Grouped statistics of the resource
+        :type statistics: List
+        """
+        if self.meter_type == 'cumulative':
+            self.value = \
+                max(s.max for s in statistics) - \
+                min(s.min for s in statistics)
+        elif self.meter_type == 'gauge':
+            seconds = (self.usage_stop - self.usage_start).total_seconds()
+            self.value = seconds_to_hours(statistics[0].max * seconds)
+        else:
+            self.value = sum(s.sum for s in statistics)
+
+    def resource_existed_before(self):
+        """Determine if resource existed before self.start.
+
+        :returns: Whether there are samples prior to start
+        :rtype: Bool
+        """
+        return self._existed_before
+
+    def resource_existed_after(self):
+        """Determine if resource existed after self.stop.
+
+        :returns: Whether there are samples after stop
+        :rtype: Bool
+        """
+        return self._existed_after
+
+    @property
+    def usage_start(self):
+        """Get the usage start time.
+
+        :returns: Usage start time
+        :rtype: Datetime
+        """
+        if self._existed_before:
+            return self.start
+        return self._duration_start
+
+    @property
+    def usage_stop(self):
+        """Get the usage stop time.
+
+        :returns: Usage stop time
+        :rtype: Datetime
+        """
+        if self._existed_after:
+            return self.stop
+        return self._duration_end
+
+    @property
+    def last_sample_time(self):
+        """Get the time of the last sample during the reading.
+
+        :returns: Time of the last sample
+        :rtype: Datetime
+        """
+        return self._duration_end
+
+    def convert(self, conversion):
+        """Convert value using function func.
+
+        :param conversion: Conversion function name
+        :type conversion: String|None
+        """
+        if self.value is None or conversion is None:
+            return
+        self.value = convert(conversion, self.value)
+
+
+class ApproximateGaugeReading(StatisticsReading):
+    """Models an approximate gauge reading from per period statistics.
+
+    Each period contributes its average volume times the part of the
+    period between usage start and usage stop. Periods without samples
+    take the mean of the averages of the periods on either side. Like
+    Reading, time before the first and after the last period keeps the
+    volume of those periods. The bounds assume the volume stayed between
+    the minimum and maximum of each period, and between the minimum and
+    maximum of both neighbours during periods without samples.
+    """
+    def __init__(self, statistics, start, stop, meter_name,
+                 existed_before=False, existed_after=False):
+        """Init the reading.
+
+        :param statistics: Statistics of one resource grouped by resource id
+            and project id with a period.
+        :type statistics: List
+        :param start: Starting datetime.
+        :type start: Datetime
+        :param stop: Stopping datetime.
+        :type stop: Datetime
+        :param meter_name: Name of the meter
+        :type meter_name: String
+        :param existed_before: Whether there are samples prior to start.
+        :type existed_before: Bool
+        :param existed_after: Whether there are samples after stop.
+        :type existed_after: Bool
+        """
+        StatisticsReading.__init__(
+            self,
+            statistics,
+            start,
+            stop,
+            meter_name,
+            'gauge',
+            existed_before=existed_before,
+            existed_after=existed_after
+        )
+
+    def _calculate(self, statistics):
+        """Compute the value and bounds from the period statistics.
+
+        :param statistics: Grouped period statistics of the resource
+        :type statistics: List
+        """
+        # A resource that moved between projects has several statistics
+        # in the same period.
+        periods = {}
+        for s in statistics:
+            periods.setdefault(s.period_start, []).append(s)
+
+        # (period start, period end, average, min, max) in time order.
+        ordered = []
+        for period_stats in periods.values():
+            count = sum(s.count for s in period_stats)
+            ordered.append((
+                _parse_time(period_stats[0].period_start),
+                _parse_time(period_stats[0].period_end),
+                sum(s.avg * s.count for s in period_stats) / count,
+                min(s.min for s in period_stats),
+                max(s.max for s in period_stats)
+            ))
+        ordered.sort()
+
+        # Time before the first period, between periods and after the last
+        # period is covered by neighbouring periods.
+        segments = [(self.usage_start, ordered[0][0]) + ordered[0][2:]]
+        previous = None
+        for period in ordered:
+            if previous is not None and period[0] > previous[1]:
+                logger.debug('No samples of {} between {} and {}'.format(
+                    self.resource_id, previous[1], period[0]
+                ))
+                segments.append((
+                    previous[1],
+                    period[0],
+                    (previous[2] + period[2]) / 2.0,
+                    min(previous[3], period[3]),
+                    max(previous[4], period[4])
+                ))
+            segments.append(period)
+            previous = period
+        segments.append((previous[1], self.usage_stop) + previous[2:])
+
+        usage_start = self.usage_start
+        usage_stop = self.usage_stop
+        value = low = high = 0.0
+        for begin, end, average, minimum, maximum in segments:
+            seconds = max(
+                (min(end, usage_stop) - max(begin, usage_start))
+                .total_seconds(),
+                0
+            )
+            value += average * seconds
+            low += minimum * seconds
+            high += maximum * seconds
+        self.value = seconds_to_hours(value)
+        self.value_bounds = (seconds_to_hours(low), seconds_to_hours(high))
+
+    def convert(self, conversion):
+        """Convert value and bounds using function func.
+
+        :param conversion: Conversion function name
+        :type conversion: String|None
+        """
+        if conversion is None:
+            return
+        StatisticsReading.convert(self, conversion)
+        self.value_bounds = tuple(
+            convert(conversion, bound) for bound in self.value_bounds
+        )
@@ -82,6 +82,217 @@ parser.add_argument(
     help="Maximum number of samples per query."
 )
 
+# Include an option for number of concurrent count queries
+parser.add_argument(
+    '--probe-concurrency',
+    default=1,
+    type=int,
+    help="Maximum number of concurrent count queries while planning."
+)
+
+# Include an option for number of concurrent sample list queries
+parser.add_argument(
+    '--fetch-concurrency',
+    default=1,
+    type=int,
+    help="Maximum number of concurrent sample list queries."
+)
+
+# Include an option for how to plan queries
+parser.add_argument(
+    '--strategy',
+    default='bisect',
+    choices=['bisect', 'histogram', 'paging'],
+    help=(
+        "How to plan sample list queries. bisect halves time ranges using"
+        " count queries. histogram uses one statistics query per meter."
+        " paging skips counts and pages backward through timestamps."
+    )
+)
+
+# Include an option for the histogram period
+parser.add_argument(
+    '--histogram-period',
+    default=3600,
+    type=int,
+    help="Period in seconds of each histogram bucket."
+)
+
+# Include an option for remembering sample densities between runs
+parser.add_argument(
+    '--density-file',
+    default=None,
+    help=(
+        "Json file of sample densities from previous runs. When provided,"
+        " queries are planned from known densities instead of counts."
+    )
+)
+
+# Include an option for sizing queries from measured latency
+parser.add_argument(
+    '--adaptive',
+    default=False,
+    action='store_true',
+    help=(
+        "Grow or shrink the number of samples per query between"
+        " --min-samples and --max-samples from measured latency."
+    )
+)
+
+# Include an option for the smallest adaptive query
+parser.add_argument(
+    '--min-samples',
+    default=1000,
+    type=int,
+    help="Minimum number of samples per query when adaptive."
+)
+
+# Include an option for the desired latency of adaptive queries
+parser.add_argument(
+    '--target-latency',
+    default=10.0,
+    type=float,
+    help="Desired seconds per sample list query when adaptive."
+)
+
+# Include an option for resuming interrupted fetches
+parser.add_argument(
+    '--checkpoint-dir',
+    default=None,
+    help=(
+        "Directory to save query plans and finished queries in. A rerun"
+        " with the same --start and --stop only fetches what is missing."
+    )
+)
+
+# Include an option for retrying failed queries
+parser.add_argument(
+    '--retries',
+    default=3,
+    type=int,
+    help=(
+        "Number of times to retry a query that timed out or failed with a"
+        " connection or server error."
+    )
+)
+
+# Include an option for the time between retries
+parser.add_argument(
+    '--backoff',
+    default=1.0,
+    type=float,
+    help="Seconds to wait before the first retry. Doubles with each retry."
+)
+
+# Include an option for duplicating slow queries
+parser.add_argument(
+    '--hedge',
+    default=False,
+    action='store_true',
+    help=(
+        "Send a duplicate sample list query when a query is slower than the"
+        " 95th percentile seen so far."
+    )
+)
+
+# Include an option for fetching all meters of a report at once
+parser.add_argument(
+    '--multi-meter',
+    default=False,
+    action='store_true',
+    help=(
+        "Fetch the samples of every meter sharing the same filters in one"
+        " pass with the complex query api."
+    )
+)
+
+# Include an option for reading meters from statistics
+parser.add_argument(
+    '--aggregate',
+    default=False,
+    action='store_true',
+    help=(
+        "Read meters from grouped statistics instead of samples when no"
+        " column needs sample metadata. Gauge meters are only read this way"
+        " for resources with a constant volume."
+    )
+)
+
+# Include options for approximate gauge readings
+parser.add_argument(
+    '--approximate',
+    default=False,
+    action='store_true',
+    help=(
+        "Approximate gauge readings from per period statistics averages."
+        " Implies --aggregate."
+    )
+)
+
+parser.add_argument(
+    '--approximate-period',
+    type=int,
+    default=3600,
+    help="Seconds per period of approximate gauge readings."
+)
+
+# Include an option for probing existence outside the report window
+parser.add_argument(
+    '--probe-boundaries',
+    default=False,
+    action='store_true',
+    help=(
+        "Fetch samples only within the report window. Count samples in the"
+        " 4 hours on either side to decide whether resources existed."
+    )
+)
+
+# Include an option for remembering resources between consecutive runs
+parser.add_argument(
+    '--state-file',
+    default=None,
+    help=(
+        "Json file of the last sample of each resource from the previous"
+        " run. When a run starts at or shortly after where the previous run"
+        " stopped, only samples since the previous stop are fetched before"
+        " the report window."
+    )
+)
+
+# Include an option for streaming sample lists
+parser.add_argument(
+    '--stream',
+    default=False,
+    action='store_true',
+    help=(
+        "Request gzip encoded sample lists and parse them while they"
+        " download. Parsing is incremental when ijson is installed. Works"
+        " with both legacy and keystone session ceilometer clients."
+    )
+)
+
+# Include an option for keeping timestamps as integers
+parser.add_argument(
+    '--epoch-timestamps',
+    default=False,
+    action='store_true',
+    help=(
+        "Keep sample timestamps as integer microseconds since the epoch"
+        " while reading. Uses less memory than datetimes."
+    )
+)
+
+# Include an option for how to compute readings
+parser.add_argument(
+    '--engine',
+    default='python',
+    choices=['python', 'numpy'],
+    help=(
+        "How to compute readings. numpy computes the readings of all"
+        " resources of a meter at once and needs numpy installed."
+    )
+)
+
 # Include an option for filename
 parser.add_argument(
     '--definition-filename',
@@ -0,0 +1,203 @@
+"""
+Module for saving the progress of long sample fetches.
+
+A checkpoint holds the schedule of a fetch and the samples of every chunk
+that finished. A rerun with the same meter, window and query loads both
+and only fetches the chunks that are missing.
+"""
+import hashlib
+import json
+import os
+import shutil
+import utils
+
+from log import logging
+from sample import Sample
+
+logger = logging.getLogger('usage.checkpoint')
+
+
+def _encode_q(q):
+    """Make a list of query filters json serializable.
+
+    :param q: List of query filters
+    :type q: List
+    :returns: List of query filters with datetimes as strings
+    :rtype: List
+    """
+    encoded = []
+    for f in q:
+        f = dict(f)
+        if f.get('type') == 'datetime':
+            f['value'] = f['value'].isoformat()
+        encoded.append(f)
+    return encoded
+
+
+def _decode_q(q):
+    """Restore a list of query filters encoded by _encode_q.
+
+    :param q: List of encoded query filters
+    :type q: List
+    :returns: List of query filters
+    :rtype: List
+    """
+    for f in q:
+        if f.get('type') == 'datetime':
+            f['value'] = _decode_time(f['value'])
+    return q
+
+
+def _decode_time(value):
+    """Parse an isoformatted datetime into a naive utc datetime.
+
+    :param value: Isoformatted datetime
+    :type value: String
+    :returns: Datetime
+    :rtype: datetime.datetime
+    """
+    return utils.normalize_time(utils.parse_datetime(value))
+
+
+class Checkpoint(object):
+    """Saved plan and chunks of one fetch."""
+    def __init__(self, directory, meter_name, start, stop, q):
+        """Init the checkpoint.
+
+        :param directory: Base directory for all checkpoints
+        :type directory: String
+        :param meter_name: Name of the meter
+        :type meter_name: String
+        :param start: Start of the fetch
+        :type start: datetime.datetime
+        :param stop: Stop of the fetch
+        :type stop: datetime.datetime
+        :param q: List of query filters excluding time
+        :type q: List
+        """
+        key = hashlib.sha1(json.dumps([
+            meter_name,
+            start.isoformat(),
+            stop.isoformat(),
+            _encode_q(q)
+        ], sort_keys=True)).hexdigest()
+        self.directory = os.path.join(os.path.abspath(directory), key)
+
+    def _path(self, name):
+        """Get the path of a file in this checkpoint.
+
+        :param name: Name of the file
+        :type name: String
+        :returns: Path of the file
+        :rtype: String
+        """
+        return os.path.join(self.directory, name)
+
+    def _load(self, name):
+        """Load a json file from this checkpoint.
+
+        :param name: Name of the file
+        :type name: String
+        :returns: Loaded data or None if not saved
+        :rtype: Object|None
+        """
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            logger.exception('Unable to load checkpoint {}'.format(path))
+            return None
+
+    def _save(self, name, data):
+        """Save data to a json file in this checkpoint.
+
+        :param name: Name of the file
+        :type name: String
+        :param data: Json serializable data
+        :type data: Object
+        """
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Another fetch worker made it first.
+                if not os.path.isdir(self.directory):
+                    raise
+        path = self._path(name)
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+
+    def load_plan(self):
+        """Load the saved schedule.
+
+        :returns: List of chunk field tuples or None if not saved.
+        :rtype: List|None
+        """
+        plan = self._load('plan.json')
+        if plan is None:
+            return None
+        return [
+            (
+                _decode_time(start),
+                _decode_time(stop),
+                _decode_q(q),
+                count,
+                estimated,
+                partitioned
+            )
+            for start, stop, q, count, estimated, partitioned in plan
+        ]
+
+    def save_plan(self, chunks):
+        """Save the schedule.
+
+        :param chunks: List of chunks
+        :type chunks: List
+        """
+        self._save('plan.json', [
+            [
+                chunk.start.isoformat(),
+                chunk.stop.isoformat(),
+                _encode_q(chunk.q),
+                chunk.count,
+                chunk.estimated,
+                chunk.partitioned
+            ]
+            for chunk in chunks
+        ])
+
+    def load_chunk(self, i):
+        """Load the samples of a finished chunk.
+
+        :param i: Index of the chunk in the schedule
+        :type i: Integer
+        :returns: List of samples or None if not saved.
+        :rtype: List|None
+        """
+        samples = self._load('chunk-{}.json'.format(i))
+        if samples is None:
+            return None
+        return [Sample(**s) for s in samples]
+
+    def save_chunk(self, i, samples):
+        """Save the samples of a finished chunk.
+
+        :param i: Index of the chunk in the schedule
+        :type i: Integer
+        :param samples: Samples in the chunk
+        :type samples: List
+        """
+        self._save(
+            'chunk-{}.json'.format(i),
+            [Sample.from_resource(s).to_dict() for s in samples]
+        )
+
+    def clear(self):
+        """Remove the checkpoint after a complete fetch."""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
@@ -0,0 +1,346 @@
+"""
+Module for reading many resources at once with numpy.
+
+Samples of a meter are added to columns as they are fetched. Timestamps
+are int64 microseconds since the epoch, volumes are numpy numbers and,
+once sorted, each resource is a segment of consecutive rows. Gauge,
+cumulative and delta values, usage start and usage stop of every resource
+are computed from the segment offsets instead of a python loop per sample.
+Only the first, last and last live status sample of each resource are kept
+as objects. Needs numpy.
+"""
+import utils
+
+from conversions import convert
+from exc import UnknownCounterTypeError
+from log import logging
+from reading import ALLOWED_METER_TYPES
+from reading import live_status
+from reading import select_metadata
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('usage.columnar')
+
+
+def available():
+    """Check whether numpy is installed.
+
+    :returns: Whether the columnar engine can be used
+    :rtype: Bool
+    """
+    return numpy is not None
+
+
+def _volumes(volumes):
+    """Convert a list of volumes to an array.
+
+    Integer volumes stay integers so cumulative and delta values match
+    the python engine.
+
+    :param volumes: Sample volumes
+    :type volumes: List
+    :returns: Volumes
+    :rtype: numpy.ndarray
+    """
+    volumes = numpy.array(volumes)
+    if volumes.dtype.kind not in 'iuf':
+        volumes = volumes.astype(numpy.float64)
+    return volumes
+
+
+class SampleColumns(object):
+    """Samples of a meter as columns with one segment per resource."""
+    def __init__(self):
+        """Init empty columns."""
+        self.resource_ids = []
+        self._codes = {}
+        # First, last and last live status sample of each resource.
+        self._first = []
+        self._last = []
+        self._live = []
+        # (codes, timestamps, volumes) arrays of added batches.
+        self._parts = []
+
+    def add_batch(self, samples):
+        """Add a batch of samples.
+
+        Only the first, last and last live status sample of each resource
+        in the batch are looked at in python.
+
+        :param samples: Samples with epoch microsecond timestamps
+        :type samples: List
+        """
+        if not samples:
+            return
+        resource_ids = [s.resource_id for s in samples]
+        for resource_id in set(resource_ids).difference(self._codes):
+            self._codes[resource_id] = len(self.resource_ids)
+            self.resource_ids.append(resource_id)
+            self._first.append(None)
+            self._last.append(None)
+            self._live.append(None)
+        codes = numpy.array(
+            [self._codes[resource_id] for resource_id in resource_ids],
+            dtype=numpy.int64
+        )
+        timestamps = numpy.array(
+            [s.timestamp for s in samples], dtype=numpy.int64
+        )
+        self._parts.append((
+            codes, timestamps, _volumes([s.counter_volume for s in samples])
+        ))
+
+        # Lexsort is stable, so samples sharing a timestamp keep their order
+        # and later samples win ties.
+        order = numpy.lexsort((timestamps, codes))
+        sorted_codes = codes[order]
+        starts = numpy.flatnonzero(sorted_codes[1:] != sorted_codes[:-1]) + 1
+        firsts = numpy.concatenate(([0], starts)).tolist()
+        lasts = numpy.concatenate((starts - 1, [len(samples) - 1])).tolist()
+        order = order.tolist()
+        sorted_codes = sorted_codes.tolist()
+        for first, last in zip(firsts, lasts):
+            code = sorted_codes[first]
+            sample = samples[order[first]]
+            current = self._first[code]
+            if current is None or sample.timestamp < current.timestamp:
+                self._first[code] = sample
+            sample = samples[order[last]]
+            current = self._last[code]
+            if current is None or sample.timestamp >= current.timestamp:
+                self._last[code] = sample
+            # Step back from the newest sample to the first live status
+            # that is newer than the one already known.
+            current = self._live[code]
+            for i in xrange(last, first - 1, -1):
+                sample = samples[order[i]]
+                if current is not None and \
+                        sample.timestamp < current.timestamp:
+                    break
+                if live_status(sample.resource_metadata or {}):
+                    self._live[code] = sample
+                    break
+
+    def last_samples(self):
+        """Get the last sample of each resource.
+
+        :returns: Samples
+        :rtype: List
+        """
+        return list(self._last)
+
+    def _columns(self):
+        """Join the batches and sort rows by resource and timestamp.
+
+        :returns: (timestamps, volumes, offsets) tuple. Rows offsets[i] to
+            offsets[i + 1] belong to resource_ids[i].
+        :rtype: Tuple
+        """
+        codes = numpy.concatenate([p[0] for p in self._parts])
+        timestamps = numpy.concatenate([p[1] for p in self._parts])
+        volumes = numpy.concatenate([p[2] for p in self._parts])
+        self._parts = []
+        # Lexsort is stable, so samples sharing a timestamp keep their order.
+        order = numpy.lexsort((timestamps, codes))
+        codes = codes[order]
+        offsets = numpy.searchsorted(
+            codes, numpy.arange(len(self.resource_ids) + 1), 'left'
+        )
+        return timestamps[order], volumes[order], offsets
+
+    def values(self, meter_type, start, stop, before, after):
+        """Compute the value, usage start and usage stop of every resource.
+
+        Matches reading.Reading given existed_before and existed_after.
+
+        :param meter_type: One of gauge, cumulative or delta
+        :type meter_type: String
+        :param start: Reading start time
+        :type start: Datetime
+        :param stop: Reading stop time
+        :type stop: Datetime
+        :param before: Ids of resources that existed before start
+        :type before: Set
+        :param after: Ids of resources that existed after stop
+        :type after: Set
+        :returns: (values, usage starts, usage stops) arrays in the order of
+            resource_ids. Usage times are epoch microseconds.
+        :rtype: Tuple
+        """
+        ts, volumes, offsets = self._columns()
+        first = offsets[:-1]
+        last = offsets[1:] - 1
+        existed_before = numpy.array(
+            [resource_id in before for resource_id in self.resource_ids],
+            dtype=bool
+        )
+        existed_after = numpy.array(
+            [resource_id in after for resource_id in self.resource_ids],
+            dtype=bool
+        )
+        usage_start = numpy.where(
+            existed_before, utils.to_epoch_micros(start), ts[first]
+        )
+        usage_stop = numpy.where(
+            existed_after, utils.to_epoch_micros(stop), ts[last]
+        )
+
+        if meter_type == 'cumulative':
+            values = volumes[last] - volumes[first]
+        elif meter_type == 'delta':
+            values = numpy.add.reduceat(volumes, first)
+        else:
+            values = self._gauge(
+                ts, volumes, first, last, usage_start, usage_stop
+            )
+        return values, usage_start, usage_stop
+
+    def _gauge(self, ts, volumes, first, last, usage_start, usage_stop):
+        """Trapezoidal integral of each resource's samples.
+
+        Like Reading._gauge, a sample is assumed at usage start and usage
+        stop with the volume of the first and last sample.
+
+        :returns: Values in hours
+        :rtype: numpy.ndarray
+        """
+        volumes = volumes.astype(numpy.float64)
+        areas = (ts[1:] - ts[:-1]) * (volumes[1:] + volumes[:-1])
+        # Pairs across two resources end at a segment start.
+        areas[first[1:] - 1] = 0
+        totals = numpy.add.reduceat(numpy.append(areas, 0), first)
+        totals += (ts[first] - usage_start) * 2 * volumes[first]
+        totals += (usage_stop - ts[last]) * 2 * volumes[last]
+        # Microseconds to hours.
+        return totals / 2 / 1000000.0 / 3600
+
+    def readings(self, start, stop, before, after):
+        """Yield a reading for every resource sorted by resource id.
+
+        :param start: Reading start time
+        :type start: Datetime
+        :param stop: Reading stop time
+        :type stop: Datetime
+        :param before: Ids of resources that existed before start
+        :type before: Set
+        :param after: Ids of resources that existed after stop
+        :type after: Set
+        :yields: ColumnarReading objects
+        """
+        if not self.resource_ids:
+            return
+        # Samples of a meter share one type.
+        meter_type = self._first[0].counter_type
+        if meter_type not in ALLOWED_METER_TYPES:
+            raise UnknownCounterTypeError(meter_type)
+        values, usage_starts, usage_stops = self.values(
+            meter_type, start, stop, before, after
+        )
+        values = values.tolist()
+        usage_starts = usage_starts.tolist()
+        usage_stops = usage_stops.tolist()
+        order = sorted(
+            xrange(len(self.resource_ids)),
+            key=self.resource_ids.__getitem__
+        )
+        for i in order:
+            resource_id = self.resource_ids[i]
+            yield ColumnarReading(
+                self._first[i],
+                self._last[i],
+                self._live[i],
+                start,
+                stop,
+                values[i],
+                utils.from_epoch_micros(usage_starts[i]),
+                utils.from_epoch_micros(usage_stops[i]),
+                resource_id in before,
+                resource_id in after
+            )
+
+
+class ColumnarReading:
+    """Models a reading of one resource computed from sample columns.
+
+    Has the same attributes as reading.Reading except for samples, which
+    are not kept.
+    """
+    def __init__(self,
+                 first,
+                 last,
+                 live,
+                 start,
+                 stop,
+                 value,
+                 usage_start,
+                 usage_stop,
+                 existed_before,
+                 existed_after):
+        """Init the reading.
+
+        :param first: First sample of the resource during the reading
+        :type first: usage.sample.Sample
+        :param last: Last sample of the resource during the reading
+        :type last: usage.sample.Sample
+        :param live: Last sample with a live status or None
+        :type live: usage.sample.Sample|None
+        :param start: Starting datetime.
+        :type start: Datetime
+        :param stop: Stopping datetime.
+        :type stop: Datetime
+        :param value: Value of the reading
+        :type value: Numeric
+        :param usage_start: Usage start time
+        :type usage_start: Datetime
+        :param usage_stop: Usage stop time
+        :type usage_stop: Datetime
+        :param existed_before: Whether the resource existed before start.
+        :type existed_before: Bool
+        :param existed_after: Whether the resource existed after stop.
+        :type existed_after: Bool
+        """
+        self.start = start
+        self.stop = stop
+        self.resource_id = first.resource_id
+        self.project_id = first.project_id
+        self.meter_name = last.meter
+        self.meter_type = first.counter_type
+        self.value = value
+        self.usage_start = usage_start
+        self.usage_stop = usage_stop
+        self.samples = []
+        self._existed_before = existed_before
+        self._existed_after = existed_after
+        self.metadata = select_metadata(
+            [s for s in (live, last) if s is not None]
+        )
+
+    def resource_existed_before(self):
+        """Determine if resource existed before self.start.
+
+        :returns: Whether the resource existed before start
+        :rtype: Bool
+        """
+        return self._existed_before
+
+    def resource_existed_after(self):
+        """Determine if resource existed after self.stop.
+
+        :returns: Whether the resource existed after stop
+        :rtype: Bool
+        """
+        return self._existed_after
+
+    def convert(self, conversion):
+        """Convert value using function func.
+
+        :param conversion: Conversion function name
+        :type conversion: String|None
+        """
+        if self.value is None or conversion is None:
+            return
+        self.value = convert(conversion, self.value)
@@ -7,8 +7,11 @@ import utils
 from args.report import parser as report_parser
 from args.summary import parser as summary_parser
 from clients import ClientManager
+from density import DensityModel
 from log import logging
+from meter import EXTRA_TIME
 from report import Report
+from state import BoundaryState
 from summary import Summary
 
 
@@ -21,6 +24,33 @@ logger = logging.getLogger('usage')
 logger.setLevel(logging.INFO)
 
 
+def scheduler_options(args):
+    """Get keyword arguments for the query scheduler from cli args.
+
+    :param args: Parsed report arguments
+    :type args: argparse.Namespace
+    :returns: Scheduler keyword arguments
+    :rtype: Dict
+    """
+    options = {
+        'concurrency': args.probe_concurrency,
+        'fetch_concurrency': args.fetch_concurrency,
+        'strategy': args.strategy,
+        'period': args.histogram_period,
+        'adaptive': args.adaptive,
+        'min_samples': args.min_samples,
+        'target_latency': args.target_latency,
+        'checkpoint_dir': args.checkpoint_dir,
+        'retries': args.retries,
+        'backoff': args.backoff,
+        'hedge': args.hedge,
+        'streaming': args.stream
+    }
+    if args.density_file:
+        options['density_model'] = DensityModel(args.density_file)
+    return options
+
+
 def console_licensing():
     """Summarizes a csv report."""
     from licensing import Licensing
@@ -93,6 +123,9 @@ def console_report():
     else:
         start, stop = utils.mtd_range()
         out = out or output.Mtd(args.output_directory, start, stop)
+    boundary_state = None
+    if args.state_file:
+        boundary_state = BoundaryState(args.state_file, EXTRA_TIME)
     try:
         p_start = time.time()
         r = Report(
@@ -101,7 +134,15 @@ def console_report():
             out,
             start=start,
             stop=stop,
-            max_samples=args.max_samples
+            max_samples=args.max_samples,
+            scheduler_options=scheduler_options(args),
+            multi_meter=args.multi_meter,
+            aggregate=args.aggregate,
+            approximate=args.approximate_period if args.approximate else None,
+            probe_boundaries=args.probe_boundaries,
+            state=boundary_state,
+            epoch_timestamps=args.epoch_timestamps,
+            engine=args.engine
         )
         r.run()
         logger.debug("Finished in {} seconds".format(time.time() - p_start))
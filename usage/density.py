@@ -0,0 +1,83 @@
+"""
+Module for remembering how densely meters are sampled.
+
+Densities are stored as samples per hour in a small json file keyed by
+meter name and query so recurring reports can plan without counting.
+"""
+import json
+import os
+
+from log import logging
+
+logger = logging.getLogger('usage.density')
+
+# Weight of the newest observation when smoothing densities.
+_ALPHA = 0.5
+
+
+class DensityModel(object):
+    """Persisted per meter sample densities."""
+    def __init__(self, filename):
+        """Init the model and load any existing densities.
+
+        :param filename: Name of the json file holding densities.
+        :type filename: String
+        """
+        self.filename = os.path.abspath(filename)
+        self.densities = {}
+        self.load()
+
+    def load(self):
+        """Load densities from file if it exists."""
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self.densities = json.load(f)
+        except Exception:
+            logger.exception(
+                'Unable to load densities from {}'.format(self.filename)
+            )
+            self.densities = {}
+
+    def save(self):
+        """Save densities to file."""
+        directory = os.path.dirname(self.filename)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = '{}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.densities, f, indent=2, sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def predict(self, key):
+        """Get the expected number of samples per hour.
+
+        :param key: Meter and query key
+        :type key: String
+        :returns: Samples per hour or None if unknown
+        :rtype: Float|None
+        """
+        return self.densities.get(key)
+
+    def record(self, key, count, seconds):
+        """Record an observed number of samples over a number of seconds.
+
+        :param key: Meter and query key
+        :type key: String
+        :param count: Number of samples observed
+        :type count: Integer
+        :param seconds: Length of time observed in seconds
+        :type seconds: Float
+        """
+        if seconds <= 0:
+            return
+        observed = count * 3600.0 / seconds
+        previous = self.densities.get(key)
+        if previous is not None:
+            observed = _ALPHA * observed + (1 - _ALPHA) * previous
+        self.densities[key] = observed
+        logger.debug('Density of {} is {} samples per hour'.format(
+            key, observed
+        ))
+        self.save()
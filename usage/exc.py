@@ -41,3 +41,17 @@ class NoSamplesError(Exception):
     def __init__(self):
         msg = "Resource does not have any samples during the time period."
         super(NoSamplesError, self).__init__(msg)
+
+
+class UnknownStrategyError(Exception):
+    """Error for unknown scheduling strategies."""
+    def __init__(self, strategy):
+        msg = 'Unknown scheduling strategy {}.'.format(strategy)
+        super(UnknownStrategyError, self).__init__(msg)
+
+
+class UnknownEngineError(Exception):
+    """Error for unknown reading engines."""
+    def __init__(self, engine):
+        msg = 'Unknown reading engine {}.'.format(engine)
+        super(UnknownEngineError, self).__init__(msg)
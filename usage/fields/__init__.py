@@ -14,6 +14,18 @@ for entry_point in iter_entry_points(group='usage.fields'):
             'Unable to load field function {}'.format(entry_point.name))
 
 
+def normalize_name(name):
+    """Transform a field function name into a python compatible name.
+
+    :param name: Field function name from a report definition
+    :type name: String
+    :returns: Normalized name
+    :rtype: String
+    """
+    # TODO - Move towards more sophisticated function mapping.
+    return name.lower().replace(' ', '_').replace('.', '_')
+
+
 def field_function(name, definition, item, reading):
     """Run a field function. Always send defintion, item, and reading.
 
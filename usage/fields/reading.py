@@ -6,6 +6,14 @@ from usage.log import logging
 
 _ALLOWED_RESOURCE_ATTRS = ['resource_id', 'project_id', 'metadata']
 
+# Metadata keys read by field functions other than metadata and image
+# metadata fields.
+METADATA_FIELD_KEYS = {
+    'availability_zone': ['availability_zone'],
+    'display_name': ['display_name'],
+    'instance_type': ['instance_type']
+}
+
 logger = logging.getLogger('usage.fields')
 
 
@@ -51,6 +59,28 @@ def _get_reading_attr(reading, attr):
     return None
 
 
+def metadata_keys(func):
+    """Get the metadata keys a field function reads.
+
+    :param func: Normalized name of the field function
+    :type func: String
+    :returns: List of lowercase metadata keys or None if the function is
+        not known to read metadata.
+    :rtype: List|None
+    """
+    if func.startswith('metadata:'):
+        _, key = func.split(':', 1)
+        return [
+            'metadata.{}'.format(key).lower(),
+            'properties.{}'.format(key).lower(),
+            'metadata'
+        ]
+    if func.startswith('image_metadata:'):
+        _, key = func.split(':', 1)
+        return ['image_meta.{}'.format(key).lower()]
+    return METADATA_FIELD_KEYS.get(func)
+
+
 def metadata_field(key, r):
     """Get value of metadata field if present.
 
@@ -1,38 +1,79 @@
+import collections
+import columnar
 import datetime
 import itertools
+import operator
 import query
+import time
 import utils
 
+from aggregate import AGGREGATE_METER_TYPES
+from aggregate import ApproximateGaugeReading
+from aggregate import constant_volume
+from aggregate import StatisticsReading
 from exc import InvalidTimeRangeError
 from exc import NoSamplesError
+from exc import UnknownEngineError
 from log import logging
+from reading import is_deleted
 from reading import Reading
+from reading import select_metadata
+from sample import Sample
 
 logger = logging.getLogger('usage.meter')
 
+# Ways of computing reading values. numpy needs numpy installed.
+ENGINES = ['python', 'numpy']
 
-def _cmp_sample(a, b):
-    """Compare two samples.
+# Samples are read this far outside of the reading window to determine
+# whether resources existed before and after it. 4 * 60 * 60 = 14400
+EXTRA_TIME = datetime.timedelta(seconds=14400)
 
-    First compare the resource ids. Compare the timestamps if the
-    resource ids are the same.
+# Resources per complex query when fetching the metadata of last samples.
+_METADATA_BATCH = 100
 
-    :param a: First sample
-    :param b: Second sample
-    :return: Result of cmp function.
-    :rtype: Integer
+# Sample timestamps have microsecond precision. Fetching after start minus
+# this includes samples at exactly start.
+_PRECISION = datetime.timedelta(microseconds=1)
+
+
+def fetch_window(start, stop, probe_boundaries=False, known_before=None):
+    """Get the time range samples are fetched over for a reading window.
+
+    :param start: Start date and time.
+    :type start: datetime
+    :param stop: Stop date and time.
+    :type stop: datetime
+    :param probe_boundaries: Whether existence outside the window is probed
+        with counts instead of read from extra samples.
+    :type probe_boundaries: Bool
+    :param known_before: Stop of a previous run that already knows which
+        resources existed before it. At or before start. None if unknown.
+    :type known_before: datetime|None
+    :returns: (start, stop) tuple
+    :rtype: Tuple
     """
-    result = cmp(a.resource_id, b.resource_id)
-    if result == 0:
-        result = cmp(a.timestamp, b.timestamp)
-    return result
+    if probe_boundaries:
+        return start - _PRECISION, stop
+    if known_before is not None:
+        return known_before - _PRECISION, stop + EXTRA_TIME
+    return start - EXTRA_TIME, stop + EXTRA_TIME
 
 
 class Meter:
     """
     Class for interacting with a ceilometer meter.
     """
-    def __init__(self, client, name, max_samples=15000):
+    def __init__(self,
+                 client,
+                 name,
+                 max_samples=15000,
+                 scheduler_options=None,
+                 probe_boundaries=False,
+                 state=None,
+                 metadata_keys=None,
+                 epoch_timestamps=False,
+                 engine='python'):
         """Init the meter.
 
         :param client: Ceilometer client
@@ -41,13 +82,40 @@ class Meter:
         :type name: String
         :param max_samples: Max number of samples per query.
         :type max_samples: Integer
+        :param scheduler_options: Extra keyword arguments for the scheduler.
+        :type scheduler_options: Dict
+        :param probe_boundaries: Whether to fetch only samples in the reading
+            window and count samples outside of it to decide whether
+            resources existed before and after.
+        :type probe_boundaries: Bool
+        :param state: Last samples of resources from previous runs.
+        :type state: usage.state.BoundaryState
+        :param metadata_keys: Lowercase resource metadata keys to keep.
+            Other keys are dropped as samples are read. None keeps all.
+        :type metadata_keys: Set|None
+        :param epoch_timestamps: Whether to keep sample timestamps as
+            integer microseconds since the epoch instead of datetimes.
+        :type epoch_timestamps: Bool
+        :param engine: How to compute reading values. One of ENGINES.
+            Falls back to python when numpy is not installed.
+        :type engine: String
         """
         self.client = client
         self.name = name
         self.max_samples = max_samples
+        self.scheduler_options = scheduler_options or {}
+        self.probe_boundaries = probe_boundaries
+        self.state = state
+        self.metadata_keys = metadata_keys
+        self.epoch_timestamps = epoch_timestamps
+        if engine not in ENGINES:
+            raise UnknownEngineError(engine)
+        if engine == 'numpy' and not columnar.available():
+            logger.warning("numpy is not installed. Using python engine.")
+            engine = 'python'
+        self.engine = engine
 
-        # Extra time is 4 hours. 4 * 60 * 60 = 14400
-        self._extra_time = datetime.timedelta(seconds=14400)
+        self._extra_time = EXTRA_TIME
 
     def last_non_deleted_sample(self, group):
         """Get last sample that is not in deleted or deleting.
@@ -63,29 +131,51 @@ class Meter:
         :rtype: sample
         """
         deleted_status = set(['deleted', 'deleting'])
+        checked = None
         for i in xrange(len(group) - 1, -1, -1):
-            if group[i].resource_metadata.get('status') not in deleted_status:
+            # Samples sharing metadata with the last checked sample have
+            # the same status.
+            metadata = group[i].resource_metadata
+            if metadata is checked:
+                continue
+            checked = metadata
+            if metadata.get('status') not in deleted_status:
                 return group[i]
         return group[-1]
 
-    def _reading_generator(self, samples, start, stop):
+    def _reading_generator(self, buckets, start, stop, boundaries=None):
         """Yields one reading at a time.
 
-        Samples are grouped by resource id(already sorted by resource id)
-        and then used to create a reading object.
+        Each bucket of samples of one resource is used to create a reading
+        object.
 
-        :param samples: List of samples sorted by resource_id and timestamp.
-        :type samples: List
+        :param buckets: List of (resource_id, samples) tuples sorted by
+            resource id. Samples are sorted by timestamp.
+        :type buckets: List
         :param start: Reading start time
         :type start: Datetime
         :param stop: Reading stop time
         :type stop: Datetime
+        :param boundaries: (before, after) tuple of sets of ids of resources
+            that existed before start and after stop. None, or None in
+            place of a set, to decide from samples outside of the window.
+        :type boundaries: Tuple|None
         :yields: Reading objects
         """
-        # Yield a reading for each resource/meter pair
-        for _, g in itertools.groupby(samples, lambda x: x.resource_id):
+        before, after = boundaries or (None, None)
+        epoch = self.epoch_timestamps
+        # Yield a reading for each resource/meter pair. Buckets are popped
+        # so samples are released once their reading is consumed.
+        buckets.reverse()
+        while buckets:
+            resource_id, samples = buckets.pop()
+            kwargs = {}
+            if before is not None:
+                kwargs['existed_before'] = resource_id in before
+            if after is not None:
+                kwargs['existed_after'] = resource_id in after
             try:
-                yield Reading(list(g), start, stop)
+                yield Reading(samples, start, stop, epoch=epoch, **kwargs)
             except NoSamplesError:
                 continue
 
@@ -101,6 +191,410 @@ class Meter:
         :return: Value of reading
         :rtype: Float
         """
+        start, stop = self._window(start, stop)
+        existed_before = previous_stop = None
+        if self.state and not self.probe_boundaries:
+            previous_stop = self.state.previous_stop(
+                self._state_key(q), start
+            )
+            existed_before = self.state.existed_before(
+                self._state_key(q), start
+            )
+        fetch_start, fetch_stop = fetch_window(
+            start, stop, self.probe_boundaries, previous_stop
+        )
+
+        # The scheduler adds times to the query. Unless boundaries are
+        # probed or known, times are +- the extra time. When known, samples
+        # since the previous stop are fetched.
+        schedule = query.Scheduler(
+            self.client,
+            self.name,
+            fetch_start,
+            fetch_stop,
+            q=list(q or []),
+            max_samples=self.max_samples,
+            **self.scheduler_options
+        )
+        for chunk in schedule:
+            logger.debug("{} - {} - {}".format(
+                chunk.start, chunk.stop, chunk.count
+            ))
+        logger.debug("Count of scheduled samples {}".format(schedule.count()))
+        return self.read_batches(
+            schedule.iter_batches(),
+            start,
+            stop,
+            q=q,
+            existed_before=existed_before
+        )
+
+    def _state_key(self, q):
+        """Key of this meter and query in the boundary state.
+
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        :returns: State key
+        :rtype: String
+        """
+        return '{}?{}'.format(self.name, query._query_string(q or []))
+
+    def _call(self, func, **kwargs):
+        """Call a client function with the scheduler's retry options.
+
+        :param func: Client function
+        :type func: Callable
+        :param kwargs: Keyword arguments for the function
+        :type kwargs: Dict
+        :returns: Result of the function
+        :rtype: Object
+        """
+        return query.call(
+            func,
+            kwargs,
+            retries=self.scheduler_options.get('retries', 0),
+            backoff=self.scheduler_options.get('backoff', 1.0)
+        )
+
+    def _statistics(self, q, groupby, aggregates=None, period=None):
+        """Get statistics of this meter grouped by fields.
+
+        :param q: List of filters.
+        :type q: List
+        :param groupby: Fields to group by
+        :type groupby: List
+        :param aggregates: Aggregate functions. Defaults to the standard
+            aggregates.
+        :type aggregates: List|None
+        :param period: Seconds per period or None for a single period.
+        :type period: Integer|None
+        :returns: List of statistics
+        :rtype: List
+        """
+        logger.debug('{} -g {}'.format(
+            query._count_to_cli(self.name, q, period=period), ','.join(groupby)
+        ))
+        kwargs = {'meter_name': self.name, 'q': q, 'groupby': groupby}
+        if aggregates:
+            kwargs['aggregates'] = aggregates
+        if period:
+            kwargs['period'] = period
+        p_start = time.time()
+        stats = self._call(self.client.statistics.list, **kwargs)
+        logger.debug("Grouped statistics finished in {} seconds.".format(
+            time.time() - p_start
+        ))
+        return stats or []
+
+    def _existing_resources(self, q):
+        """Get the ids of resources with samples matching q.
+
+        :param q: List of filters.
+        :type q: List
+        :returns: Set of resource ids
+        :rtype: Set
+        """
+        stats = self._statistics(
+            q, ['resource_id'], aggregates=[{'func': 'count'}]
+        )
+        return set(s.groupby['resource_id'] for s in stats if s.count)
+
+    def boundaries(self, start, stop, q=None):
+        """Get the resources with samples just outside a window.
+
+        Uses two grouped counts over the extra time on either side instead
+        of fetching the samples.
+
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        :returns: (before, after) tuple of sets of resource ids
+        :rtype: Tuple
+        """
+        q = list(q or [])
+        before = self._existing_resources(q + [
+            query.query(
+                'timestamp', 'gt', start - self._extra_time, 'datetime'
+            ),
+            query.query('timestamp', 'lt', start, 'datetime')
+        ])
+        after = self._existing_resources(q + [
+            query.query('timestamp', 'gt', stop, 'datetime'),
+            query.query('timestamp', 'le', stop + self._extra_time, 'datetime')
+        ])
+        return before, after
+
+    def meter_type(self, q):
+        """Get the type of this meter from a single sample.
+
+        :param q: List of filters.
+        :type q: List
+        :returns: Type of the meter or None if there are no samples.
+        :rtype: String|None
+        """
+        logger.debug(query._sample_list_to_cli(self.name, q, 1))
+        samples = self._call(
+            self.client.samples.list, meter_name=self.name, q=q, limit=1
+        )
+        if not samples:
+            return None
+        return samples[0].counter_type
+
+    def aggregate(self,
+                  start=None,
+                  stop=None,
+                  q=None,
+                  period=None,
+                  metadata=False):
+        """Read a meter from grouped statistics without listing samples.
+
+        Only cumulative, delta and gauge meters can be read this way.
+        Gauge resources whose volume changed during the window are read
+        from their samples instead, all in one read, unless a period is
+        given. Then every gauge reading is approximated from per period
+        averages.
+
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        :param period: Seconds per period of approximate gauge readings.
+        :type period: Integer|None
+        :param metadata: Whether to give readings the metadata of the last
+            samples of their resources. Otherwise metadata is empty.
+        :type metadata: Bool
+        :returns: List of readings or None if the meter type can not be
+            aggregated.
+        :rtype: List|None
+        """
+        start, stop = self._window(start, stop)
+        q = list(q or [])
+        during_q = q + [
+            query.query('timestamp', 'ge', start, 'datetime'),
+            query.query('timestamp', 'le', stop, 'datetime')
+        ]
+        meter_type = self.meter_type(during_q)
+        if meter_type is None:
+            return []
+        if meter_type not in AGGREGATE_METER_TYPES:
+            return None
+
+        approximate = bool(period) and meter_type == 'gauge'
+        by_resource = {}
+        stats = self._statistics(
+            during_q,
+            ['resource_id', 'project_id'],
+            period=period if approximate else None
+        )
+        for stat in stats:
+            by_resource.setdefault(stat.groupby['resource_id'], []) \
+                .append(stat)
+        before, after = self.boundaries(start, stop, q)
+        if approximate:
+            readings = self._approximate(
+                by_resource, start, stop, before, after
+            )
+            if metadata:
+                self._set_metadata(readings, start, stop, q)
+            return readings
+
+        readings = []
+        varying = set()
+        for resource_id, stats in sorted(by_resource.items()):
+            if meter_type == 'gauge' and not constant_volume(stats):
+                varying.add(resource_id)
+                continue
+            readings.append(StatisticsReading(
+                stats,
+                start,
+                stop,
+                self.name,
+                meter_type,
+                existed_before=resource_id in before,
+                existed_after=resource_id in after
+            ))
+        if metadata:
+            self._set_metadata(readings, start, stop, q)
+        if varying:
+            readings.extend(self._read_varying(start, stop, q, varying))
+            readings.sort(key=operator.attrgetter('resource_id'))
+        return readings
+
+    def _read_varying(self, start, stop, q, resource_ids):
+        """Read the gauge resources whose volume changed in one read.
+
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        :param resource_ids: Ids of the resources to read
+        :type resource_ids: Set
+        :returns: List of readings
+        :rtype: List
+        """
+        logger.debug("Volume of {} resources changed. Reading samples.".format(
+            len(resource_ids)
+        ))
+        if len(resource_ids) == 1:
+            q = q + [query.query('resource_id', 'eq', list(resource_ids)[0])]
+        return [
+            r for r in self.read(start, stop, q)
+            if r.resource_id in resource_ids
+        ]
+
+    def _set_metadata(self, readings, start, stop, q):
+        """Give readings the metadata of their resources' last samples.
+
+        The last samples are fetched in bulk with one complex query per
+        _METADATA_BATCH resources, using the time of each resource's last
+        sample from its statistics. Resources whose last sample is missing
+        or in a deleted status have their samples listed to find the last
+        non deleted metadata like reading.Reading.
+
+        :param readings: Statistics readings without metadata
+        :type readings: List
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        """
+        during_q = q + [
+            query.query('timestamp', 'ge', start, 'datetime'),
+            query.query('timestamp', 'le', stop, 'datetime')
+        ]
+
+        def last_samples(batch):
+            last = {r.resource_id: r.last_sample_time for r in batch}
+            # Ties on the last timestamp are rare. Resources cut off by the
+            # limit are listed below.
+            return self._call(
+                query.query_samples,
+                client=self.client,
+                expression=query._last_samples_filter(
+                    self.name, during_q, last
+                ),
+                limit=2 * len(batch)
+            )
+
+        concurrency = self.scheduler_options.get('concurrency', 1)
+        batches = [
+            readings[i:i + _METADATA_BATCH]
+            for i in xrange(0, len(readings), _METADATA_BATCH)
+        ]
+        metadata = {}
+        for samples in query._map(last_samples, batches, concurrency):
+            # Samples are listed newest first.
+            for s in samples:
+                metadata.setdefault(s.resource_id, s.resource_metadata)
+
+        unknown = [
+            r.resource_id for r in readings
+            if r.resource_id not in metadata or
+            is_deleted(metadata[r.resource_id])
+        ]
+        listed = query._map(
+            lambda resource_id: self._list_metadata(
+                resource_id, start, stop, q
+            ),
+            unknown,
+            concurrency
+        )
+        metadata.update(zip(unknown, listed))
+        for reading in readings:
+            reading.metadata = metadata.get(reading.resource_id) or {}
+
+    def _list_metadata(self, resource_id, start, stop, q):
+        """Find the last non deleted metadata of one resource.
+
+        Pages through the resource's samples between start and stop at
+        most max_samples at a time.
+
+        :param resource_id: Id of the resource
+        :type resource_id: String
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters excluding timestamp filters
+        :type q: List
+        :returns: Resource metadata
+        :rtype: Dict
+        """
+        options = dict(self.scheduler_options)
+        options.update(
+            strategy='paging', density_model=None, checkpoint_dir=None
+        )
+        schedule = query.Scheduler(
+            self.client,
+            self.name,
+            start - _PRECISION,
+            stop,
+            q=q + [query.query('resource_id', 'eq', resource_id)],
+            max_samples=self.max_samples,
+            **options
+        )
+        samples = sorted(
+            schedule.list(),
+            key=lambda s: utils.parse_timestamp(s.timestamp)
+        )
+        return select_metadata(samples) or {}
+
+    def _approximate(self, by_resource, start, stop, before, after):
+        """Create approximate gauge readings and log their bounds.
+
+        :param by_resource: Mapping of resource id to period statistics
+        :type by_resource: Dict
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param before: Ids of resources that existed before start
+        :type before: Set
+        :param after: Ids of resources that existed after stop
+        :type after: Set
+        :returns: List of readings
+        :rtype: List
+        """
+        readings = [
+            ApproximateGaugeReading(
+                stats,
+                start,
+                stop,
+                self.name,
+                existed_before=resource_id in before,
+                existed_after=resource_id in after
+            )
+            for resource_id, stats in sorted(by_resource.items())
+        ]
+        logger.info(
+            "Approximate {} total {} assuming between {} and {}.".format(
+                self.name,
+                sum(r.value for r in readings),
+                sum(r.value_bounds[0] for r in readings),
+                sum(r.value_bounds[1] for r in readings)
+            )
+        )
+        return readings
+
+    def _window(self, start, stop):
+        """Default and check the reading window.
+
+        :param start: Start date and time.
+        :type start: datetime|None
+        :param stop: Stop date and time.
+        :type stop: datetime|None
+        :returns: (start, stop) tuple
+        :rtype: Tuple
+        """
         # Default times to month to date
         default_start, default_stop = utils.mtd_range()
         if not start:
@@ -112,42 +606,138 @@ class Meter:
         logger.info("Meter name: {}".format(self.name))
         if start > stop:
             raise InvalidTimeRangeError(start, stop)
+        return start, stop
 
-        # Add times to query. times are +- the extra time.
-        q = q or []
-        q.append(query.query(
-            'timestamp', 'gt', start - self._extra_time, 'datetime'
-        ))
-        q.append(query.query(
-            'timestamp', 'le', stop + self._extra_time, 'datetime'
-        ))
+    def read_batches(self,
+                     batches,
+                     start=None,
+                     stop=None,
+                     q=None,
+                     existed_before=None):
+        """Read a meter from samples that were already fetched.
 
-        schedule = query.Scheduler(
-            self.client,
-            self.name,
-            start - self._extra_time,
-            stop + self._extra_time,
-            q=[],
-            max_samples=self.max_samples
-        )
-        for s_start, s_stop, s_query, s_count in schedule:
-            logger.debug("{} - {} - {}".format(s_start, s_stop, s_count))
-        logger.debug("Count of scheduled samples {}".format(schedule.count()))
+        Samples must cover the fetch_window of start and stop. Samples
+        shared with another reading may already have parsed timestamps,
+        which must be in the form this meter keeps them in.
 
-        # Get samples
-        samples = schedule.list()
-        logger.debug(
-            "{} samples according to sample-list.".format(len(samples))
-        )
+        Batches are cut by time, so any batch may hold samples of any
+        resource and no resource is complete before the last batch. Samples
+        before start and after stop only tell whether resources existed, so
+        they are dropped as they arrive. Samples between start and stop are
+        kept until the last batch is consumed, so memory grows with the
+        samples in the reading window rather than the fetch window. Each
+        resource's samples are released once its reading is consumed.
 
-        # Convert timestamps from strings to datetime objects
-        for s in samples:
-            s.timestamp = utils.normalize_time(
-                utils.parse_datetime(s.timestamp)
-            )
+        With the numpy engine, samples between start and stop are added to
+        columns as they arrive and only a few samples per resource are
+        kept. Timestamps are then always epoch microseconds.
 
-        # Sort by resource id and then timestamps in ascending order
-        samples.sort(cmp=_cmp_sample)
+        :param batches: Iterable of lists of samples of this meter.
+        :type batches: Iterable
+        :param start: Start date and time.
+        :type start: datetime
+        :param stop: Stop date and time.
+        :type stop: datetime
+        :param q: List of filters the samples were fetched with, excluding
+            timestamp filters. Used to probe boundaries.
+        :type q: List
+        :param existed_before: Ids of resources known to have existed before
+            start. Resources with samples prior to start existed as well.
+            None to decide from samples.
+        :type existed_before: Set|None
+        :return: Readings
+        :rtype: Generator
+        """
+        start, stop = self._window(start, stop)
+        boundaries = None
+        if self.probe_boundaries:
+            boundaries = self.boundaries(start, stop, q)
+
+        # Get samples one batch at a time. Convert client samples to compact
+        # samples and timestamps from strings to datetime objects or epoch
+        # microseconds. Samples outside of the window only mark their
+        # resources as existing before or after it. The rest have unused
+        # metadata dropped and are bucketed by resource id while later
+        # batches are still being fetched. Samples of a resource whose
+        # metadata equals that of its previous sample share one metadata
+        # dict.
+        keys = self.metadata_keys
+        last_metadata = {}
+        columns = None
+        if self.engine == 'numpy':
+            columns = columnar.SampleColumns()
+        first, last = start, stop
+        if self.epoch_timestamps or columns is not None:
+            parse = utils.parse_epoch_micros
+            first = utils.to_epoch_micros(start)
+            last = utils.to_epoch_micros(stop)
+        else:
+            parse = utils.parse_timestamp
+        buckets = collections.defaultdict(list)
+        before = set()
+        after = set()
+        # Last sample prior to start of each resource for the state.
+        last_prior = {}
+        count = 0
+        for batch in batches:
+            window = []
+            for s in batch:
+                if not isinstance(s, Sample):
+                    s = Sample.from_resource(s)
+                if isinstance(s.timestamp, basestring):
+                    s.timestamp = parse(s.timestamp)
+                if s.timestamp < first:
+                    before.add(s.resource_id)
+                    previous = last_prior.get(s.resource_id)
+                    if previous is None or previous.timestamp < s.timestamp:
+                        last_prior[s.resource_id] = s
+                    continue
+                if s.timestamp > last:
+                    after.add(s.resource_id)
+                    continue
+                if columns is not None:
+                    window.append(s)
+                    continue
+                if keys is not None and s.resource_metadata:
+                    s.resource_metadata = {
+                        k: v for k, v in s.resource_metadata.iteritems()
+                        if k.lower() in keys
+                    }
+                if s.resource_metadata:
+                    previous = last_metadata.get(s.resource_id)
+                    if previous == s.resource_metadata:
+                        s.resource_metadata = previous
+                    else:
+                        last_metadata[s.resource_id] = s.resource_metadata
+                buckets[s.resource_id].append(s)
+            if columns is not None:
+                columns.add_batch(window)
+            count += len(batch)
+        logger.debug("{} samples according to sample-list.".format(count))
+
+        # Order resources by id and each resource's samples by timestamp.
+        # Sorts are stable, so samples sharing a timestamp keep their order.
+        by_timestamp = operator.attrgetter('timestamp')
+        buckets = sorted(buckets.iteritems())
+        for _, samples in buckets:
+            samples.sort(key=by_timestamp)
+
+        if boundaries is None:
+            # Resources known from the state existed before start as well.
+            boundaries = (before | (existed_before or set()), after)
+
+        if self.state:
+            if columns is not None:
+                during = columns.last_samples()
+            else:
+                during = itertools.chain.from_iterable(s for _, s in buckets)
+            self.state.record(
+                self._state_key(q),
+                stop,
+                itertools.chain(last_prior.itervalues(), during)
+            )
 
         # Return generator
-        return self._reading_generator(samples, start, stop)
+        if columns is not None:
+            return columns.readings(start, stop, *boundaries)
+        return self._reading_generator(buckets, start, stop, boundaries)
@@ -1,15 +1,53 @@
+import collections
 import copy
+import datetime
+import importlib
+import itertools
+import json
+import Queue
+import socket
+import stream
+import threading
 import time
+import utils
 
+from checkpoint import Checkpoint
+from collections import namedtuple
+from exc import UnknownStrategyError
 from log import logging
+from multiprocessing.pool import ThreadPool
+from sample import Sample
 
 logger = logging.getLogger('usage.query')
 
+STRATEGIES = ['bisect', 'histogram', 'paging']
+
+# Fraction of max samples to aim for when predicting chunks from densities.
+_DENSITY_HEADROOM = 0.75
+
+# Number of sample list latencies to observe before hedging requests.
+_HEDGE_MIN_OBSERVATIONS = 20
+
+# Keys used to split time ranges that are too dense to split by time.
+PARTITION_KEYS = ['project_id', 'resource_id']
+
+# A scheduled query. Count is None when the chunk is paged instead of
+# counted. Estimated chunks have a predicted count that must be verified.
+# Partitioned chunks are filtered on PARTITION_KEYS and can not be split
+# any further by time.
+Chunk = namedtuple(
+    'Chunk',
+    ['start', 'stop', 'q', 'count', 'estimated', 'partitioned']
+)
+Chunk.__new__.__defaults__ = (False, False)
+
 _OPS = {
     "gt": ">",
     "ge": ">=",
     "lt": "<",
-    "le": "<="
+    "le": "<=",
+    "eq": "=",
+    "ne": "!="
 }
 
 
@@ -35,6 +73,30 @@ def query(field, op, value, type=''):
     }
 
 
+def filters(definition):
+    """Assemble query filters from a report definition.
+
+    Filters are either a mapping of field to value, which are compared for
+    equality, or a list of dicts with field, value and an optional op.
+
+    :param definition: Filters from a report definition item.
+    :type definition: Dict|List|None
+    :returns: List of query filters
+    :rtype: List
+    """
+    if not definition:
+        return []
+    if isinstance(definition, dict):
+        return [
+            query(field, 'eq', value)
+            for field, value in sorted(definition.items())
+        ]
+    return [
+        query(f['field'], f.get('op', 'eq'), f['value'], f.get('type', ''))
+        for f in definition
+    ]
+
+
 def _query_string(q):
     """Creates query string as it would be used from the cli.
 
@@ -74,20 +136,305 @@ def _sample_list_to_cli(meter_name, q, limit):
     )
 
 
-def _count_to_cli(meter_name, q):
+def _count_to_cli(meter_name, q, period=None):
     """Creates a count command as it would be used from cli.
 
     :param meter_name: Name of the meter
     :type meter_name: String
     :param q: List of query filters
     :type q: List
+    :param period: Statistics period in seconds
+    :type period: Integer|None
     :returns: Cli string.
     :rtype: String
     """
-    return 'ceilometer statistics -m {} -q "{}" -a count'.format(
+    cli = 'ceilometer statistics -m {} -q "{}" -a count'.format(
         meter_name,
         _query_string(q)
     )
+    if period:
+        cli = '{} -p {}'.format(cli, period)
+    return cli
+
+
+# Simple query fields named differently in complex queries.
+_COMPLEX_FIELDS = {
+    'resource': 'resource_id',
+    'project': 'project_id',
+    'user': 'user_id'
+}
+
+
+def _complex_field(field):
+    """Get the complex query name of a simple query field.
+
+    :param field: Simple query field like metadata.instance_type
+    :type field: String
+    :returns: Complex query field like resource_metadata.instance_type
+    :rtype: String
+    """
+    if field.startswith('metadata.'):
+        return 'resource_metadata.{}'.format(field[len('metadata.'):])
+    return _COMPLEX_FIELDS.get(field, field)
+
+
+def _complex_filter(meter_names, q):
+    """Creates a complex query filter for several meters.
+
+    :param meter_names: Names of the meters
+    :type meter_names: List
+    :param q: List of query filters
+    :type q: List
+    :returns: Complex query filter
+    :rtype: Dict
+    """
+    clauses = [{'in': {'meter': list(meter_names)}}]
+    for f in q:
+        value = f.get('value')
+        if f.get('type') == 'datetime':
+            value = value.isoformat()
+        clauses.append({
+            _OPS[f.get('op', 'eq')]: {_complex_field(f.get('field')): value}
+        })
+    return {'and': clauses}
+
+
+def _last_samples_filter(meter_name, q, last):
+    """Creates a complex query filter for the last samples of resources.
+
+    :param meter_name: Name of the meter
+    :type meter_name: String
+    :param q: List of query filters
+    :type q: List
+    :param last: Mapping of resource id to the time of its last sample
+    :type last: Dict
+    :returns: Complex query filter
+    :rtype: Dict
+    """
+    expression = _complex_filter([meter_name], q)
+    expression['and'].append({'or': [
+        {'and': [
+            {'=': {'resource_id': resource_id}},
+            {'>=': {'timestamp': timestamp.isoformat()}}
+        ]}
+        for resource_id, timestamp in sorted(last.items())
+    ]})
+    return expression
+
+
+def _query_samples_to_cli(filter, orderby, limit):
+    """Creates a query samples command as it would be used from cli.
+
+    :param filter: Json complex query filter
+    :type filter: String
+    :param orderby: Json order by expression
+    :type orderby: String
+    :param limit: Limit of samples
+    :type limit: Integer
+    :returns: Cli command
+    :rtype: String
+    """
+    return "ceilometer query-samples --filter '{}' --orderby '{}' " \
+        "--limit {}".format(filter, orderby, limit)
+
+
+def query_samples(client, expression, limit):
+    """Make a single complex query request for samples.
+
+    :param client: Ceilometer client
+    :type client: ceilometerclient.v2.client.Client
+    :param expression: Complex query filter
+    :type expression: Dict
+    :param limit: Maximum number of samples to return
+    :type limit: Integer
+    :returns: Samples, newest first
+    :rtype: List
+    """
+    filter = json.dumps(expression)
+    orderby = json.dumps([{'timestamp': 'desc'}])
+    logger.debug(_query_samples_to_cli(filter, orderby, limit))
+    samples = client.query_samples.query(
+        filter=filter,
+        orderby=orderby,
+        limit=limit
+    )
+    return [Sample.from_query_sample(s) for s in samples]
+
+
+def _client_errors(errors, candidates):
+    """Collect exception types from optional client libraries.
+
+    :param errors: Exception types that are always included
+    :type errors: List
+    :param candidates: List of (module name, exception names) tuples
+    :type candidates: List
+    :returns: Tuple of exception types
+    :rtype: Tuple
+    """
+    errors = list(errors)
+    for module_name, names in candidates:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        errors.extend(
+            getattr(module, name) for name in names if hasattr(module, name)
+        )
+    return tuple(errors)
+
+# Exception types that mean a request timed out.
+TIMEOUT_ERRORS = _client_errors([socket.timeout], [
+    ('ceilometerclient.apiclient.exceptions',
+     ['RequestTimeout', 'GatewayTimeout']),
+    ('keystoneauth1.exceptions',
+     ['ConnectTimeout', 'RequestTimeout', 'GatewayTimeout']),
+    ('requests.exceptions', ['Timeout'])
+])
+
+# Exception types of failures that may pass when retried. Client errors
+# such as a bad filter or expired credentials are not retried.
+TRANSIENT_ERRORS = TIMEOUT_ERRORS + _client_errors([socket.error], [
+    ('ceilometerclient.apiclient.exceptions',
+     ['ConnectionError', 'HttpServerError']),
+    ('ceilometerclient.exc',
+     ['CommunicationError', 'HTTPInternalServerError', 'HTTPBadGateway',
+      'HTTPServiceUnavailable']),
+    ('keystoneauth1.exceptions', ['ConnectionError', 'HttpServerError']),
+    ('requests.exceptions', ['ConnectionError'])
+])
+
+
+def _transient(error):
+    """Check whether a failed request may succeed when retried.
+
+    :param error: Raised exception
+    :type error: Exception
+    :returns: Whether the error is a timeout, connection or server error
+    :rtype: Bool
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = getattr(error, 'http_status', None) or \
+        getattr(error, 'code', None)
+    return isinstance(status, int) and status >= 500
+
+
+def call(func,
+         kwargs,
+         retries=0,
+         backoff=1.0,
+         retry_timeouts=True,
+         on_failure=None):
+    """Call a client function, retrying transient failures with backoff.
+
+    Timeouts, connection errors and server errors are retried. Other
+    errors are raised right away.
+
+    :param func: Client function
+    :type func: Callable
+    :param kwargs: Keyword arguments for the function
+    :type kwargs: Dict
+    :param retries: Number of times to retry a failed request.
+    :type retries: Integer
+    :param backoff: Seconds to wait before the first retry. Doubles with
+        every retry.
+    :type backoff: Float
+    :param retry_timeouts: Whether to retry timeouts. When False a timeout
+        is raised right away so the caller can split the work.
+    :type retry_timeouts: Bool
+    :param on_failure: Called after every failure.
+    :type on_failure: Callable|None
+    :returns: Result of the function
+    :rtype: Object
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(**kwargs)
+        except Exception as e:
+            if on_failure is not None:
+                on_failure()
+            if attempt >= retries or not _transient(e):
+                raise
+            if not retry_timeouts and isinstance(e, TIMEOUT_ERRORS):
+                raise
+            delay = backoff * 2 ** attempt
+            logger.warn("Request failed with {}. Retrying in {} seconds."
+                        .format(e, delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+def _map(func, items, concurrency):
+    """Apply func to every item using at most concurrency threads.
+
+    Results are returned in the same order as items. Runs in the calling
+    thread when concurrency is 1 or there is only one item.
+
+    :param func: Function to apply
+    :type func: Callable
+    :param items: Items to apply the function to
+    :type items: List
+    :param concurrency: Maximum number of concurrent calls
+    :type concurrency: Integer
+    :returns: Results of the function calls
+    :rtype: List
+    """
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class AdaptiveLimit(object):
+    """Number of samples per request sized from measured latency.
+
+    Works like AIMD. The limit grows by a fixed step after a request that
+    was mostly full and finished within the target latency. It is halved
+    after a request that took longer than the target latency or failed.
+    """
+    def __init__(self, minimum, maximum, target_latency=10.0):
+        """Init the limit at the maximum.
+
+        :param minimum: Smallest limit
+        :type minimum: Integer
+        :param maximum: Largest limit
+        :type maximum: Integer
+        :param target_latency: Desired seconds per request
+        :type target_latency: Float
+        """
+        self.minimum = max(min(minimum, maximum), 1)
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.step = max((self.maximum - self.minimum) / 10, 1)
+        self.value = maximum
+        self._lock = threading.Lock()
+
+    def observe(self, count, elapsed):
+        """Adjust the limit after a request.
+
+        :param count: Number of samples returned
+        :type count: Integer
+        :param elapsed: Seconds the request took
+        :type elapsed: Float
+        """
+        with self._lock:
+            if elapsed > self.target_latency:
+                self.value = max(self.value / 2, self.minimum)
+            elif count * 2 >= self.value:
+                self.value = min(self.value + self.step, self.maximum)
+            else:
+                return
+            logger.debug("Adaptive limit is now {}".format(self.value))
+
+    def failure(self):
+        """Halve the limit after a failed request."""
+        with self._lock:
+            self.value = max(self.value / 2, self.minimum)
 
 
 class Scheduler(object):
@@ -98,7 +445,21 @@ class Scheduler(object):
                  start,
                  stop,
                  q=None,
-                 max_samples=500):
+                 max_samples=500,
+                 concurrency=1,
+                 fetch_concurrency=1,
+                 strategy='bisect',
+                 period=3600,
+                 density_model=None,
+                 adaptive=False,
+                 min_samples=1000,
+                 target_latency=10.0,
+                 min_interval=1,
+                 checkpoint_dir=None,
+                 retries=0,
+                 backoff=1.0,
+                 hedge=False,
+                 streaming=False):
         """Inits the schedule
 
         :param client: Ceilometer client
@@ -113,20 +474,99 @@ class Scheduler(object):
         :type q: List
         :param max_samples: Number of maximum samples per time chunk.
         :type max_samples: Integer
+        :param concurrency: Maximum number of concurrent count queries.
+        :type concurrency: Integer
+        :param fetch_concurrency: Maximum number of concurrent sample lists.
+        :type fetch_concurrency: Integer
+        :param strategy: How to plan the schedule. One of STRATEGIES.
+        :type strategy: String
+        :param period: Histogram bucket size in seconds.
+        :type period: Integer
+        :param density_model: Sample densities from previous runs.
+        :type density_model: usage.density.DensityModel
+        :param adaptive: Whether to size requests from measured latency.
+        :type adaptive: Bool
+        :param min_samples: Smallest number of samples per adaptive request.
+        :type min_samples: Integer
+        :param target_latency: Desired seconds per adaptive request.
+        :type target_latency: Float
+        :param min_interval: Seconds below which time ranges are partitioned
+            on PARTITION_KEYS instead of halved.
+        :type min_interval: Float
+        :param checkpoint_dir: Directory to save the plan and finished
+            chunks in so an interrupted fetch can be resumed.
+        :type checkpoint_dir: String
+        :param retries: Number of times to retry a failed request.
+        :type retries: Integer
+        :param backoff: Seconds to wait before the first retry. Doubles with
+            every retry.
+        :type backoff: Float
+        :param hedge: Whether to duplicate sample lists that are slower than
+            the 95th percentile seen so far.
+        :type hedge: Bool
+        :param streaming: Whether to stream gzip encoded sample lists and
+            parse them incrementally.
+        :type streaming: Bool
         """
+        if strategy not in STRATEGIES:
+            raise UnknownStrategyError(strategy)
         self.client = client
         self.meter_name = meter_name
         self.schedule = []
         self.max_samples = max_samples
+        self.concurrency = max(concurrency, 1)
+        self.fetch_concurrency = max(fetch_concurrency, 1)
+        self.strategy = strategy
+        self.period = period
+        self.density_model = density_model
+        self.limit = None
+        if adaptive:
+            self.limit = AdaptiveLimit(
+                min_samples, max_samples, target_latency=target_latency
+            )
+        self.min_interval = datetime.timedelta(seconds=min_interval)
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.streaming = streaming
+        self._latencies = []
+        self._latencies_lock = threading.Lock()
         self.base_q = q or []
+        self.start = start
+        self.stop = stop
+        # Ceilometer has no samples after now, so densities are measured
+        # and predicted up to here only.
+        self.sampled_stop = min(stop, datetime.datetime.utcnow())
+        self.checkpoint = None
+        if checkpoint_dir:
+            self.checkpoint = Checkpoint(
+                checkpoint_dir, meter_name, start, stop, self.base_q
+            )
+            plan = self.checkpoint.load_plan()
+            if plan is not None:
+                logger.info("Resuming {} from checkpoint".format(meter_name))
+                self.schedule = [Chunk(*chunk) for chunk in plan]
+                return
         self._schedule(start, stop)
+        if self.checkpoint:
+            self.checkpoint.save_plan(self.schedule)
+
+    @property
+    def density_key(self):
+        """Key of this meter and query in the density model.
+
+        :returns: Density key
+        :rtype: String
+        """
+        return '{}?{}'.format(self.meter_name, _query_string(self.base_q))
 
     def _count(self, q):
         """Get a count of samples matching q.
 
         Since ceilometer does not support sample paging and a default limit of
         100 samples, we need to use stats to count the samples and change the
-        limit from 100 the actual number of samples.
+        limit from 100 the actual number of samples. The paging strategy
+        avoids counts by walking backward through timestamps instead.
 
         :param q: Listg of filters.
         :type q: List
@@ -136,7 +576,8 @@ class Scheduler(object):
         # Get count of samples
         logger.debug(_count_to_cli(self.meter_name, q))
         p_start = time.time()
-        stats = self.client.statistics.list(
+        stats = self._call(
+            self.client.statistics.list,
             meter_name=self.meter_name,
             q=q,
             aggregates=[{'func': 'count'}]
@@ -148,33 +589,346 @@ class Scheduler(object):
             return 0
         return stats[0].count
 
-    def _schedule(self, start, stop):
-        """Creates a schedule of queries.
+    def _group_count(self, q, key):
+        """Get a count of samples matching q for each value of key.
+
+        :param q: List of filters.
+        :type q: List
+        :param key: Field to group by
+        :type key: String
+        :returns: List of (value, count) tuples
+        :rtype: List
+        """
+        logger.debug(
+            '{} -g {}'.format(_count_to_cli(self.meter_name, q), key)
+        )
+        p_start = time.time()
+        stats = self._call(
+            self.client.statistics.list,
+            meter_name=self.meter_name,
+            q=q,
+            groupby=[key],
+            aggregates=[{'func': 'count'}]
+        )
+        logger.debug(
+            "Group count finished in {} seconds."
+            .format(time.time() - p_start)
+        )
+        return [(stat.groupby[key], stat.count) for stat in stats or []]
 
-        Appends a query tuple to this objects schedule list.
+    def _partition(self, time_range, q, max_samples, keys=None):
+        """Split a dense time range on keys instead of time.
 
-        Queries the count of samples over a chunk of time. If the count
-        exceeds max samples, the time is halved and then each half is
-        recuriively examined until we have chunks of time with less than
-        the max number of samples.
+        Counts are grouped by the first key. Groups with more than max
+        samples are partitioned again on the next key. A group that is still
+        too large with no keys left becomes one oversized chunk.
+
+        :param time_range: (start, stop, lower_op, upper_op) tuple
+        :type time_range: Tuple
+        :param q: List of filters ending with the two timestamp filters.
+        :type q: List
+        :param max_samples: Samples per chunk.
+        :type max_samples: Integer
+        :param keys: Keys to partition on. Defaults to PARTITION_KEYS
+        :type keys: List
+        :returns: List of chunks
+        :rtype: List
+        """
+        keys = keys or PARTITION_KEYS
+        start, stop = time_range[0], time_range[1]
+        chunks = []
+        for value, count in self._group_count(q, keys[0]):
+            key_q = q[:-2] + [query(keys[0], 'eq', value)] + q[-2:]
+            if count > max_samples and len(keys) > 1:
+                chunks.extend(
+                    self._partition(time_range, key_q, max_samples, keys[1:])
+                )
+                continue
+            if count > max_samples:
+                logger.warn(
+                    "{} samples of {} {} between {} and {}.".format(
+                        count, keys[0], value, start, stop
+                    )
+                )
+            chunks.append(Chunk(start, stop, key_q, count, False, True))
+        return chunks
+
+    def _time_query(self, start, stop, lower_op='gt', upper_op='le'):
+        """Creates a query for a range of time.
 
         :param start: Start datetime
         :type start: datetime.datetime
         :param stop: Stop datetime
         :type stop: datetime.datetime
+        :param lower_op: Operator for the start time. gt or ge
+        :type lower_op: String
+        :param upper_op: Operator for the stop time. le or lt
+        :type upper_op: String
+        :returns: List of query filters
+        :rtype: List
         """
         # Copy base query. Each query will be the same aside from times.
         this_q = copy.copy(self.base_q)
-        this_q.append(query('timestamp', 'gt', start, 'datetime'))
-        this_q.append(query('timestamp', 'le', stop, 'datetime'))
+        this_q.append(query('timestamp', lower_op, start, 'datetime'))
+        this_q.append(query('timestamp', upper_op, stop, 'datetime'))
+        return this_q
+
+    def _probe(self, time_range):
+        """Count the samples in a single time range.
+
+        :param time_range: (start, stop, lower_op, upper_op) tuple
+        :type time_range: Tuple
+        :returns: (time_range, query, count) tuple
+        :rtype: Tuple
+        """
+        this_q = self._time_query(*time_range)
         count = self._count(this_q)
-        logger.debug("Checking {} - {} - {}".format(start, stop, count))
-        if count > self.max_samples:
-            d = (stop - start) / 2
-            self._schedule(start, start + d)
-            self._schedule(start + d, stop)
+        logger.debug(
+            "Checking {} - {} - {}".format(time_range[0], time_range[1], count)
+        )
+        return (time_range, this_q, count)
+
+    def _split(self, time_range):
+        """Halve a time range.
+
+        The halves share a boundary that belongs to the first half.
+
+        :param time_range: (start, stop, lower_op, upper_op) tuple
+        :type time_range: Tuple
+        :returns: Two time ranges
+        :rtype: List
+        """
+        start, stop, lower_op, upper_op = time_range
+        middle = start + (stop - start) / 2
+        return [
+            (start, middle, lower_op, 'le'),
+            (middle, stop, 'gt', upper_op)
+        ]
+
+    def _bisect(self, pending, max_samples=None):
+        """Bisect time ranges until each has less than max samples.
+
+        Time ranges are examined one level of halving at a time. Every range
+        in a level is counted concurrently, bounded by self.concurrency, so
+        planning takes roughly one round trip per level instead of one per
+        range. Ranges no longer than self.min_interval are partitioned on
+        PARTITION_KEYS instead of halved.
+
+        :param pending: List of (start, stop, lower_op, upper_op) tuples
+        :type pending: List
+        :param max_samples: Samples per chunk. Defaults to self.max_samples
+        :type max_samples: Integer
+        :returns: List of chunks
+        :rtype: List
+        """
+        max_samples = max_samples or self.max_samples
+        chunks = []
+        dense = []
+        while pending:
+            probed = _map(self._probe, pending, self.concurrency)
+            pending = []
+            for time_range, p_q, p_count in probed:
+                if p_count <= max_samples:
+                    chunks.append(
+                        Chunk(time_range[0], time_range[1], p_q, p_count)
+                    )
+                elif time_range[1] - time_range[0] <= self.min_interval:
+                    dense.append((time_range, p_q))
+                else:
+                    pending.extend(self._split(time_range))
+        for time_range, p_q in dense:
+            chunks.extend(self._partition(time_range, p_q, max_samples))
+        return chunks
+
+    def _histogram(self, start, stop):
+        """Get a count of samples per period between start and stop.
+
+        :param start: Start datetime
+        :type start: datetime.datetime
+        :param stop: Stop datetime
+        :type stop: datetime.datetime
+        :returns: Sorted list of (period start, count) tuples
+        :rtype: List
+        """
+        q = self._time_query(start, stop)
+        logger.debug(_count_to_cli(self.meter_name, q, period=self.period))
+        p_start = time.time()
+        stats = self._call(
+            self.client.statistics.list,
+            meter_name=self.meter_name,
+            q=q,
+            period=self.period,
+            aggregates=[{'func': 'count'}]
+        )
+        logger.debug(
+            "Histogram finished in {} seconds.".format(time.time() - p_start)
+        )
+        buckets = []
+        for stat in stats or []:
+            b_start = utils.parse_timestamp(stat.period_start)
+            buckets.append((max(b_start, start), stat.count))
+        buckets.sort()
+        return buckets
+
+    def _plan_histogram(self, start, stop):
+        """Plans the schedule from a single histogram of sample counts.
+
+        Ceilometer counts each period as period_start <= t < period_end, so
+        chunks are cut on period starts using ge and lt. Consecutive periods
+        are packed into a chunk until max samples would be exceeded. A
+        single period with more than max samples is bisected.
+
+        :param start: Start datetime
+        :type start: datetime.datetime
+        :param stop: Stop datetime
+        :type stop: datetime.datetime
+        :returns: List of chunks
+        :rtype: List
+        """
+        period = datetime.timedelta(seconds=self.period)
+        # List of (start, stop, count) packed from the histogram.
+        ranges = []
+        c_start = start
+        c_count = 0
+        for b_start, b_count in self._histogram(start, stop):
+            if b_count > self.max_samples:
+                if b_start > c_start:
+                    ranges.append((c_start, b_start, c_count))
+                c_start = min(b_start + period, stop)
+                ranges.append((b_start, c_start, b_count))
+                c_count = 0
+            elif c_count + b_count > self.max_samples:
+                ranges.append((c_start, b_start, c_count))
+                c_start = b_start
+                c_count = b_count
+            else:
+                c_count += b_count
+        if c_start < stop:
+            ranges.append((c_start, stop, c_count))
+
+        chunks = []
+        oversized = []
+        for r_start, r_stop, r_count in ranges:
+            time_range = (
+                r_start,
+                r_stop,
+                'gt' if r_start == start else 'ge',
+                'le' if r_stop == stop else 'lt'
+            )
+            if r_count > self.max_samples:
+                oversized.extend(self._split(time_range))
+            else:
+                chunks.append(
+                    Chunk(r_start, r_stop, self._time_query(*time_range),
+                          r_count)
+                )
+        chunks.extend(self._bisect(oversized))
+        return chunks
+
+    def _plan_paging(self, start, stop):
+        """Plans one chunk per fetch worker without counting.
+
+        :param start: Start datetime
+        :type start: datetime.datetime
+        :param stop: Stop datetime
+        :type stop: datetime.datetime
+        :returns: List of chunks
+        :rtype: List
+        """
+        step = (stop - start) / self.fetch_concurrency
+        chunks = []
+        for i in xrange(self.fetch_concurrency):
+            c_start = start + step * i
+            c_stop = c_start + step
+            if i == self.fetch_concurrency - 1:
+                c_stop = stop
+            c_q = self._time_query(c_start, c_stop)
+            chunks.append(Chunk(c_start, c_stop, c_q, None))
+        return chunks
+
+    def _plan_density(self, start, stop, density):
+        """Plans chunks from a predicted number of samples per hour.
+
+        Chunks are sized to hold a fraction of max samples at the predicted
+        density. No counts are made. Each chunk is verified when fetched.
+        Time after sampled_stop holds no samples yet and is left to one
+        chunk.
+
+        :param start: Start datetime
+        :type start: datetime.datetime
+        :param stop: Stop datetime
+        :type stop: datetime.datetime
+        :param density: Predicted samples per hour
+        :type density: Float
+        :returns: List of chunks
+        :rtype: List
+        """
+        if density > 0:
+            seconds = self.max_samples * _DENSITY_HEADROOM * 3600 / density
+            step = datetime.timedelta(seconds=max(seconds, 1))
         else:
-            self.schedule.append((start, stop, this_q, count))
+            step = stop - start
+        sampled_stop = max(min(stop, self.sampled_stop), start)
+        chunks = []
+        c_start = start
+        while c_start < stop:
+            if c_start < sampled_stop:
+                c_stop = min(c_start + step, sampled_stop)
+                estimate = int(
+                    density * (c_stop - c_start).total_seconds() / 3600
+                )
+            else:
+                c_stop = stop
+                estimate = 0
+            chunks.append(Chunk(
+                c_start,
+                c_stop,
+                self._time_query(c_start, c_stop),
+                estimate,
+                True
+            ))
+            c_start = c_stop
+        return chunks
+
+    def _schedule(self, start, stop):
+        """Creates a schedule of queries.
+
+        Appends query tuples to this objects schedule list in time order.
+
+        With the bisect strategy, the count of samples over a chunk of time
+        is queried. If the count exceeds max samples, the time is halved and
+        then each half is examined until we have chunks of time with less
+        than the max number of samples.
+
+        With the histogram strategy, a single statistics query with a period
+        provides the counts used to pack chunks.
+
+        With the paging strategy, no counts are made. The window is cut into
+        one chunk per fetch worker and each chunk is paged through when
+        fetched. Paged chunks have a count of None.
+
+        When a density model knows this meter, chunks are predicted from the
+        density instead of counted, regardless of counting strategy.
+
+        :param start: Start datetime
+        :type start: datetime.datetime
+        :param stop: Stop datetime
+        :type stop: datetime.datetime
+        """
+        density = None
+        if self.density_model and self.strategy != 'paging':
+            density = self.density_model.predict(self.density_key)
+        if density is not None:
+            logger.debug("Predicting {} samples per hour".format(density))
+            chunks = self._plan_density(start, stop, density)
+        elif self.strategy == 'histogram':
+            chunks = self._plan_histogram(start, stop)
+        elif self.strategy == 'paging':
+            chunks = self._plan_paging(start, stop)
+        else:
+            chunks = self._bisect([(start, stop, 'gt', 'le')])
+        chunks.sort(key=lambda chunk: chunk.start)
+        self.schedule.extend(chunks)
 
     def __iter__(self):
         """Generator for iterating over the schedule."""
@@ -184,38 +938,426 @@ class Scheduler(object):
     def count(self):
         """Returns the total number of samples expected by the schedule.
 
-        :returns: Number of total samples
-        :rtype: Integer
+        :returns: Number of total samples or None if not known.
+        :rtype: Integer|None
         """
         total = 0
-        for _, _, _, count in self:
-            total += count
+        for chunk in self:
+            if chunk.count is None:
+                return None
+            total += chunk.count
         return total
 
-    def list(self):
-        """Gets a list of all samples.
+    def _call(self, func, retry_timeouts=True, hedge=False, **kwargs):
+        """Call a client function, retrying failures with backoff.
 
-        :returns: All samples
+        :param func: Client function
+        :type func: Callable
+        :param retry_timeouts: Whether to retry timeouts. When False a
+            timeout is raised right away so the caller can split the work.
+        :type retry_timeouts: Bool
+        :param hedge: Whether the call may be hedged.
+        :type hedge: Bool
+        :param kwargs: Keyword arguments for the function
+        :type kwargs: Dict
+        :returns: Result of the function
+        :rtype: Object
+        """
+        def hedged(**kwargs):
+            return self._hedged(func, kwargs)
+
+        return call(
+            hedged if hedge and self.hedge else func,
+            kwargs,
+            retries=self.retries,
+            backoff=self.backoff,
+            retry_timeouts=retry_timeouts,
+            on_failure=self.limit.failure if self.limit is not None else None
+        )
+
+    def _hedge_delay(self):
+        """Get the 95th percentile of observed sample list latencies.
+
+        :returns: Seconds or None if too few latencies were observed.
+        :rtype: Float|None
+        """
+        with self._latencies_lock:
+            if len(self._latencies) < _HEDGE_MIN_OBSERVATIONS:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _hedged(self, func, kwargs):
+        """Call func and call it again if the first call is slow.
+
+        The duplicate is sent once the first call has taken longer than the
+        95th percentile latency. Whichever call succeeds first wins.
+
+        :param func: Client function
+        :type func: Callable
+        :param kwargs: Keyword arguments for the function
+        :type kwargs: Dict
+        :returns: Result of the function
+        :rtype: Object
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return func(**kwargs)
+        results = Queue.Queue()
+
+        def run():
+            try:
+                results.put((True, func(**kwargs)))
+            except Exception as e:
+                results.put((False, e))
+
+        def start():
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+
+        start()
+        calls = 1
+        try:
+            ok, value = results.get(timeout=delay)
+        except Queue.Empty:
+            logger.info("Request slower than {} seconds. Hedging.".format(
+                delay
+            ))
+            start()
+            calls = 2
+            ok, value = results.get()
+        if not ok and calls == 2:
+            ok, value = results.get()
+        if not ok:
+            raise value
+        return value
+
+    def _list(self, q, limit, retry_timeouts=True):
+        """Get a list of samples matching q.
+
+        :param q: List of filters.
+        :type q: List
+        :param limit: Maximum number of samples to return
+        :type limit: Integer
+        :param retry_timeouts: Whether to retry timeouts.
+        :type retry_timeouts: Bool
+        :returns: Samples, newest first
+        :rtype: List
+        """
+        p_start = time.time()
+        samples = self._call(
+            self._samples_list,
+            retry_timeouts=retry_timeouts,
+            hedge=True,
+            q=q,
+            limit=limit
+        )
+        elapsed = time.time() - p_start
+        logger.debug("sample-list finished in {} seconds.".format(elapsed))
+        if self.limit is not None:
+            self.limit.observe(len(samples), elapsed)
+        with self._latencies_lock:
+            self._latencies.append(elapsed)
+        return samples
+
+    def _samples_list(self, q, limit):
+        """Make a single sample list request.
+
+        :param q: List of filters.
+        :type q: List
+        :param limit: Maximum number of samples to return
+        :type limit: Integer
+        :returns: Samples, newest first
+        :rtype: List
+        """
+        logger.debug(_sample_list_to_cli(self.meter_name, q, limit))
+        if self.streaming:
+            return stream.list_samples(
+                self.client, self.meter_name, q=q, limit=limit
+            )
+        return self.client.samples.list(
+            meter_name=self.meter_name,
+            q=q,
+            limit=limit
+        )
+
+    def _page_size(self):
+        """Get the number of samples to ask for per page.
+
+        :returns: Number of samples
+        :rtype: Integer
+        """
+        if self.limit is not None:
+            return self.limit.value
+        return self.max_samples
+
+    def _page(self, q):
+        """Get all samples matching q one page at a time.
+
+        Ceilometer returns samples newest first. Each page asks for
+        max_samples samples at or before the oldest timestamp of the previous
+        page. Samples sharing that timestamp may be split across pages, so
+        they are remembered by message id and skipped when seen again. If a
+        whole page shares one timestamp the page size is doubled until the
+        page reaches past it. Ceilometer does not order samples sharing a
+        timestamp, so ties are remembered until the oldest timestamp moves.
+
+        :param q: List of filters ending with the two timestamp filters.
+        :type q: List
+        :returns: Samples, newest first
         :rtype: List
         """
-        total_queries = len(self.schedule)
         samples = []
-        for i, item in enumerate(self):
-            logger.info(
-                "Performing query {} of {}".format(i + 1, total_queries)
+        upper = q[-1]
+        limit = self._page_size()
+        seen = set()
+        previous = None
+        while True:
+            page = self._list(q[:-1] + [upper], limit)
+            samples.extend(s for s in page if s.message_id not in seen)
+            if len(page) < limit:
+                return samples
+            oldest = utils.parse_timestamp(page[-1].timestamp)
+            ties = set(
+                s.message_id for s in page
+                if utils.parse_timestamp(s.timestamp) == oldest
             )
-            _, _, q, limit = item
-            logger.debug(_sample_list_to_cli(self.meter_name, q, limit))
-            p_start = time.time()
-            samples.extend(
-                self.client.samples.list(
-                    meter_name=self.meter_name,
-                    q=q,
-                    limit=limit
-                )
+            if len(ties) == len(page):
+                # No progress. Grow the page to reach past the tie.
+                limit *= 2
+            else:
+                limit = self._page_size()
+            if oldest == previous:
+                seen |= ties
+            else:
+                seen = ties
+            previous = oldest
+            upper = query('timestamp', 'le', oldest, 'datetime')
+
+    def _fetch(self, numbered_item):
+        """Gets the samples for a single scheduled item.
+
+        :param numbered_item: (index, schedule item) tuple
+        :type numbered_item: Tuple
+        :returns: Samples in the scheduled item
+        :rtype: List
+        """
+        i, item = numbered_item
+        if self.checkpoint:
+            samples = self.checkpoint.load_chunk(i)
+            if samples is not None:
+                logger.info("Loaded query {} of {} from checkpoint".format(
+                    i + 1, len(self.schedule)
+                ))
+                return samples
+        logger.info(
+            "Performing query {} of {}".format(i + 1, len(self.schedule))
+        )
+        if item.count is None:
+            samples = self._page(item.q)
+        elif item.estimated:
+            samples = self._verify(item)
+        else:
+            samples = self._fetch_chunk(item)
+        if self.checkpoint:
+            self.checkpoint.save_chunk(i, samples)
+        return samples
+
+    def _fetch_chunk(self, chunk):
+        """Gets the samples of a counted chunk.
+
+        Chunks larger than the adaptive limit are split before fetching. A
+        chunk that times out is split in half and its halves are fetched.
+        Chunks that can not be split retry timeouts instead.
+
+        :param chunk: Counted chunk
+        :type chunk: Chunk
+        :returns: Samples in the chunk
+        :rtype: List
+        """
+        splittable = not chunk.partitioned and chunk.count > 1
+        if splittable and self.limit is not None and \
+                chunk.count > self.limit.value:
+            return self._fetch_split(chunk, self.limit.value)
+        try:
+            return self._list(
+                chunk.q, chunk.count, retry_timeouts=not splittable
+            )
+        except TIMEOUT_ERRORS:
+            if not splittable:
+                raise
+            logger.warn("Query for {} - {} timed out. Splitting.".format(
+                chunk.start, chunk.stop
+            ))
+            return self._fetch_split(chunk, max(chunk.count / 2, 1))
+
+    def _fetch_split(self, chunk, max_samples):
+        """Gets the samples of a chunk in parts of at most max samples.
+
+        :param chunk: Chunk to fetch
+        :type chunk: Chunk
+        :param max_samples: Maximum number of samples per part
+        :type max_samples: Integer
+        :returns: Samples in the chunk
+        :rtype: List
+        """
+        time_range = (
+            chunk.start, chunk.stop, chunk.q[-2]['op'], chunk.q[-1]['op']
+        )
+        parts = self._bisect(self._split(time_range), max_samples)
+        parts.sort(key=lambda part: part.start)
+        samples = []
+        for part in parts:
+            samples.extend(self._fetch_chunk(part))
+        return samples
+
+    def _verify(self, chunk):
+        """Gets the samples of an estimated chunk.
+
+        Asks for one more than max samples. If that many come back the
+        prediction was badly wrong, so the chunk is bisected with counts and
+        its parts are fetched instead.
+
+        :param chunk: Estimated chunk
+        :type chunk: Chunk
+        :returns: Samples in the chunk
+        :rtype: List
+        """
+        samples = self._list(chunk.q, self.max_samples + 1)
+        if len(samples) <= self.max_samples:
+            return samples
+        logger.info(
+            "Prediction for {} - {} was wrong. Counting samples."
+            .format(chunk.start, chunk.stop)
+        )
+        return self._fetch_split(chunk, self.max_samples)
+
+    def iter_batches(self):
+        """Yields the samples of each scheduled item in schedule order.
+
+        Up to self.fetch_concurrency scheduled items are fetched at the same
+        time. At most twice that many fetched batches are held at once, so
+        a slow item lets later items finish without unbounded buffering.
+        Callers should drop each batch once consumed.
+
+        :yields: List of samples for one scheduled item
+        """
+        numbered = enumerate(self.schedule)
+        total = 0
+        if self.fetch_concurrency <= 1 or len(self.schedule) <= 1:
+            for numbered_item in numbered:
+                batch = self._fetch(numbered_item)
+                total += len(batch)
+                yield batch
+        else:
+            pool = ThreadPool(
+                min(self.fetch_concurrency, len(self.schedule))
             )
-            logger.debug(
-                "sample-list finished in {} seconds."
-                .format(time.time() - p_start)
+            try:
+                window = collections.deque(
+                    pool.apply_async(self._fetch, (numbered_item,))
+                    for numbered_item in itertools.islice(
+                        numbered, 2 * self.fetch_concurrency
+                    )
+                )
+                while window:
+                    batch = window.popleft().get()
+                    for numbered_item in itertools.islice(numbered, 1):
+                        window.append(
+                            pool.apply_async(self._fetch, (numbered_item,))
+                        )
+                    total += len(batch)
+                    yield batch
+            finally:
+                pool.close()
+                pool.join()
+
+        if self.checkpoint:
+            self.checkpoint.clear()
+        if self.density_model:
+            self.density_model.record(
+                self.density_key,
+                total,
+                (self.sampled_stop - self.start).total_seconds()
             )
+
+    def iter_samples(self):
+        """Yields every sample one at a time.
+
+        :yields: Sample
+        """
+        for batch in self.iter_batches():
+            for sample in batch:
+                yield sample
+
+    def list(self):
+        """Gets a list of all samples.
+
+        :returns: All samples
+        :rtype: List
+        """
+        samples = []
+        for batch in self.iter_batches():
+            samples.extend(batch)
         return samples
+
+
+class MeterSetScheduler(Scheduler):
+    """Schedule that fetches samples of several meters at once.
+
+    The sample list api only accepts one meter, so samples are fetched
+    with the complex query api filtering on meter in meter names. The
+    statistics api can not count several meters at once either, so time
+    chunks are always paged instead of counted.
+    """
+    def __init__(self, client, meter_names, start, stop, q=None, **kwargs):
+        """Inits the schedule.
+
+        :param client: Ceilometer client
+        :type client: Ceilometer client
+        :param meter_names: Names of the meters to read
+        :type meter_names: List
+        :param start: Start time
+        :type start: datetime.datetime
+        :param stop: Stop time
+        :type stop: datetime.datetime
+        :param q: List of query filters excluding time and meter
+        :type q: List
+        :param kwargs: Other keyword arguments of Scheduler. Strategy and
+            density model are ignored.
+        :type kwargs: Dict
+        """
+        self.meter_names = sorted(set(meter_names))
+        kwargs['strategy'] = 'paging'
+        kwargs.pop('density_model', None)
+        super(MeterSetScheduler, self).__init__(
+            client, ','.join(self.meter_names), start, stop, q=q, **kwargs
+        )
+
+    def _samples_list(self, q, limit):
+        """Make a single complex query request for samples.
+
+        :param q: List of filters.
+        :type q: List
+        :param limit: Maximum number of samples to return
+        :type limit: Integer
+        :returns: Samples, newest first
+        :rtype: List
+        """
+        return query_samples(
+            self.client, _complex_filter(self.meter_names, q), limit
+        )
+
+    def demultiplex(self):
+        """Fetch all samples and group them by meter.
+
+        :returns: Mapping of meter name to list of samples. Every meter
+            name has an entry even when it has no samples.
+        :rtype: Dict
+        """
+        by_meter = {name: [] for name in self.meter_names}
+        for batch in self.iter_batches():
+            for s in batch:
+                by_meter[s.meter].append(s)
+        return by_meter
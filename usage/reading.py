@@ -1,4 +1,6 @@
 import copy
+import utils
+
 from exc import NoSamplesError
 from exc import UnknownCounterTypeError
 from log import logging
@@ -8,13 +10,86 @@ from conversions.time_units import seconds_to_hours
 
 
 ALLOWED_METER_TYPES = set(['gauge', 'cumulative', 'delta'])
+
+# Metadata keys used to find the last non deleted metadata.
+STATUS_KEYS = ['state', 'status']
+DELETE_STATUSES = ['deleting', 'deleted']
 logger = logging.getLogger('usage.reading')
 
 
+def live_status(metadata):
+    """Check whether metadata has a status that is not a delete status.
+
+    :param metadata: Resource metadata
+    :type metadata: Dict
+    :returns: Whether a status key has a non deleted value
+    :rtype: Bool
+    """
+    for key in STATUS_KEYS:
+        status = metadata.get(key)
+        if status is not None and status not in DELETE_STATUSES:
+            return True
+    return False
+
+
+def is_deleted(metadata):
+    """Check whether metadata only has deleted statuses.
+
+    Metadata without status keys is not deleted.
+
+    :param metadata: Resource metadata
+    :type metadata: Dict
+    :returns: Whether earlier metadata should be looked for
+    :rtype: Bool
+    """
+    has_keys = any(key in metadata for key in STATUS_KEYS)
+    return has_keys and not live_status(metadata)
+
+
+def select_metadata(samples):
+    """Get the metadata of the last non deleted status sample.
+
+    Steps backward from the end of the sample list. Defaults to the
+    metadata of the last sample.
+
+    :param samples: List of samples sorted by timestamp
+    :type samples: List
+    :returns: Resource metadata or None if there are no samples
+    :rtype: Dict|None
+    """
+    # If no samples, return early
+    if not samples:
+        return None
+
+    last = samples[-1].resource_metadata
+    if not is_deleted(last):
+        return last
+
+    checked = last
+    for i in xrange(len(samples) - 2, -1, -1):
+        # Samples with equal metadata usually share one dict. Skip
+        # metadata that was just checked.
+        metadata = samples[i].resource_metadata
+        if metadata is checked:
+            continue
+        checked = metadata
+        if live_status(metadata):
+            return metadata
+
+    # Default to last sample metadata.
+    return last
+
+
 class Reading:
     """Models a reading of a meter."""
 
-    def __init__(self, samples, start, stop):
+    def __init__(self,
+                 samples,
+                 start,
+                 stop,
+                 existed_before=None,
+                 existed_after=None,
+                 epoch=False):
         """Init the reading.
 
         :param samples: List of samples sorted by timestamp.
@@ -23,9 +98,21 @@ class Reading:
         :type start: Datetime
         :param stop: Stopping datetime.
         :type stop: Datetime
+        :param existed_before: Whether the resource existed before start.
+            None to decide from samples prior to start.
+        :type existed_before: Bool|None
+        :param existed_after: Whether the resource existed after stop.
+            None to decide from samples after stop.
+        :type existed_after: Bool|None
+        :param epoch: Whether sample timestamps are integer microseconds
+            since the epoch instead of datetimes.
+        :type epoch: Bool
         """
         self.start = start
         self.stop = stop
+        self._epoch = epoch
+        self._existed_before = existed_before
+        self._existed_after = existed_after
         self._during_samples = []
         self._split_samples(samples)
         self._calculate()
@@ -47,6 +134,9 @@ class Reading:
         post_samples = []
         start = self.start
         stop = self.stop
+        if self._epoch:
+            start = utils.to_epoch_micros(start)
+            stop = utils.to_epoch_micros(stop)
 
         for sample in samples:
             logger.debug("{} - {} - {} - {} - {}".format(
@@ -82,6 +172,8 @@ class Reading:
         :returns: The length of prior samples > 0
         :rtype: Bool
         """
+        if self._existed_before is not None:
+            return self._existed_before
         return len(self._prior_samples) > 0
 
     def resource_existed_after(self):
@@ -89,6 +181,8 @@ class Reading:
 
         :returns: The lenght of post samples > 0
         """
+        if self._existed_after is not None:
+            return self._existed_after
         return len(self._post_samples) > 0
 
     @property
@@ -122,7 +216,7 @@ class Reading:
             return None
         if self.resource_existed_before():
             return self.start
-        return self._during_samples[0].timestamp
+        return self._datetime(self._during_samples[0].timestamp)
 
     @property
     def usage_stop(self):
@@ -137,7 +231,31 @@ class Reading:
             return None
         if self.resource_existed_after():
             return self.stop
-        return self._during_samples[-1].timestamp
+        return self._datetime(self._during_samples[-1].timestamp)
+
+    def _datetime(self, timestamp):
+        """Get a sample timestamp as a datetime.
+
+        :param timestamp: Sample timestamp
+        :type timestamp: Datetime|Integer
+        :returns: Timestamp as a datetime
+        :rtype: Datetime
+        """
+        if self._epoch:
+            return utils.from_epoch_micros(timestamp)
+        return timestamp
+
+    def _timestamp(self, value):
+        """Get a datetime in the form of sample timestamps.
+
+        :param value: Datetime
+        :type value: Datetime
+        :returns: Datetime or microseconds since the epoch
+        :rtype: Datetime|Integer
+        """
+        if self._epoch:
+            return utils.to_epoch_micros(value)
+        return value
 
     @property
     def samples(self):
@@ -192,12 +310,12 @@ class Reading:
         """
         # Prepend usage start
         assumed_start = copy.copy(self._during_samples[0])
-        assumed_start.timestamp = self.usage_start
+        assumed_start.timestamp = self._timestamp(self.usage_start)
         self._during_samples.insert(0, assumed_start)
 
         # Append usage stop
         assumed_stop = copy.copy(self._during_samples[-1])
-        assumed_stop .timestamp = self.usage_stop
+        assumed_stop .timestamp = self._timestamp(self.usage_stop)
         self._during_samples.append(assumed_stop)
 
     def _gauge(self):
@@ -209,17 +327,29 @@ class Reading:
         self._assume_ends()
         samples = self._during_samples
 
-        for i in xrange(1, len(self._during_samples)):
-            value += (
-                (
-                    samples[i].timestamp -
-                    samples[i - 1].timestamp
-                ).total_seconds() *
-                (
-                    samples[i].counter_volume +
-                    samples[i - 1].counter_volume
+        if self._epoch:
+            # Integer microseconds. Scale once at the end.
+            for i in xrange(1, len(samples)):
+                value += (
+                    (samples[i].timestamp - samples[i - 1].timestamp) *
+                    (
+                        samples[i].counter_volume +
+                        samples[i - 1].counter_volume
+                    )
+                )
+            value = value / 1000000.0
+        else:
+            for i in xrange(1, len(self._during_samples)):
+                value += (
+                    (
+                        samples[i].timestamp -
+                        samples[i - 1].timestamp
+                    ).total_seconds() *
+                    (
+                        samples[i].counter_volume +
+                        samples[i - 1].counter_volume
+                    )
                 )
-            )
         value = value / 2
         # Value is in unit seconds. convert to unit hours.
         self.value = seconds_to_hours(value)
@@ -277,42 +407,7 @@ class Reading:
         This function will step backward from the end of the sample list
         looking for the last non deleted status sample.
         """
-        delete_status = ['deleting', 'deleted']
-        status_keys = ['state', 'status']
-        samples = self._during_samples
-
-        # If no samples, return early
-        if not samples:
-            self.metadata = None
-            return
-
-        metadata = None
-        # Check if sample even has status keys going by last sample.
-        has_keys = [
-            key in samples[-1].resource_metadata
-            for key in status_keys
-        ]
-
-        # If sample has keys, loop back from the end.
-        if any(has_keys):
-            start = max(len(samples) - 1, 0)
-            stop = -1
-            step = -1
-            for i in xrange(start, stop, step):
-                # Loop over status fields
-                for key in status_keys:
-                    status = samples[i].resource_metadata.get(key)
-                    if status is not None and status not in delete_status:
-                        metadata = samples[i].resource_metadata
-                        break
-                # Check to see if we found some metadata.
-                if metadata is not None:
-                    break
-
-        # Default to last sample metadata.
-        if metadata is None:
-            metadata = samples[-1].resource_metadata
-        self.metadata = metadata
+        self.metadata = select_metadata(self._during_samples)
 
     def convert(self, conversion):
         """Convert value using function func.
@@ -1,15 +1,25 @@
+import collections
+import copy
 import csv
+import query
 import time
 import utils
 import yaml
 
+from aggregate import needs_metadata
+from aggregate import needs_samples
+from aggregate import SAMPLE_FREE_FIELDS
 from contextlib import contextmanager
 from exc import UnknownFieldFunctionError
 from fields import field_function
+from fields import normalize_name
 from fields.reading import image_metadata_field
 from fields.reading import metadata_field
+from fields.reading import metadata_keys
 from log import logging
+from meter import fetch_window
 from meter import Meter
+from reading import STATUS_KEYS
 
 
 logger = logging.getLogger('usage.report')
@@ -23,7 +33,15 @@ class Report:
                  output,
                  max_samples=15000,
                  start=None,
-                 stop=None):
+                 stop=None,
+                 scheduler_options=None,
+                 multi_meter=False,
+                 aggregate=False,
+                 approximate=None,
+                 probe_boundaries=False,
+                 state=None,
+                 epoch_timestamps=False,
+                 engine='python'):
         """Read in report definition from file.
 
         :param client: Ceilometer client
@@ -38,6 +56,28 @@ class Report:
         :type start: Datetime
         :param stop: Stop of report in utc
         :type stop: Datetime
+        :param scheduler_options: Extra keyword arguments for the scheduler.
+        :type scheduler_options: Dict
+        :param multi_meter: Whether to fetch the samples of all items sharing
+            the same filters in one pass.
+        :type multi_meter: Bool
+        :param aggregate: Whether to read meters from grouped statistics
+            when no column needs per sample data.
+        :type aggregate: Bool
+        :param approximate: Seconds per period of approximate gauge readings.
+            Implies aggregate. None for exact readings.
+        :type approximate: Integer|None
+        :param probe_boundaries: Whether to fetch only the report window and
+            count samples outside of it instead of fetching extra samples.
+        :type probe_boundaries: Bool
+        :param state: Last samples of resources from previous runs.
+        :type state: usage.state.BoundaryState
+        :param epoch_timestamps: Whether to keep sample timestamps as
+            integer microseconds since the epoch while reading.
+        :type epoch_timestamps: Bool
+        :param engine: How to compute reading values. One of
+            meter.ENGINES.
+        :type engine: String
         """
         self._definition_filename = definition_filename
         self._definition = None
@@ -46,6 +86,17 @@ class Report:
         self.output = output
         self._headers_written = False
         self.max_samples = max_samples
+        self.scheduler_options = scheduler_options or {}
+        self.multi_meter = multi_meter
+        self.aggregate = aggregate or bool(approximate)
+        self.approximate = approximate
+        self.probe_boundaries = probe_boundaries
+        self.state = state
+        self.epoch_timestamps = epoch_timestamps
+        self.engine = engine
+        self._metadata_keys = self._project_metadata(
+            self._definition.get('columns', [])
+        )
 
         self._client = client
 
@@ -58,6 +109,29 @@ class Report:
         with open(self._definition_filename, 'r') as f:
             self._definition = yaml.safe_load(f)
 
+    def _project_metadata(self, columns):
+        """Get the metadata keys needed by the columns.
+
+        :param columns: Columns in report definition
+        :type columns: List
+        :returns: Set of lowercase metadata keys or None if a column uses a
+            field function that may read any metadata.
+        :rtype: Set|None
+        """
+        keys = set(STATUS_KEYS)
+        for column in columns:
+            func = normalize_name(column.get('func', ''))
+            if func in SAMPLE_FREE_FIELDS:
+                continue
+            column_keys = metadata_keys(func)
+            if column_keys is None:
+                logger.debug(
+                    'Keeping all metadata for field function {}'.format(func)
+                )
+                return None
+            keys.update(column_keys)
+        return keys
+
     def _field_function(self, func, item, reading):
         """Call a field function.
 
@@ -70,9 +144,7 @@ class Report:
         :return: Result of the field function.
         :rtype: String|Numeric|None
         """
-        # Transform function name into a python compatible function name.
-        # TODO - Move towards more sophisticated function mapping.
-        func = func.lower().replace(' ', '_').replace('.', '_')
+        func = normalize_name(func)
         try:
             return field_function(func, self._definition, item, reading)
         except UnknownFieldFunctionError as uffe:
@@ -98,23 +170,188 @@ class Report:
             writer.writeheader()
         yield writer
 
+    def _item_key(self, item):
+        """Get the key of the samples an item reads.
+
+        Items with the same key read the same samples.
+
+        :param item: Item in report definition
+        :type item: Dict
+        :returns: (meter name, filters key) tuple
+        :rtype: Tuple
+        """
+        return (
+            item['meter_name'],
+            query._query_string(query.filters(item.get('filters')))
+        )
+
+    def _groups(self, items):
+        """Group items by filters for fetching them together.
+
+        :param items: Items in report definition
+        :type items: List
+        :returns: Mapping of filters key to list of items
+        :rtype: Dict
+        """
+        groups = {}
+        for item in items:
+            key = self._item_key(item)[1]
+            groups.setdefault(key, []).append(item)
+        return groups
+
+    def _prefetch(self, group):
+        """Fetch the samples of a group of items sharing filters.
+
+        The samples are fetched together in shared time chunks and then
+        demultiplexed by meter.
+
+        :param group: Items in report definition with the same filters
+        :type group: List
+        :returns: Mapping of (meter name, filters key) to list of samples
+        :rtype: Dict
+        """
+        key = self._item_key(group[0])[1]
+        fetch_start, fetch_stop = fetch_window(
+            self._start, self._stop, self.probe_boundaries
+        )
+        schedule = query.MeterSetScheduler(
+            self._client,
+            [item['meter_name'] for item in group],
+            fetch_start,
+            fetch_stop,
+            q=query.filters(group[0].get('filters')),
+            max_samples=self.max_samples,
+            **self.scheduler_options
+        )
+        return {
+            (meter_name, key): meter_samples
+            for meter_name, meter_samples in schedule.demultiplex().items()
+        }
+
+    def _meter(self, item):
+        """Create the meter of an item.
+
+        :param item: Item in report definition
+        :type item: Dict
+        :returns: Meter
+        :rtype: meter.Meter
+        """
+        return Meter(
+            self._client,
+            item['meter_name'],
+            max_samples=self.max_samples,
+            scheduler_options=self.scheduler_options,
+            probe_boundaries=self.probe_boundaries,
+            state=self.state,
+            metadata_keys=self._metadata_keys,
+            epoch_timestamps=self.epoch_timestamps,
+            engine=self.engine
+        )
+
+    def _read(self, item, prefetched=None, groups=None):
+        """Read the meter of an item.
+
+        With prefetching, the group of the item is fetched when its first
+        item is read. Samples are released once the item's meter is read.
+
+        :param item: Item in report definition
+        :type item: Dict
+        :param prefetched: Samples from _prefetch not yet read
+        :type prefetched: Dict|None
+        :param groups: Groups from _groups
+        :type groups: Dict|None
+        :returns: Readings. One reading per resource/meter pair
+        :rtype: Generator
+        """
+        m = self._meter(item)
+        if prefetched is not None:
+            key = self._item_key(item)
+            if key not in prefetched:
+                prefetched.update(self._prefetch(groups[key[1]]))
+            return m.read_batches(
+                [prefetched.pop(key)],
+                start=self._start,
+                stop=self._stop,
+                q=query.filters(item.get('filters'))
+            )
+        return m.read(
+            start=self._start,
+            stop=self._stop,
+            q=query.filters(item.get('filters'))
+        )
+
+    def _aggregate(self, items, keys, metadata=False):
+        """Read the meters of items from grouped statistics where possible.
+
+        :param items: Items in report definition
+        :type items: List
+        :param keys: Item keys from _item_key
+        :type keys: List
+        :param metadata: Whether readings need metadata
+        :type metadata: Bool
+        :returns: Mapping of item key to list of readings
+        :rtype: Dict
+        """
+        aggregated = {}
+        for item, key in zip(items, keys):
+            if key in aggregated:
+                continue
+            m = self._meter(item)
+            aggregated[key] = m.aggregate(
+                start=self._start,
+                stop=self._stop,
+                q=query.filters(item.get('filters')),
+                period=self.approximate,
+                metadata=metadata
+            )
+        return {
+            key: readings for key, readings in aggregated.items()
+            if readings is not None
+        }
+
     def run(self):
-        """Run the report."""
+        """Run the report.
+
+        Items reading the same meter with the same filters share one read.
+        Their readings are kept until the last such item is written and
+        each item converts its own copy of every reading.
+        """
         report_start = time.time()
         columns = self._definition.get('columns', [])
         items = self._definition.get('items', [])
 
+        keys = [self._item_key(item) for item in items]
+        remaining = collections.Counter(keys)
+        shared = {}
+        if self.aggregate and not needs_samples(columns):
+            shared = self._aggregate(
+                items, keys, metadata=needs_metadata(columns)
+            )
+
+        prefetched = groups = None
+        if self.multi_meter:
+            prefetched = {}
+            groups = self._groups([
+                item for item, key in zip(items, keys) if key not in shared
+            ])
+
         with self.csv_scope() as csv_scope:
             # Iterate over items in definition.
-            for item in items:
-                m = Meter(
-                    self._client,
-                    item['meter_name'],
-                    max_samples=self.max_samples
-                )
-                # Meter.read() returns a generator that yields readings.
-                # One reading per resource/meter pair
-                for reading in m.read(start=self._start, stop=self._stop):
+            for item, key in zip(items, keys):
+                remaining[key] -= 1
+                is_shared = key in shared or remaining[key] > 0
+                if key in shared:
+                    readings = shared[key]
+                else:
+                    readings = self._read(item, prefetched, groups)
+                    if remaining[key] > 0:
+                        readings = list(readings)
+                        shared[key] = readings
+                if remaining[key] == 0:
+                    shared.pop(key, None)
+                for reading in readings:
+                    if is_shared:
+                        reading = copy.copy(reading)
                     reading.convert(item.get('conversion'))
                     line_item = {
                         c.get('name'):
@@ -0,0 +1,149 @@
+"""
+Module for lightweight sample records.
+"""
+
+# Sample attributes used by this tool.
+FIELDS = (
+    'message_id',
+    'resource_id',
+    'project_id',
+    'meter',
+    'counter_name',
+    'counter_type',
+    'counter_volume',
+    'timestamp',
+    'resource_metadata'
+)
+
+# Identifier strings shared by many samples. Each distinct value is kept
+# once. The builtin intern only accepts byte strings, and json gives
+# unicode. Cleared when it reaches _IDENTIFIERS_SIZE so identifiers of
+# earlier reads are not kept for the life of the process.
+_IDENTIFIERS = {}
+_IDENTIFIERS_SIZE = 100000
+
+
+def _intern(value):
+    """Get the shared copy of an identifier string.
+
+    :param value: Identifier
+    :type value: String|None
+    :returns: Equal identifier shared with other samples
+    :rtype: String|None
+    """
+    if value is None:
+        return None
+    try:
+        return _IDENTIFIERS[value]
+    except KeyError:
+        pass
+    if len(_IDENTIFIERS) >= _IDENTIFIERS_SIZE:
+        _IDENTIFIERS.clear()
+    _IDENTIFIERS[value] = value
+    return value
+
+
+class Sample(object):
+    """Compact sample with only the fields used by this tool.
+
+    Slots avoid a dict per sample. Resource, project, meter and type
+    identifiers are interned.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self,
+                 message_id=None,
+                 resource_id=None,
+                 project_id=None,
+                 meter=None,
+                 counter_name=None,
+                 counter_type=None,
+                 counter_volume=None,
+                 timestamp=None,
+                 resource_metadata=None,
+                 **kwargs):
+        """Init the sample.
+
+        Other sample attributes in kwargs are ignored.
+
+        :param message_id: Id of the sample
+        :type message_id: String
+        :param resource_id: Id of the resource
+        :type resource_id: String
+        :param project_id: Id of the project
+        :type project_id: String
+        :param meter: Name of the meter
+        :type meter: String
+        :param counter_name: Name of the counter
+        :type counter_name: String
+        :param counter_type: Type of the counter
+        :type counter_type: String
+        :param counter_volume: Volume of the sample
+        :type counter_volume: Numeric
+        :param timestamp: Timestamp of the sample
+        :type timestamp: String|Datetime|Integer
+        :param resource_metadata: Resource metadata
+        :type resource_metadata: Dict
+        """
+        self.message_id = message_id
+        self.resource_id = _intern(resource_id)
+        self.project_id = _intern(project_id)
+        self.meter = _intern(meter)
+        self.counter_name = _intern(counter_name)
+        self.counter_type = _intern(counter_type)
+        self.counter_volume = counter_volume
+        self.timestamp = timestamp
+        self.resource_metadata = resource_metadata
+
+    def __copy__(self):
+        """Copy the sample.
+
+        :returns: Sample with the same field values
+        :rtype: Sample
+        """
+        copied = Sample.__new__(Sample)
+        for field in FIELDS:
+            setattr(copied, field, getattr(self, field))
+        return copied
+
+    @classmethod
+    def from_resource(cls, resource):
+        """Create a sample from a ceilometer client sample.
+
+        :param resource: Sample returned by the ceilometer client
+        :type resource: ceilometerclient.v2.samples.OldSample
+        :returns: Sample
+        :rtype: Sample
+        """
+        return cls(**{
+            field: getattr(resource, field, None) for field in FIELDS
+        })
+
+    @classmethod
+    def from_query_sample(cls, resource):
+        """Create a sample from a ceilometer complex query sample.
+
+        :param resource: Sample returned by the complex query api
+        :type resource: ceilometerclient.v2.samples.Sample
+        :returns: Sample
+        :rtype: Sample
+        """
+        return cls(
+            message_id=resource.id,
+            resource_id=resource.resource_id,
+            project_id=resource.project_id,
+            meter=resource.meter,
+            counter_name=resource.meter,
+            counter_type=resource.type,
+            counter_volume=resource.volume,
+            timestamp=resource.timestamp,
+            resource_metadata=resource.metadata
+        )
+
+    def to_dict(self):
+        """Get the sample as a dictionary.
+
+        :returns: Sample fields
+        :rtype: Dict
+        """
+        return {field: getattr(self, field) for field in FIELDS}
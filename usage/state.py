@@ -0,0 +1,154 @@
+"""
+Module for remembering where resources were at the end of a run.
+
+The last sample timestamp of each resource is stored per meter and query in
+a small json file. A run that starts at or shortly after where the previous
+run stopped can tell which resources existed before its start by fetching
+only the samples since the previous stop.
+"""
+import datetime
+import json
+import os
+import utils
+
+from log import logging
+
+logger = logging.getLogger('usage.state')
+
+
+class BoundaryState(object):
+    """Persisted last sample timestamps per meter and resource."""
+    def __init__(self, filename, lookback):
+        """Init the state and load any existing state.
+
+        :param filename: Name of the json file holding the state.
+        :type filename: String
+        :param lookback: How long before a window a sample counts as the
+            resource existing before it.
+        :type lookback: datetime.timedelta
+        """
+        self.filename = os.path.abspath(filename)
+        self.lookback = lookback
+        self.state = {}
+        self.load()
+
+    def load(self):
+        """Load state from file if it exists."""
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self.state = json.load(f)
+        except Exception:
+            logger.exception(
+                'Unable to load state from {}'.format(self.filename)
+            )
+            self.state = {}
+
+    def save(self):
+        """Save state to file."""
+        directory = os.path.dirname(self.filename)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = '{}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def previous_stop(self, key, start):
+        """Get the stop of the previous run if it can be used for start.
+
+        The previous run must have stopped at or before start and within
+        the lookback of it. Windows from the current time, like the last
+        hour, rarely start exactly where the previous run stopped.
+
+        :param key: Meter and query key
+        :type key: String
+        :param start: Start of the window
+        :type start: datetime.datetime
+        :returns: Previous stop or None if unusable
+        :rtype: datetime.datetime|None
+        """
+        entry = self.state.get(key)
+        if not entry:
+            return None
+        stop = _parse_time(entry['stop'])
+        if stop > start or start - stop >= self.lookback:
+            return None
+        return stop
+
+    def existed_before(self, key, start):
+        """Get the resources known to have existed before start.
+
+        These are the resources seen by the previous run within the
+        lookback of start. Resources with samples between the previous stop
+        and start are not included.
+
+        :param key: Meter and query key
+        :type key: String
+        :param start: Start of the window
+        :type start: datetime.datetime
+        :returns: Set of resource ids or None if unknown
+        :rtype: Set|None
+        """
+        if self.previous_stop(key, start) is None:
+            return None
+        lower = start - self.lookback
+        return set(
+            resource_id
+            for resource_id, timestamp
+            in self.state[key]['resources'].iteritems()
+            if _parse_time(timestamp) > lower
+        )
+
+    def record(self, key, stop, samples):
+        """Record the last sample of each resource at or before stop.
+
+        Resources from the previous run that had no samples this run are
+        kept until they are older than the lookback.
+
+        :param key: Meter and query key
+        :type key: String
+        :param stop: End of the window
+        :type stop: datetime.datetime
+        :param samples: Samples with datetime or epoch microsecond
+            timestamps
+        :type samples: List
+        """
+        resources = {}
+        entry = self.state.get(key)
+        if entry:
+            resources.update(entry['resources'])
+        for s in samples:
+            sample_time = s.timestamp
+            if not isinstance(sample_time, datetime.datetime):
+                sample_time = utils.from_epoch_micros(sample_time)
+            if sample_time > stop:
+                continue
+            previous = resources.get(s.resource_id)
+            if previous is None or _parse_time(previous) < sample_time:
+                resources[s.resource_id] = sample_time.isoformat()
+        lower = stop - self.lookback
+        self.state[key] = {
+            'stop': stop.isoformat(),
+            'resources': {
+                resource_id: timestamp
+                for resource_id, timestamp in resources.iteritems()
+                if _parse_time(timestamp) > lower
+            }
+        }
+        logger.debug('Recorded {} resources of {}'.format(
+            len(self.state[key]['resources']), key
+        ))
+        self.save()
+
+
+def _parse_time(timestamp):
+    """Parse a stored timestamp.
+
+    :param timestamp: Iso8601 timestamp
+    :type timestamp: String
+    :returns: Naive utc datetime
+    :rtype: datetime.datetime
+    """
+    return utils.parse_timestamp(timestamp)
@@ -0,0 +1,147 @@
+"""
+Module for streaming sample lists from the ceilometer api.
+
+Sample lists are requested gzip encoded and parsed into lightweight sample
+records while the response is downloaded. Incremental parsing needs ijson.
+Without it the decompressed body is parsed in one piece.
+
+Both ceilometer client types are supported. The legacy http client returns
+the streamed response as is. The keystone session client parses json
+bodies in its request method, so its requests are sent through the plain
+keystoneauth adapter instead.
+"""
+import decimal
+import json
+
+from ceilometerclient import exc
+from ceilometerclient.v2 import options
+from log import logging
+from sample import Sample
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from keystoneauth1 import adapter
+except ImportError:
+    adapter = None
+
+logger = logging.getLogger('usage.stream')
+
+# Bytes read from the response at a time.
+_CHUNK_SIZE = 64 * 1024
+
+
+class _ResponseReader(object):
+    """File like reader over the decoded content of a streamed response."""
+    def __init__(self, response, chunk_size=_CHUNK_SIZE):
+        """Init the reader.
+
+        :param response: Streamed response
+        :type response: requests.Response
+        :param chunk_size: Bytes to read at a time
+        :type chunk_size: Integer
+        """
+        self._chunks = response.iter_content(chunk_size)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        """Read up to size bytes.
+
+        :param size: Number of bytes. Negative reads everything.
+        :type size: Integer
+        :returns: Bytes
+        :rtype: String
+        """
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _plain(value):
+    """Convert decimals from ijson into the numbers json would give.
+
+    :param value: Parsed json value
+    :type value: Object
+    :returns: Value without decimals
+    :rtype: Object
+    """
+    if isinstance(value, decimal.Decimal):
+        if value.as_tuple().exponent < 0:
+            return float(value)
+        return int(value)
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.iteritems()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _get(http_client, url, headers):
+    """Send a streamed get request without parsing the body.
+
+    :param http_client: Http client of the ceilometer client
+    :type http_client: ceilometerclient.client.SessionClient|
+        ceilometerclient.apiclient.client.BaseClient
+    :param url: Url relative to the metering endpoint
+    :type url: String
+    :param headers: Request headers
+    :type headers: Dict
+    :returns: Streamed response
+    :rtype: requests.Response
+    """
+    if adapter is None or \
+            not isinstance(http_client, adapter.LegacyJsonAdapter):
+        return http_client.get(url, headers=headers, stream=True)
+    # Skip the json parsing of LegacyJsonAdapter.request and raise client
+    # errors like the session client does.
+    response = adapter.Adapter.request(
+        http_client, url, 'GET', headers=headers, stream=True,
+        raise_exc=False
+    )
+    if response.status_code >= 400:
+        error = exc.from_response(response, response.content)
+        response.close()
+        raise error
+    return response
+
+
+def list_samples(client, meter_name, q=None, limit=None):
+    """List samples like client.samples.list without resource objects.
+
+    :param client: Ceilometer client
+    :type client: ceilometerclient.v2.client.Client
+    :param meter_name: Name of the meter
+    :type meter_name: String
+    :param q: List of query filters
+    :type q: List
+    :param limit: Maximum number of samples
+    :type limit: Integer
+    :returns: Samples, newest first
+    :rtype: List
+    """
+    params = ['limit={}'.format(limit)] if limit else None
+    url = options.build_url('/v2/meters/{}'.format(meter_name), q, params)
+    response = _get(
+        client.http_client, url, headers={'Accept-Encoding': 'gzip'}
+    )
+    try:
+        if ijson is None:
+            items = json.loads(response.content)
+        else:
+            items = (
+                _plain(item)
+                for item in ijson.items(_ResponseReader(response), 'item')
+            )
+        return [Sample(**item) for item in items]
+    finally:
+        response.close()
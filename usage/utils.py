@@ -1,5 +1,6 @@
 import datetime
 import iso8601
+import re
 
 
 def mtd_range():
@@ -55,3 +56,97 @@ def normalize_time(timestamp):
     if offset is None:
         return timestamp
     return timestamp.replace(tzinfo=None) - offset
+
+
+# Ceilometer timestamps look like 2016-07-01T00:00:00.123456 with an
+# optional utc offset.
+_TIMESTAMP_RE = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?'
+    r'(?:Z|[+-]00:?00)?$'
+)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Parsed timestamps by string. Cleared when they reach _CACHE_SIZE.
+_CACHE = {}
+_EPOCH_CACHE = {}
+_CACHE_SIZE = 100000
+
+
+def parse_timestamp(timestamp):
+    """Parse a timestamp string into a naive utc datetime.
+
+    Timestamps in the usual ceilometer format are parsed with a regular
+    expression. Others fall back to parse_datetime and normalize_time.
+    Results are cached since timestamps often repeat exactly.
+
+    :param timestamp: Iso8601 timestamp
+    :type timestamp: String
+    :return: Naive utc datetime
+    :rtype: datetime.datetime
+    """
+    try:
+        return _CACHE[timestamp]
+    except KeyError:
+        pass
+    match = _TIMESTAMP_RE.match(timestamp)
+    if match:
+        year, month, day, hour, minute, second, fraction = match.groups()
+        parsed = datetime.datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            int(fraction.ljust(6, '0')) if fraction else 0
+        )
+    else:
+        parsed = normalize_time(parse_datetime(timestamp))
+    if len(_CACHE) >= _CACHE_SIZE:
+        _CACHE.clear()
+    _CACHE[timestamp] = parsed
+    return parsed
+
+
+def to_epoch_micros(timestamp):
+    """Convert a naive utc datetime to microseconds since the epoch.
+
+    :param timestamp: Naive utc datetime
+    :type timestamp: datetime.datetime
+    :return: Microseconds since the epoch
+    :rtype: Integer
+    """
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def from_epoch_micros(micros):
+    """Convert microseconds since the epoch to a naive utc datetime.
+
+    :param micros: Microseconds since the epoch
+    :type micros: Integer
+    :return: Naive utc datetime
+    :rtype: datetime.datetime
+    """
+    return _EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def parse_epoch_micros(timestamp):
+    """Parse a timestamp string into microseconds since the epoch.
+
+    :param timestamp: Iso8601 timestamp
+    :type timestamp: String
+    :return: Microseconds since the epoch
+    :rtype: Integer
+    """
+    try:
+        return _EPOCH_CACHE[timestamp]
+    except KeyError:
+        pass
+    micros = to_epoch_micros(parse_timestamp(timestamp))
+    if len(_EPOCH_CACHE) >= _CACHE_SIZE:
+        _EPOCH_CACHE.clear()
+    _EPOCH_CACHE[timestamp] = micros
+    return micros